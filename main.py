@@ -1,17 +1,34 @@
 import shlex
 import sys
 
-from valutatrade_hub.cli.interface import build_parser, execute
-from valutatrade_hub.logging_config import configure_logging
+from valutatrade_hub.cli.client import DaemonError, forward
 
 
 def main(argv=None) -> None:
-    configure_logging()
-    parser = build_parser()
-
     if argv is None:
         argv = sys.argv[1:]
 
+    if argv:
+        # Запущен демон (valutatrade serve) — команда выполняется в нём, без импорта CLI и загрузки данных.
+        try:
+            reply = forward(argv)
+        except DaemonError as e:
+            print(f"Ошибка демона: {e}", file=sys.stderr)
+            sys.exit(1)
+        if reply is not None:
+            sys.stdout.write(reply.get("stdout") or "")
+            sys.stderr.write(reply.get("stderr") or "")
+            code = reply.get("code")
+            if code:
+                sys.exit(code)
+            return
+
+    from valutatrade_hub.cli.interface import build_parser, execute
+    from valutatrade_hub.logging_config import configure_logging
+
+    configure_logging()
+    parser = build_parser()
+
     if not argv:
         while True:
             try:
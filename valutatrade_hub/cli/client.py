@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import json
+import os
+import socket
+from pathlib import Path
+
+from valutatrade_hub.infra.settings import SettingsLoader
+
+# Команды, которые сами читают stdin/пишут в stdout или запускают серверы, выполняются локально.
+LOCAL_COMMANDS = frozenset({"serve", "run-script", "quote-server"})
+CONNECT_TIMEOUT = 0.2
+
+
+class DaemonError(Exception):
+    pass
+
+
+def socket_path() -> Path:
+    env = os.environ.get("VALUTATRADE_SOCKET")
+    if env and env.strip():
+        return Path(env.strip())
+    return Path(SettingsLoader().get("DAEMON_SOCKET"))
+
+
+def call(method: str, params: dict | None = None, path: Path | None = None, timeout: float | None = None) -> object:
+    # Один запрос JSON-RPC 2.0 — одна строка JSON в каждую сторону.
+    # OSError — демон не запущен или недоступен; DaemonError — демон вернул ошибку.
+    if not hasattr(socket, "AF_UNIX"):
+        raise OSError("unix sockets are not supported")
+    request = {"jsonrpc": "2.0", "id": 1, "method": method, "params": params or {}}
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(CONNECT_TIMEOUT)
+        sock.connect(str(path or socket_path()))
+        sock.settimeout(timeout)
+        sock.sendall(json.dumps(request, ensure_ascii=False).encode("utf-8") + b"\n")
+        with sock.makefile("rb") as fh:
+            line = fh.readline()
+    if not line:
+        raise DaemonError("пустой ответ демона")
+    response = json.loads(line)
+    error = response.get("error")
+    if error is not None:
+        raise DaemonError(error.get("message") if isinstance(error, dict) else str(error))
+    return response.get("result")
+
+
+def forward(argv: list[str]) -> dict | None:
+    # Выполнить команду в запущенном демоне. None — демона нет, команду нужно выполнить в процессе.
+    if argv and argv[0] in LOCAL_COMMANDS:
+        return None
+    try:
+        result = call("execute", {"argv": list(argv), "cwd": os.getcwd()})
+    except OSError:
+        return None
+    return result if isinstance(result, dict) else None
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import contextlib
+import io
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import threading
+from pathlib import Path
+from typing import Callable
+
+# Ошибки JSON-RPC 2.0.
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+SERVER_ERROR = -32000
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            response = self.server.dispatch(line)
+            self.wfile.write(json.dumps(response, ensure_ascii=False).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+class TradingDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    # Долгоживущий процесс: модули, настройки, кеши файлов, матрица курсов и рейтинги остаются
+    # прогретыми между командами. Соединения обслуживаются потоками, а сами команды — строго по
+    # одной под общей блокировкой: сессия у CLI одна на каталог данных, и execute рассчитан на
+    # последовательный вызов. Состояние на диске остаётся общим с обычным CLI — каждая команда
+    # пишет сразу, как и при запуске без демона.
+    daemon_threads = True
+
+    def __init__(self, path: Path, run: Callable[[list[str]], tuple[int, str, str]]):
+        self.path = Path(path)
+        self.run = run
+        self.logger = logging.getLogger("valutatrade.daemon")
+        self._lock = threading.Lock()
+        self._prepare_socket()
+        super().__init__(str(self.path), _Handler)
+        os.chmod(self.path, 0o600)
+
+    def _prepare_socket(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if not self.path.exists():
+            return
+        # Файл сокета от упавшего демона удаляем, к живому — не подключаемся вторым.
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(str(self.path))
+            except OSError:
+                self.path.unlink()
+                return
+        raise RuntimeError(f"демон уже запущен: {self.path}")
+
+    def dispatch(self, line: bytes) -> dict:
+        try:
+            request = json.loads(line)
+        except Exception:
+            return _error(None, PARSE_ERROR, "parse error")
+        if not isinstance(request, dict) or not isinstance(request.get("method"), str):
+            return _error(None, INVALID_REQUEST, "invalid request")
+        req_id = request.get("id")
+        params = request.get("params") or {}
+        if not isinstance(params, dict):
+            return _error(req_id, INVALID_PARAMS, "params must be an object")
+
+        method = request["method"]
+        if method == "ping":
+            return _result(req_id, {"pid": os.getpid()})
+        if method == "shutdown":
+            threading.Thread(target=self.shutdown, daemon=True).start()
+            return _result(req_id, True)
+        if method != "execute":
+            return _error(req_id, METHOD_NOT_FOUND, f"unknown method '{method}'")
+
+        argv = params.get("argv")
+        cwd = params.get("cwd")
+        if not isinstance(argv, list) or not all(isinstance(a, str) for a in argv):
+            return _error(req_id, INVALID_PARAMS, "argv must be a list of strings")
+        if cwd is not None and (not isinstance(cwd, str) or not os.path.isdir(cwd)):
+            return _error(req_id, INVALID_PARAMS, "cwd must be an existing directory")
+        with self._lock:
+            try:
+                # Относительные пути в аргументах (batch, valuate-all --out) — от каталога клиента.
+                with contextlib.chdir(cwd or os.getcwd()):
+                    code, out, err = self.run(argv)
+            except Exception as e:
+                self.logger.exception("daemon command failed")
+                return _error(req_id, SERVER_ERROR, f"{type(e).__name__}: {e}")
+        return _result(req_id, {"code": code, "stdout": out, "stderr": err})
+
+    def serve(self) -> None:
+        stop = lambda *_: threading.Thread(target=self.shutdown, daemon=True).start()  # noqa: E731
+        previous = signal.signal(signal.SIGTERM, stop)
+        self.logger.info(f"Daemon started socket={self.path} pid={os.getpid()}")
+        try:
+            self.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            signal.signal(signal.SIGTERM, previous)
+            self.server_close()
+            with contextlib.suppress(FileNotFoundError):
+                self.path.unlink()
+            self.logger.info("Daemon stopped")
+
+
+def _result(req_id, result) -> dict:
+    return {"jsonrpc": "2.0", "id": req_id, "result": result}
+
+
+def _error(req_id, code: int, message: str) -> dict:
+    return {"jsonrpc": "2.0", "id": req_id, "error": {"code": code, "message": message}}
+
+
+def capture(fn: Callable[[], str]) -> tuple[int, str, str]:
+    # Выполнить команду, собрав то, что она и argparse печатают сами (usage, ошибки разбора).
+    out = io.StringIO()
+    err = io.StringIO()
+    code = 0
+    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+        try:
+            msg = fn()
+            if msg is not None:
+                print(msg)
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    return code, out.getvalue(), err.getvalue()
@@ -2,20 +2,43 @@ import argparse
 import hashlib
 import json
 import logging
+import os
 import secrets
+import shlex
+import sys
 from datetime import datetime
 from pathlib import Path
+from typing import Iterable, TextIO
 
 import valutatrade_hub.parser_service.storage as parser_storage
+from valutatrade_hub.cli.client import LOCAL_COMMANDS
+from valutatrade_hub.cli.client import socket_path as client_socket_path
+from valutatrade_hub.cli.daemon import TradingDaemon, capture
 from valutatrade_hub.core.exceptions import ApiRequestError, CurrencyNotFoundError, InsufficientFundsError
+from valutatrade_hub.core.leaderboard import get_leaderboard as uc_get_leaderboard
+from valutatrade_hub.core.rates import get_rate_matrix
 from valutatrade_hub.core.usecases import buy as uc_buy
 from valutatrade_hub.core.usecases import cash_out_usd as uc_cash_out_usd
 from valutatrade_hub.core.usecases import deposit_usd as uc_deposit_usd
+from valutatrade_hub.core.usecases import execute_batch as uc_execute_batch
+from valutatrade_hub.core.usecases import get_portfolio as uc_get_portfolio
 from valutatrade_hub.core.usecases import get_rate as uc_get_rate
+from valutatrade_hub.core.usecases import get_trade_history as uc_get_trade_history
 from valutatrade_hub.core.usecases import sell as uc_sell
+from valutatrade_hub.core.valuation import valuate_all as uc_valuate_all
+from valutatrade_hub.infra.database import get_database
+from valutatrade_hub.infra.files import ConcurrentUpdateError
+from valutatrade_hub.infra.repositories import (
+    flush_repositories,
+    get_repositories,
+    json_repositories,
+    set_repositories,
+    write_back_repositories,
+)
 from valutatrade_hub.infra.settings import SettingsLoader
 from valutatrade_hub.parser_service.api_clients import CoinGeckoClient, ExchangeRateApiClient
 from valutatrade_hub.parser_service.config import ParserConfig
+from valutatrade_hub.parser_service.quote_server import run_quote_server
 from valutatrade_hub.parser_service.updater import ClientSpec, RatesUpdater
 
 SETTINGS = SettingsLoader()
@@ -29,43 +52,20 @@ def _data_dir() -> Path:
     return _project_root() / "data"
 
 
-def _session_path() -> Path:
-    return _data_dir() / "session.json"
-
-
 #def _rates_path() -> Path:
 #    return _data_dir() / "rates.json"
 
 
-def _read_json_list(path: Path) -> list:
-    if not path.exists():
-        path.parent.mkdir(parents=True, exist_ok=True)
-        path.write_text("[]", encoding="utf-8")
-        return []
-    text = path.read_text(encoding="utf-8").strip()
-    if not text:
-        return []
-    data = json.loads(text)
-    if isinstance(data, list):
-        return data
-    raise ValueError("json is not a list")
+def _read_session() -> dict:
+    return get_repositories().sessions.get()
 
 
-def _read_json_dict(path: Path) -> dict:
-    if not path.exists():
-        return {}
-    text = path.read_text(encoding="utf-8").strip()
-    if not text:
-        return {}
-    data = json.loads(text)
-    if isinstance(data, dict):
-        return data
-    return {}
+def _write_session(session: dict) -> None:
+    get_repositories().sessions.set(session)
 
 
-def _write_json(path: Path, data) -> None:
-    path.parent.mkdir(parents=True, exist_ok=True)
-    path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+def _find_user(username: str) -> dict | None:
+    return get_repositories().users.get_by_username(username)
 
 
 def _hash_password(password: str, salt: str) -> str:
@@ -97,40 +97,15 @@ def register(username: str, password: str) -> str:
         return "Пароль должен быть не короче 4 символов"
 
     username = username.strip()
-    users_path = _data_dir() / "users.json"
-    portfolios_path = _data_dir() / "portfolios.json"
-
-    users = _read_json_list(users_path)
-    for u in users:
-        if isinstance(u, dict) and u.get("username") == username:
-            return f"Имя пользователя '{username}' уже занято"
-
-    max_id = 0
-    for u in users:
-        if isinstance(u, dict):
-            uid = u.get("user_id")
-            if isinstance(uid, int) and uid > max_id:
-                max_id = uid
-    user_id = max_id + 1
-
     salt = secrets.token_urlsafe(8)
     hashed_password = _hash_password(password, salt)
     registration_date = datetime.now().replace(microsecond=0).isoformat()
 
-    users.append(
-        {
-            "user_id": user_id,
-            "username": username,
-            "hashed_password": hashed_password,
-            "salt": salt,
-            "registration_date": registration_date,
-        }
-    )
-    _write_json(users_path, users)
-
-    portfolios = _read_json_list(portfolios_path)
-    portfolios.append({"user_id": user_id, "wallets": {"USD": {"balance": 0.0}}})
-    _write_json(portfolios_path, portfolios)
+    repos = get_repositories()
+    user = repos.users.create(username, hashed_password, salt, registration_date)
+    if user is None:
+        return f"Имя пользователя '{username}' уже занято"
+    repos.portfolios.save({"user_id": user["user_id"], "wallets": {"USD": {"balance": 0.0}}})
 
     return f"Пользователь '{username}' зарегистрирован. Войдите: login --username {username} --password ****"
 
@@ -142,15 +117,7 @@ def login(username: str, password: str) -> str:
         raise ValueError("password required")
 
     username = username.strip()
-    users_path = _data_dir() / "users.json"
-    users = _read_json_list(users_path)
-
-    user = None
-    for u in users:
-        if isinstance(u, dict) and u.get("username") == username:
-            user = u
-            break
-
+    user = _find_user(username)
     if user is None:
         return f"Пользователь '{username}' не найден"
 
@@ -171,13 +138,13 @@ def login(username: str, password: str) -> str:
         "username": username,
         "login_date": datetime.now().replace(microsecond=0).isoformat(),
     }
-    _write_json(_session_path(), session)
+    _write_session(session)
 
     return f"Вы вошли как '{username}'"
 
 
 def show_portfolio(base: str = "USD") -> str:
-    session = _read_json_dict(_session_path())
+    session = _read_session()
     username = session.get("username")
     user_id = session.get("user_id")
     if not isinstance(username, str) or not isinstance(user_id, int):
@@ -187,42 +154,16 @@ def show_portfolio(base: str = "USD") -> str:
         base = "USD"
     base = base.strip().upper()
 
-    portfolios_path = _data_dir() / "portfolios.json"
-    portfolios = _read_json_list(portfolios_path)
-
-    portfolio = None
-    for p in portfolios:
-        if isinstance(p, dict) and p.get("user_id") == user_id:
-            portfolio = p
-            break
-
-    wallets = {}
-    if isinstance(portfolio, dict):
-        w = portfolio.get("wallets", {})
-        if isinstance(w, dict):
-            wallets = w
-
-    if portfolio is None:
-        portfolio = {"user_id": user_id, "wallets": {"USD": {"balance": 0.0}}}
-        portfolios.append(portfolio)
-        _write_json(portfolios_path, portfolios)
-
-    elif isinstance(wallets, dict):
-        changed = False
-        if "USD" not in wallets or not isinstance(wallets.get("USD"), dict):
-            wallets["USD"] = {"balance": 0.0}
-            portfolio["wallets"] = wallets
-            changed = True
-        if changed:
-            for i, p in enumerate(portfolios):
-                if isinstance(p, dict) and p.get("user_id") == user_id:
-                    portfolios[i] = portfolio
-                    break
-            _write_json(portfolios_path, portfolios)
+    portfolio = uc_get_portfolio(user_id)
+    wallets = portfolio.get("wallets", {})
 
     if not isinstance(wallets, dict) or not wallets:
         return f"Портфель пользователя '{username}' (база: {base}):\n- USD: 0.00 → 0.00 {base}\n---------------------------------\nИТОГО: 0.00 {base}"
 
+    pairs = _read_rates_cache().get("pairs")
+    if not isinstance(pairs, dict) or not pairs:
+        return "Локальный кеш курсов пуст. Выполните 'update-rates', чтобы загрузить данные."
+
     lines = [f"Портфель пользователя '{username}' (база: {base}):"]
     total_usd = 0.0
 
@@ -239,18 +180,13 @@ def show_portfolio(base: str = "USD") -> str:
 
         c = str(code).strip().upper()
 
-        cache = _read_rates_cache()
-        pairs = cache.get("pairs")
-        if not isinstance(pairs, dict) or not pairs:
-            return "Локальный кеш курсов пуст. Выполните 'update-rates', чтобы загрузить данные."
-
-        r = _convert_to_base(pairs, c, base, pivot="USD")
+        r = _convert_to_base(pairs, c, base)
         if r is None or float(r) <= 0:
             return f"Курс для '{c}' не найден в кеше."
 
         base_value = bal * float(r)
 
-        usd_r = _convert_to_base(pairs, c, "USD", pivot="USD")
+        usd_r = _convert_to_base(pairs, c, "USD")
         if usd_r is None or float(usd_r) <= 0:
             usd_value = 0.0
         else:
@@ -266,11 +202,7 @@ def show_portfolio(base: str = "USD") -> str:
 
         lines.append(f"- {c}: {bal_str}  → {base_value:.2f} {base}")
 
-    pairs = _read_rates_cache().get("pairs")
-    if not isinstance(pairs, dict) or not pairs:
-        return "Локальный кеш курсов пуст. Выполните 'update-rates', чтобы загрузить данные."
-
-    usd_to_base = _convert_to_base(pairs, "USD", base, pivot="USD")
+    usd_to_base = _convert_to_base(pairs, "USD", base)
     if usd_to_base is None or float(usd_to_base) <= 0:
         return f"Курс для 'USD→{base}' не найден в кеше."
 
@@ -282,7 +214,7 @@ def show_portfolio(base: str = "USD") -> str:
 
 
 def buy(currency: str, amount: float) -> str:
-    session = _read_json_dict(_session_path())
+    session = _read_session()
     username = session.get("username")
     user_id = session.get("user_id")
     if not isinstance(username, str) or not isinstance(user_id, int):
@@ -349,7 +281,7 @@ def buy(currency: str, amount: float) -> str:
 
 
 def sell(currency: str, amount: float) -> str:
-    session = _read_json_dict(_session_path())
+    session = _read_session()
     username = session.get("username")
     user_id = session.get("user_id")
     if not isinstance(username, str) or not isinstance(user_id, int):
@@ -416,7 +348,7 @@ def sell(currency: str, amount: float) -> str:
 
 
 def deposit(amount: float) -> str:
-    session = _read_json_dict(_session_path())
+    session = _read_session()
     username = session.get("username")
     user_id = session.get("user_id")
     if not isinstance(username, str) or not isinstance(user_id, int):
@@ -441,7 +373,7 @@ def deposit(amount: float) -> str:
     )
 
 def cash_out(amount: float) -> str:
-    session = _read_json_dict(_session_path())
+    session = _read_session()
     username = session.get("username")
     user_id = session.get("user_id")
     if not isinstance(username, str) or not isinstance(user_id, int):
@@ -476,6 +408,269 @@ def get_rate(from_currency: str, to_currency: str) -> str:
     return f"Курс {fc}→{tc}: {rate:.8f} (обновлено: {updated_at})\nОбратный курс {tc}→{fc}: {inv:.8f}"
 
 
+def import_json() -> str:
+    source = json_repositories()
+    db = get_database()
+    counts = db.import_json(
+        users=list(source.users.iter_all()),
+        portfolios=list(source.portfolios.iter_all()),
+        session=source.sessions.get(),
+        rates_snapshot=source.rates.get_snapshot(),
+        history=list(parser_storage.iter_file_history()),
+        trades=list(source.trades.iter_all()),
+    )
+    return (
+        f"Импорт в SQLite ({db.path}) завершён: пользователей {counts['users']}, кошельков {counts['wallets']}, "
+        f"пар в кеше {counts['pairs']}, новых записей истории {counts['history']}, сделок {counts['trades']}"
+    )
+
+
+def valuate_all(base: str, out: str) -> str:
+    if not isinstance(base, str) or not base.strip():
+        base = "USD"
+    base = base.strip().upper()
+    if not isinstance(out, str) or not out.strip():
+        return "Укажите файл отчёта: --out report.csv"
+
+    pairs = _read_rates_cache().get("pairs")
+    if not isinstance(pairs, dict) or not pairs:
+        return "Локальный кеш курсов пуст. Выполните 'update-rates', чтобы загрузить данные."
+    if base not in get_rate_matrix(pairs):
+        return f"Курс для '{base}' не найден в кеше."
+
+    result = uc_valuate_all(base, Path(out.strip()))
+    lines = [
+        f"Оценено портфелей: {result['accounts']} (база: {base})",
+        f"ИТОГО: {result['total']:,.2f} {base}",
+    ]
+    if result["unpriced"]:
+        lines.append(f"Без курса для части валют: {result['unpriced']} (в отчёте пустое значение)")
+    lines.append(f"Отчёт: {result['path']}")
+    return "\n".join(lines)
+
+
+def leaderboard(base: str, top) -> str:
+    if not isinstance(base, str) or not base.strip():
+        base = "USD"
+    base = base.strip().upper()
+    try:
+        k = int(top) if top not in (None, "") else 10
+    except Exception:
+        return "'top' должен быть положительным целым числом"
+    if k <= 0:
+        return "'top' должен быть положительным целым числом"
+
+    pairs = _read_rates_cache().get("pairs")
+    if not isinstance(pairs, dict) or not pairs:
+        return "Локальный кеш курсов пуст. Выполните 'update-rates', чтобы загрузить данные."
+    if base not in get_rate_matrix(pairs):
+        return f"Курс для '{base}' не найден в кеше."
+
+    rows = uc_get_leaderboard(base, k)
+    if not rows:
+        return f"Нет портфелей для рейтинга (база: {base})."
+
+    users = get_repositories().users
+    lines = [f"Топ-{len(rows)} портфелей (база: {base}):"]
+    for pos, (user_id, value) in enumerate(rows, start=1):
+        user = users.get_by_id(user_id)
+        name = user.get("username") if isinstance(user, dict) else None
+        lines.append(f"{pos}. {name or f'id={user_id}'}: {value:,.2f} {base}")
+    return "\n".join(lines)
+
+
+def _fmt_amount(code: str, value: float) -> str:
+    return f"{value:.4f}" if code in ("BTC", "ETH") else f"{value:.2f}"
+
+
+def trade_history(user: str | None, since: str | None, limit) -> str:
+    if isinstance(user, str) and user.strip():
+        found = _find_user(user.strip())
+        if not isinstance(found, dict):
+            return f"Пользователь '{user.strip()}' не найден"
+        username, user_id = found.get("username"), found.get("user_id")
+    else:
+        session = _read_session()
+        username, user_id = session.get("username"), session.get("user_id")
+        if not isinstance(username, str) or not isinstance(user_id, int):
+            return "Сначала выполните login или укажите --user"
+
+    try:
+        n = int(limit) if limit not in (None, "") else 20
+    except Exception:
+        return "'limit' должен быть положительным целым числом"
+    if n <= 0:
+        return "'limit' должен быть положительным целым числом"
+
+    try:
+        trades = uc_get_trade_history(user_id, since=since, limit=n)
+    except ValueError:
+        return "'since' должен быть датой в формате ISO, например 2026-01-31 или 2026-01-31T12:00:00Z"
+    if not trades:
+        return f"Сделок пользователя '{username}' не найдено."
+
+    lines = [f"Сделки пользователя '{username}':"]
+    for t in trades:
+        code = str(t.get("currency", "USD"))
+        amount = float(t.get("amount", 0.0))
+        line = f"- {t.get('timestamp', '?')} {t.get('action', '?')} {_fmt_amount(code, amount)} {code}"
+        if code != "USD":
+            line += f" по {float(t.get('rate', 0.0)):.2f} {t.get('base', 'USD')}"
+        line += f" ({code}: {_fmt_amount(code, float(t.get('before', 0.0)))} → {_fmt_amount(code, float(t.get('after', 0.0)))})"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def _read_orders(path: Path) -> list:
+    # Заявки в формате JSONL; строка, которая не разбирается, остаётся в пакете и получит ERROR.
+    orders = []
+    with path.open("r", encoding="utf-8") as fh:
+        for line in fh:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                orders.append(json.loads(line))
+            except Exception:
+                orders.append(line)
+    return orders
+
+
+def execute_batch(path: str, best_effort: bool = False) -> str:
+    session = _read_session()
+    username = session.get("username")
+    user_id = session.get("user_id")
+    if not isinstance(username, str) or not isinstance(user_id, int):
+        return "Сначала выполните login"
+
+    if not isinstance(path, str) or not path.strip():
+        return "Укажите файл с заявками (JSONL)"
+    p = Path(path.strip())
+    if not p.is_file():
+        return f"Файл '{p}' не найден"
+
+    orders = _read_orders(p)
+    if not orders:
+        return f"В файле '{p}' нет заявок"
+
+    result = uc_execute_batch(orders, user_id=user_id, username=username, atomic=not best_effort)
+    status = "изменения сохранены" if result["committed"] else "ничего не применено"
+    lines = [f"Пакет из {len(orders)} заявок: выполнено {result['ok']}, ошибок {result['failed']} — {status}"]
+    for r in result["results"]:
+        n = r["index"] + 1
+        if r["result"] == "OK":
+            code = r["currency_code"]
+            lines.append(
+                f"#{n} {r['action']} {_fmt_amount(code, r['amount'])} {code}: OK "
+                f"({code}: {_fmt_amount(code, r['before_balance'])} → {_fmt_amount(code, r['after_balance'])})"
+            )
+        elif r["result"] == "ROLLED_BACK":
+            code = r["currency_code"]
+            lines.append(f"#{n} {r['action']} {_fmt_amount(code, r['amount'])} {code}: отменена")
+        elif r["result"] == "ERROR":
+            lines.append(f"#{n} ERROR: {r['error']}")
+        else:
+            lines.append(f"#{n} SKIPPED")
+    return "\n".join(lines)
+
+
+def run_script(lines: Iterable[str], out: TextIO, flush_every: int | None = None) -> str:
+    # Команды выполняются в одном процессе поверх write-back хранилища: сессия, портфели и снимок
+    # курсов читаются один раз, изменения сбрасываются каждые flush_every команд и в конце.
+    if flush_every is None:
+        flush_every = int(SETTINGS.get("SCRIPT_FLUSH_EVERY", 100))
+    if flush_every <= 0:
+        return "'flush-every' должен быть положительным целым числом"
+
+    parser = build_parser()
+    repos = write_back_repositories(get_repositories())
+    previous = set_repositories(repos)
+    count = 0
+    try:
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.lower() in ("exit", "quit"):
+                break
+            if line.startswith("valutatrade "):
+                line = line[len("valutatrade ") :].strip()
+            try:
+                args = parser.parse_args(shlex.split(line))
+            except SystemExit:
+                continue
+            if args.command == "run-script":
+                out.write("run-script нельзя вызывать из скрипта\n")
+                continue
+            out.write(f"{execute(args)}\n")
+            count += 1
+            if count % flush_every == 0:
+                _flush_script(repos, out)
+    finally:
+        _flush_script(repos, out)
+        set_repositories(previous)
+    return f"Выполнено команд: {count}"
+
+
+def _flush_script(repos, out: TextIO) -> None:
+    try:
+        flush_repositories(repos)
+    except ConcurrentUpdateError as e:
+        out.write(f"{e}\n")
+
+
+def run_script_file(path: str | None, flush_every) -> str:
+    try:
+        n = int(flush_every) if flush_every not in (None, "") else None
+    except Exception:
+        return "'flush-every' должен быть положительным целым числом"
+    if path in (None, "", "-"):
+        return run_script(sys.stdin, sys.stdout, n)
+    p = Path(path)
+    if not p.is_file():
+        return f"Файл '{p}' не найден"
+    with p.open("r", encoding="utf-8") as fh:
+        return run_script(fh, sys.stdout, n)
+
+
+def serve(socket_path: str | None = None) -> str:
+    # Демон выполняет те же команды, что и CLI; парсер собирается один раз на всё время работы.
+    parser = build_parser()
+
+    def run(argv: list[str]) -> tuple[int, str, str]:
+        def one() -> str:
+            args = parser.parse_args(argv)
+            if args.command in LOCAL_COMMANDS:
+                return f"Команду {args.command} нельзя выполнить через демон"
+            return execute(args)
+
+        return capture(one)
+
+    path = Path(socket_path) if socket_path else client_socket_path()
+    try:
+        daemon = TradingDaemon(path, run)
+    except (OSError, RuntimeError) as e:
+        return f"Не удалось запустить демон: {e}"
+    print(f"Демон слушает {path} (pid {os.getpid()})", flush=True)
+    daemon.serve()
+    return "Демон остановлен"
+
+
+def quote_server(host: str | None, port) -> str:
+    host = host.strip() if isinstance(host, str) and host.strip() else str(SETTINGS.get("QUOTE_SERVER_HOST", "127.0.0.1"))
+    try:
+        port = int(port) if port not in (None, "") else int(SETTINGS.get("QUOTE_SERVER_PORT", 8765))
+    except Exception:
+        return "'port' должен быть целым числом от 1 до 65535"
+    if not 0 < port < 65536:
+        return "'port' должен быть целым числом от 1 до 65535"
+    try:
+        run_quote_server(host, port)
+    except OSError as e:
+        return f"Не удалось запустить сервер котировок: {e}"
+    return "Сервер котировок остановлен"
+
+
 def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(prog="valutatrade")
     subparsers = parser.add_subparsers(dest="command")
@@ -529,6 +724,36 @@ def build_parser() -> argparse.ArgumentParser:
     p_show_rates.add_argument("--top", default=None)
     p_show_rates.add_argument("--base", default=None)
 
+    subparsers.add_parser("import-json")
+
+    p_valuate = subparsers.add_parser("valuate-all")
+    p_valuate.add_argument("--base", default="USD")
+    p_valuate.add_argument("--out", default=None)
+
+    p_leaders = subparsers.add_parser("leaderboard")
+    p_leaders.add_argument("--base", default="USD")
+    p_leaders.add_argument("--top", default="10")
+
+    p_history = subparsers.add_parser("history")
+    p_history.add_argument("--user", default=None)
+    p_history.add_argument("--since", default=None)
+    p_history.add_argument("--limit", default="20")
+
+    p_batch = subparsers.add_parser("batch")
+    p_batch.add_argument("path", nargs="?", default=None)
+    p_batch.add_argument("--file", dest="path_opt", default=None)
+    p_batch.add_argument("--best-effort", action="store_true")
+
+    p_script = subparsers.add_parser("run-script")
+    p_script.add_argument("path", nargs="?", default="-")
+    p_script.add_argument("--flush-every", default=None)
+
+    p_serve = subparsers.add_parser("serve")
+    p_serve.add_argument("--socket", default=None)
+
+    p_quotes = subparsers.add_parser("quote-server")
+    p_quotes.add_argument("--host", default=None)
+    p_quotes.add_argument("--port", default=None)
 
     return parser
 
@@ -551,16 +776,7 @@ def _supported_codes_str() -> str:
 
 
 def _read_rates_cache() -> dict:
-    path = Path(SETTINGS.get("RATES_JSON"))
-    if not path.exists():
-        return {}
-    text = path.read_text(encoding="utf-8").strip()
-    if not text:
-        return {}
-    try:
-        data = json.loads(text)
-    except Exception:
-        return {}
+    data = get_repositories().rates.get_snapshot()
     return data if isinstance(data, dict) else {}
 
 
@@ -583,33 +799,8 @@ def _norm_code(code: str) -> str | None:
     return s
 
 
-def _get_pair_rate(pairs: dict, f: str, t: str) -> float | None:
-    key = f"{f}_{t}"
-    val = pairs.get(key)
-    if isinstance(val, dict) and isinstance(val.get("rate"), (int, float)):
-        r = float(val["rate"])
-        return r if r > 0 else None
-    inv = pairs.get(f"{t}_{f}")
-    if isinstance(inv, dict) and isinstance(inv.get("rate"), (int, float)):
-        r = float(inv["rate"])
-        if r > 0:
-            return 1.0 / r
-    return None
-
-
-def _convert_to_base(pairs: dict, from_code: str, target_base: str, pivot: str = "USD") -> float | None:
-    f = from_code
-    b = target_base
-    if f == b:
-        return 1.0
-    if b == pivot:
-        return _get_pair_rate(pairs, f, pivot)
-
-    f_p = _get_pair_rate(pairs, f, pivot)
-    b_p = _get_pair_rate(pairs, b, pivot)
-    if f_p is None or b_p is None or b_p == 0:
-        return None
-    return f_p / b_p
+def _convert_to_base(pairs: dict, from_code: str, target_base: str) -> float | None:
+    return get_rate_matrix(pairs).rate(from_code, target_base)
 
 
 def execute(args) -> str:
@@ -717,6 +908,9 @@ def execute(args) -> str:
                         pairs = 0
                     total_ok += pairs
                     lines.append(f"INFO: Fetching from {name}... OK ({pairs} rates)")
+                elif status == "SKIPPED":
+                    has_errors = True
+                    lines.append(f"WARN: Skipping {name}: {str(item.get('error_message', '')).strip()}")
                 else:
                     has_errors = True
                     msg = str(item.get("error_message", "")).strip()
@@ -774,7 +968,7 @@ def execute(args) -> str:
             if top_n is not None:
                 items = []
                 for c in sorted(crypto_set):
-                    r = _convert_to_base(pairs, c, base, pivot="USD")
+                    r = _convert_to_base(pairs, c, base)
                     if isinstance(r, (int, float)) and float(r) > 0:
                         items.append((c, float(r)))
                 items.sort(key=lambda x: x[1], reverse=True)
@@ -799,14 +993,14 @@ def execute(args) -> str:
                     if f != currency and t != currency:
                         continue
 
-                    r = _convert_to_base(pairs, f, base, pivot="USD") if t == "USD" else None
+                    r = _convert_to_base(pairs, f, base) if t == "USD" else None
                     if t == base and isinstance(obj.get("rate"), (int, float)):
                         r = float(obj["rate"])
                     if r is None:
                         if isinstance(obj.get("rate"), (int, float)) and t == "USD":
                             rr = float(obj["rate"])
                             if rr > 0:
-                                r = _convert_to_base(pairs, f, base, pivot="USD")
+                                r = _convert_to_base(pairs, f, base)
                     if r is None:
                         continue
                     view_rows.append((f"{f}_{base}", float(r)))
@@ -829,7 +1023,7 @@ def execute(args) -> str:
                 f, t = parts[0], parts[1]
                 if t != "USD":
                     continue
-                r = _convert_to_base(pairs, f, base, pivot="USD")
+                r = _convert_to_base(pairs, f, base)
                 if r is None:
                     continue
                 view_rows.append((f"{f}_{base}", float(r)))
@@ -843,6 +1037,30 @@ def execute(args) -> str:
                 lines.append(f"- {k}: {_fmt_rate(r)}")
             return "\n".join(lines)
 
+        if args.command == "import-json":
+            return import_json()
+
+        if args.command == "valuate-all":
+            return valuate_all(args.base, args.out)
+
+        if args.command == "leaderboard":
+            return leaderboard(args.base, args.top)
+
+        if args.command == "history":
+            return trade_history(args.user, args.since, args.limit)
+
+        if args.command == "batch":
+            return execute_batch(_pick_arg(args.path, args.path_opt), best_effort=args.best_effort)
+
+        if args.command == "run-script":
+            return run_script_file(args.path, args.flush_every)
+
+        if args.command == "serve":
+            return serve(args.socket)
+
+        if args.command == "quote-server":
+            return quote_server(args.host, args.port)
+
         raise ValueError("unknown command")
     except InsufficientFundsError as e:
         return str(e)
@@ -850,3 +1068,5 @@ def execute(args) -> str:
         return f"{str(e)}\nПоддерживаемые коды: {_supported_codes_str()}\nПодсказка: get-rate --from USD --to BTC"
     except ApiRequestError as e:
         return f"{str(e)}\nПовторите попытку позже."
+    except ConcurrentUpdateError as e:
+        return str(e)
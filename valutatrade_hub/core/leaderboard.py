@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import heapq
+import math
+import threading
+
+from valutatrade_hub.core.rates import RateMatrix, get_rate_matrix
+from valutatrade_hub.core.valuation import BalanceMatrix
+from valutatrade_hub.infra.repositories import PortfolioRepository, get_repositories
+
+
+class Leaderboard:
+    # Рейтинг портфелей в одной базовой валюте. Стоимости лежат в _values, порядок — в max-куче
+    # (-value, user_id) с ленивым удалением: сделка кладёт новую запись, а старая отбрасывается при
+    # чтении, если не совпадает с _values. Полный пересчёт (одно матричное умножение) — при смене
+    # снимка курсов; балансы перечитываются, когда портфели изменил другой процесс (change_stamp).
+    def __init__(self, base: str, source: PortfolioRepository):
+        self.base = base
+        self.source = source
+        self._balances: dict[int, dict[str, float]] = {}
+        self._values: dict[int, float] = {}
+        self._heap: list[tuple[float, int]] = []
+        self._rates: RateMatrix | None = None
+        self._stamp: object = None
+        self._lock = threading.Lock()
+
+    def _load(self, rates: RateMatrix, stamp: object) -> None:
+        self._stamp = stamp
+        balances: dict[int, dict[str, float]] = {}
+        for user_id, code, bal in self.source.iter_balances():
+            balances.setdefault(user_id, {})[code] = bal
+        self._balances = balances
+        self._rerank(rates)
+
+    def _valuate(self, rows, rates: RateMatrix) -> dict[int, float]:
+        # И полный пересчёт, и одна сделка оцениваются через BalanceMatrix — один и тот же путь.
+        matrix = BalanceMatrix.from_rows(rows)
+        values = matrix.valuate(rates, self.base)
+        user_ids = matrix.user_ids
+        if not isinstance(values, list):
+            user_ids = user_ids.tolist()
+            values = values.tolist()
+        return {u: v for u, v in zip(user_ids, values) if not math.isnan(v)}
+
+    def _rerank(self, rates: RateMatrix) -> None:
+        rows = ((u, c, b) for u, wallets in self._balances.items() for c, b in wallets.items())
+        self._values = self._valuate(rows, rates)
+        self._heap = [(-v, u) for u, v in self._values.items()]
+        heapq.heapify(self._heap)
+        self._rates = rates
+
+    def update(self, user_id: int, wallets: dict[str, float]) -> None:
+        with self._lock:
+            if self._rates is None:
+                return
+            self._balances[user_id] = wallets
+            value = self._valuate(((user_id, c, b) for c, b in wallets.items()), self._rates).get(user_id)
+            if value is None:
+                self._values.pop(user_id, None)
+            else:
+                self._values[user_id] = value
+                heapq.heappush(self._heap, (-value, user_id))
+            # Устаревших записей стало больше живых — пересобираем кучу.
+            if len(self._heap) > 2 * len(self._values) + 64:
+                self._heap = [(-v, u) for u, v in self._values.items()]
+                heapq.heapify(self._heap)
+
+    def top(self, k: int, rates: RateMatrix) -> list[tuple[int, float]]:
+        with self._lock:
+            # Метку берём до чтения балансов: запись, попавшая между ними, перечитается в следующий раз.
+            stamp = self.source.change_stamp()
+            if self._rates is None or stamp is None or stamp != self._stamp:
+                self._load(rates, stamp)
+            elif self._rates is not rates:
+                self._rerank(rates)
+
+            out: list[tuple[int, float]] = []
+            taken: list[tuple[float, int]] = []
+            seen: set[int] = set()
+            while self._heap and len(out) < k:
+                entry = heapq.heappop(self._heap)
+                neg, user_id = entry
+                if user_id in seen or self._values.get(user_id) != -neg:
+                    continue
+                seen.add(user_id)
+                taken.append(entry)
+                out.append((user_id, -neg))
+            for entry in taken:
+                heapq.heappush(self._heap, entry)
+            return out
+
+
+_lock = threading.Lock()
+_boards: dict[str, Leaderboard] = {}
+
+
+def _board(base: str) -> Leaderboard:
+    # Рейтинги привязаны к текущему хранилищу портфелей: после set_repositories() строятся заново.
+    source = get_repositories().portfolios
+    with _lock:
+        board = _boards.get(base)
+        if board is None or board.source is not source:
+            board = _boards[base] = Leaderboard(base, source)
+    return board
+
+
+def get_leaderboard(base: str, top: int) -> list[tuple[int, float]]:
+    snap = get_repositories().rates.get_snapshot()
+    pairs = snap.get("pairs") if isinstance(snap, dict) else None
+    rates = get_rate_matrix(pairs if isinstance(pairs, dict) else {})
+    if base not in rates:
+        raise KeyError(base)
+    return _board(base).top(top, rates)
+
+
+def on_portfolio_changed(user_id: int, wallets: dict) -> None:
+    # Вызывается после каждой успешной сделки; рейтинги, ещё не построенные в этом процессе, не трогаем.
+    balances = {}
+    for code, entry in (wallets or {}).items():
+        bal = entry.get("balance") if isinstance(entry, dict) else None
+        if isinstance(bal, (int, float)):
+            balances[str(code).upper()] = float(bal)
+    with _lock:
+        boards = list(_boards.values())
+    for board in boards:
+        board.update(user_id, balances)
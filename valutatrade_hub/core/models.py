@@ -1,9 +1,11 @@
 from __future__ import annotations
 
 import hashlib
+import math
 from datetime import datetime
 
 from valutatrade_hub.core.exceptions import InsufficientFundsError
+from valutatrade_hub.core.rates import RateMatrix
 
 
 class User:
@@ -207,26 +209,23 @@ class Portfolio:
             raise ValueError("wallet not found")
         return self._wallets[code]
 
-    def get_total_value(self, base_currency: str = "USD") -> float:
+    def get_total_value(self, base_currency: str = "USD", *, rates: RateMatrix) -> float:
+        # Курсы передаёт вызывающий (снимок из хранилища): модель не обращается к инфраструктуре.
         if not isinstance(base_currency, str) or not base_currency.strip():
             raise ValueError("base_currency cannot be empty")
         base = base_currency.strip().upper()
 
-        exchange_rates = {
-            "USD": 1.0,
-            "EUR": 1.07,
-            "BTC": 59300.0,
-            "ETH": 2500.0,
-            "RUB": 0.011,
-        }
+        total = self._wallets[base].balance if base in self._wallets else 0.0
+        codes = [code for code in self._wallets if code != base]
+        if not codes:
+            return total
 
-        if base not in exchange_rates:
+        if base not in rates:
             raise ValueError("unknown base_currency")
+        if any(code not in rates for code in codes):
+            raise ValueError("unknown currency in portfolio")
 
-        total_usd = 0.0
-        for code, wallet in self._wallets.items():
-            if code not in exchange_rates:
-                raise ValueError("unknown currency in portfolio")
-            total_usd += wallet.balance * exchange_rates[code]
-
-        return total_usd / exchange_rates[base]
+        converted = float(sum(rates.convert([self._wallets[c].balance for c in codes], codes, base)))
+        if math.isnan(converted):
+            raise ValueError("unknown currency in portfolio")
+        return total + converted
@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import heapq
+import math
+import threading
+from datetime import datetime, timezone
+from typing import Iterable, Sequence
+
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+
+def _quote_ts(value) -> float | None:
+    if not isinstance(value, str) or not value.strip():
+        return None
+    try:
+        dt = datetime.fromisoformat(value.strip())
+    except Exception:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+class CurrencyGraph:
+    # Граф котировок: вершины — валюты, ребро F→T с курсом из пары F_T или 1/T_F.
+    # Прямая котировка важнее обратной для того же направления. Вес ребра — возраст котировки
+    # относительно самой свежей в снимке (без времени — как самая старая плюс секунда).
+    def __init__(self, pairs: dict):
+        quotes: list[tuple[str, str, float, float | None]] = []
+        for key, val in pairs.items():
+            if not isinstance(key, str) or not isinstance(val, dict):
+                continue
+            rate = val.get("rate")
+            if not isinstance(rate, (int, float)) or not math.isfinite(rate) or float(rate) <= 0:
+                continue
+            f, _, t = key.strip().upper().partition("_")
+            if not f or not t or f == t:
+                continue
+            quotes.append((f, t, float(rate), _quote_ts(val.get("updated_at"))))
+
+        stamps = [ts for *_, ts in quotes if ts is not None]
+        newest = max(stamps, default=0.0)
+        missing_age = newest - min(stamps, default=0.0) + 1.0
+
+        edges: dict[str, dict[str, tuple[float, float, bool]]] = {}
+        for f, t, rate, ts in quotes:
+            age = newest - ts if ts is not None else missing_age
+            for a, b, r, direct in ((f, t, rate, True), (t, f, 1.0 / rate, False)):
+                cur = edges.setdefault(a, {}).get(b)
+                if cur is None or (direct, -age) > (cur[2], -cur[1]):
+                    edges[a][b] = (r, age, direct)
+
+        self.codes: tuple[str, ...] = tuple(sorted(edges))
+        self.edges = edges
+
+    def search(self, source: str) -> tuple[dict[str, float], dict[str, str]]:
+        # Дейкстра по (число шагов, суммарный возраст котировок): сначала кратчайший путь,
+        # среди равных — самый свежий. Возвращает курсы source→X и предшественников на пути.
+        rates = {source: 1.0}
+        prev: dict[str, str] = {}
+        best = {source: (0, 0.0)}
+        heap = [(0, 0.0, source)]
+        while heap:
+            hops, age, code = heapq.heappop(heap)
+            if (hops, age) > best[code]:
+                continue
+            for nxt, (r, edge_age, _) in sorted(self.edges.get(code, {}).items()):
+                cost = (hops + 1, age + edge_age)
+                if nxt in best and best[nxt] <= cost:
+                    continue
+                best[nxt] = cost
+                rates[nxt] = rates[code] * r
+                prev[nxt] = code
+                heapq.heappush(heap, (cost[0], cost[1], nxt))
+        return rates, prev
+
+
+class RateMatrix:
+    # Кросс-курсы всех валют снимка: matrix[i][j] — сколько единиц codes[j] стоит одна единица
+    # codes[i]; NaN — пути нет. Строка заполняется поиском по графу при первом обращении
+    # к валюте и дальше не пересчитывается, так что после прогрева rate() — O(1).
+    def __init__(self, graph: CurrencyGraph):
+        self.graph = graph
+        self.codes = graph.codes
+        self.index: dict[str, int] = {c: i for i, c in enumerate(self.codes)}
+        n = len(self.codes)
+        if np is not None:
+            self.matrix = np.full((n, n), np.nan, dtype=np.float64)
+        else:
+            self.matrix = [[math.nan] * n for _ in range(n)]
+        self._prev: dict[int, dict[str, str]] = {}
+        self._cols: dict[int, object] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_pairs(cls, pairs: dict) -> RateMatrix:
+        return cls(CurrencyGraph(pairs if isinstance(pairs, dict) else {}))
+
+    def __contains__(self, code: str) -> bool:
+        return code in self.index
+
+    def _row(self, i: int):
+        if i not in self._prev:
+            with self._lock:
+                if i not in self._prev:
+                    rates, prev = self.graph.search(self.codes[i])
+                    row = self.matrix[i]
+                    for code, r in rates.items():
+                        row[self.index[code]] = r
+                    self._prev[i] = prev
+        return self.matrix[i]
+
+    def rate(self, from_code: str, to_code: str) -> float | None:
+        if from_code == to_code:
+            return 1.0
+        i = self.index.get(from_code)
+        j = self.index.get(to_code)
+        if i is None or j is None:
+            return None
+        r = float(self._row(i)[j])
+        return None if math.isnan(r) else r
+
+    def path(self, from_code: str, to_code: str) -> list[str] | None:
+        i = self.index.get(from_code)
+        if i is None or to_code not in self.index:
+            return None
+        self._row(i)
+        prev = self._prev[i]
+        out = [to_code]
+        while out[-1] != from_code:
+            if out[-1] not in prev:
+                return None
+            out.append(prev[out[-1]])
+        return out[::-1]
+
+    def vector(self, base: str):
+        # Курсы всех codes к base: столбец base, собранный из строк каждой валюты, — те же пути
+        # и те же значения, что у rate(code, base). Столбец кешируется вместе с матрицей.
+        j = self.index.get(base)
+        if j is None:
+            raise KeyError(base)
+        col = self._cols.get(j)
+        if col is None:
+            values = [float(self._row(i)[j]) for i in range(len(self.codes))]
+            col = np.asarray(values, dtype=np.float64) if np is not None else values
+            self._cols[j] = col
+        return col
+
+    def convert(self, amounts: Sequence[float], codes: Iterable[str], base: str):
+        # Перевод сумм amounts[k] в валюте codes[k] в base; для неизвестных валют — NaN.
+        col = self.vector(base)
+        idx = [self.index.get(c, -1) for c in codes]
+        if np is not None:
+            idx_arr = np.asarray(idx, dtype=np.intp)
+            rates = np.where(idx_arr >= 0, col[idx_arr], np.nan)
+            return np.asarray(amounts, dtype=np.float64) * rates
+        return [float(a) * col[i] if i >= 0 else math.nan for a, i in zip(amounts, idx)]
+
+
+_lock = threading.Lock()
+_cached: tuple[dict, RateMatrix] | None = None
+
+
+def get_rate_matrix(pairs: dict) -> RateMatrix:
+    # Снимок курсов приходит из общего кеша и не меняется на месте, поэтому версия снимка —
+    # это сам объект pairs: пока он тот же, матрица и найденные пути переиспользуются.
+    global _cached
+    cached = _cached
+    if cached is not None and cached[0] is pairs:
+        return cached[1]
+    with _lock:
+        matrix = RateMatrix.from_pairs(pairs)
+        _cached = (pairs, matrix)
+    return matrix
@@ -1,14 +1,16 @@
 from __future__ import annotations
 
-import json
+import copy
 from datetime import datetime, timezone
-from pathlib import Path
-from typing import Any
+from typing import Any, Callable
 
 from valutatrade_hub.core.currencies import get_currency
 from valutatrade_hub.core.exceptions import ApiRequestError, CurrencyNotFoundError, InsufficientFundsError
+from valutatrade_hub.core.leaderboard import on_portfolio_changed
 from valutatrade_hub.core.models import Wallet
+from valutatrade_hub.core.rates import get_rate_matrix
 from valutatrade_hub.decorators import log_action
+from valutatrade_hub.infra.repositories import get_repositories
 from valutatrade_hub.infra.settings import SettingsLoader
 
 SETTINGS = SettingsLoader()
@@ -59,33 +61,6 @@ def _format_dt(dt: datetime) -> str:
     return dt.strftime("%Y-%m-%dT%H:%M:%SZ")
 
 
-def _read_json(path: Path, default):
-    if not path.exists():
-        return default
-    text = path.read_text(encoding="utf-8").strip()
-    if not text:
-        return default
-    try:
-        return json.loads(text)
-    except Exception:
-        return default
-
-
-def _write_json_atomic(path: Path, data) -> None:
-    path.parent.mkdir(parents=True, exist_ok=True)
-    tmp = path.with_suffix(path.suffix + ".tmp")
-    tmp.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
-    tmp.replace(path)
-
-
-def _portfolios_path() -> Path:
-    return Path(SETTINGS.get("PORTFOLIOS_JSON"))
-
-
-def _rates_path() -> Path:
-    return Path(SETTINGS.get("RATES_JSON"))
-
-
 def _ttl_seconds() -> int:
     ttl = SETTINGS.get("RATES_TTL_SECONDS", 3000)
     try:
@@ -103,7 +78,7 @@ def _base_currency() -> str:
 
 
 def _read_rates_snapshot() -> dict:
-    data = _read_json(_rates_path(), {})
+    data = get_repositories().rates.get_snapshot()
     return data if isinstance(data, dict) else {}
 
 
@@ -124,62 +99,11 @@ def _ensure_rates_fresh() -> tuple[dict[str, dict], datetime]:
     return pairs, last_refresh
 
 
-def _pair_rate(pairs: dict, f: str, t: str) -> float | None:
-    key = f"{f}_{t}"
-    v = pairs.get(key)
-    if isinstance(v, dict) and isinstance(v.get("rate"), (int, float)):
-        r = float(v["rate"])
-        return r if r > 0 else None
-
-    inv = pairs.get(f"{t}_{f}")
-    if isinstance(inv, dict) and isinstance(inv.get("rate"), (int, float)):
-        r = float(inv["rate"])
-        if r > 0:
-            return 1.0 / r
-
-    return None
-
-
-def _rate_to_base(pairs: dict, code: str, base: str, pivot: str = "USD") -> float:
-    c = code.strip().upper()
-    b = base.strip().upper()
-
-    if c == b:
-        return 1.0
-
-    if c == pivot:
-        r = _pair_rate(pairs, pivot, b)
-        if r is None:
-            raise ApiRequestError("rates unavailable")
-        return r
-
-    if b == pivot:
-        r = _pair_rate(pairs, c, pivot)
-        if r is None:
-            raise ApiRequestError("rates unavailable")
-        return r
-
-    c_p = _pair_rate(pairs, c, pivot)
-    b_p = _pair_rate(pairs, b, pivot)
-    if c_p is None or b_p is None or b_p == 0:
+def _rate_to_base(pairs: dict, code: str, base: str) -> float:
+    r = get_rate_matrix(pairs).rate(code.strip().upper(), base.strip().upper())
+    if r is None:
         raise ApiRequestError("rates unavailable")
-    return c_p / b_p
-
-
-
-def _load_portfolios() -> list[dict]:
-    data = _read_json(_portfolios_path(), [])
-    if isinstance(data, list):
-        out = []
-        for item in data:
-            if isinstance(item, dict):
-                out.append(item)
-        return out
-    return []
-
-
-def _save_portfolios(portfolios: list[dict]) -> None:
-    _write_json_atomic(_portfolios_path(), portfolios)
+    return r
 
 
 def _find_portfolio(portfolios: list[dict], user_id: int) -> tuple[int | None, dict | None]:
@@ -205,6 +129,77 @@ def _ensure_portfolio(portfolios: list[dict], user_id: int) -> tuple[int, dict]:
     return len(portfolios) - 1, p
 
 
+def _load_user_portfolio(user_id: int) -> dict:
+    p = get_repositories().portfolios.get(user_id)
+    if not isinstance(p, dict):
+        p = {"user_id": user_id, "wallets": {}}
+    return p
+
+
+def _save_user_portfolio(portfolio: dict) -> None:
+    get_repositories().portfolios.save(portfolio)
+
+
+def _update_user_portfolio(user_id: int, fn: Callable[[dict], Any]) -> Any:
+    # Чтение-изменение-запись портфеля одной транзакцией хранилища (с повтором при конфликте).
+    # fn при повторе вызывается заново, поэтому итоговые кошельки — от последнего вызова.
+    final: dict = {}
+
+    def apply(p: dict) -> Any:
+        result = fn(p)
+        final["wallets"] = p.get("wallets")
+        return result
+
+    result = get_repositories().portfolios.update(user_id, apply)
+    on_portfolio_changed(user_id, final.get("wallets"))
+    return result
+
+
+def _trade_record(result: dict) -> dict:
+    code = result.get("currency_code", "USD")
+    return {
+        "timestamp": _format_dt(_now()),
+        "user_id": result["user_id"],
+        "action": result["action"],
+        "currency": code,
+        "amount": result["amount"],
+        "rate": result.get("rate", 1.0),
+        "base": result.get("base", "USD"),
+        "before": result["before_balance"],
+        "after": result["after_balance"],
+        "usd_before": result.get("usd_before", result["before_balance"]),
+        "usd_after": result.get("usd_after", result["after_balance"]),
+    }
+
+
+def _record_trade(result: dict) -> dict:
+    # Структурная запись сделки в журнал; результат возвращается вызывающему без изменений.
+    get_repositories().trades.append(_trade_record(result))
+    return result
+
+
+def get_trade_history(user_id: int, since: str | None = None, limit: int | None = None) -> list[dict]:
+    if not isinstance(user_id, int) or user_id <= 0:
+        raise ValueError("user_id invalid")
+    since_dt = _parse_dt(since) if since is not None else None
+    if since is not None and since_dt is None:
+        raise ValueError("since invalid")
+    if limit is not None and (not isinstance(limit, int) or limit <= 0):
+        raise ValueError("limit invalid")
+    return list(get_repositories().trades.iter_user(user_id, _format_dt(since_dt) if since_dt else None, limit))
+
+
+def get_portfolio(user_id: int) -> dict:
+    if not isinstance(user_id, int) or user_id <= 0:
+        raise ValueError("user_id invalid")
+    p = _load_user_portfolio(user_id)
+    wallets = p.get("wallets")
+    if not isinstance(wallets, dict) or not isinstance(wallets.get("USD"), dict):
+        _ensure_portfolio([p], user_id)
+        _save_user_portfolio(p)
+    return p
+
+
 def _get_wallet_entry(portfolio: dict, code: str, create: bool) -> dict | None:
     wallets = portfolio.get("wallets")
     if not isinstance(wallets, dict):
@@ -220,6 +215,105 @@ def _get_wallet_entry(portfolio: dict, code: str, create: bool) -> dict | None:
     return None
 
 
+def _apply_buy(p: dict, code: str, amount: float, cost_usd: float) -> tuple[float, float, float, float]:
+    usd_entry = _get_wallet_entry(p, "USD", create=True)
+    if not isinstance(usd_entry, dict):
+        raise ValueError("wallet error")
+
+    usd_before = usd_entry.get("balance", 0.0)
+    if not isinstance(usd_before, (int, float)):
+        usd_before = 0.0
+    usd_before = float(usd_before)
+
+    usd_wallet = Wallet("USD", usd_before)
+    usd_wallet.withdraw(cost_usd) 
+    usd_after = usd_wallet.balance
+    usd_entry["balance"] = usd_after
+
+    entry = _get_wallet_entry(p, code, create=True)
+    if not isinstance(entry, dict):
+        raise ValueError("wallet error")
+
+    before = entry.get("balance", 0.0)
+    if not isinstance(before, (int, float)):
+        before = 0.0
+    before = float(before)
+
+    wallet = Wallet(code, before)
+    wallet.deposit(amount)
+    after = wallet.balance
+    entry["balance"] = after
+    return before, after, usd_before, usd_after
+
+
+def _apply_sell(p: dict, code: str, amount: float, revenue_usd: float) -> tuple[float, float, float, float]:
+    entry = _get_wallet_entry(p, code, create=False)
+    if not isinstance(entry, dict):
+        if code in ("BTC", "ETH"):
+            raise InsufficientFundsError(available="0.0000", required=f"{amount:.4f}", code=code)
+        raise InsufficientFundsError(available="0.00", required=f"{amount:.2f}", code=code)
+
+    before = entry.get("balance", 0.0)
+    if not isinstance(before, (int, float)):
+        before = 0.0
+    before = float(before)
+
+    sold_wallet = Wallet(code, before)
+    sold_wallet.withdraw(amount)
+    after = sold_wallet.balance
+    entry["balance"] = after
+
+    usd_entry = _get_wallet_entry(p, "USD", create=True)
+    if not isinstance(usd_entry, dict):
+        raise ValueError("wallet error")
+
+    usd_before = usd_entry.get("balance", 0.0)
+    if not isinstance(usd_before, (int, float)):
+        usd_before = 0.0
+    usd_before = float(usd_before)
+
+    usd_wallet = Wallet("USD", usd_before)
+    usd_wallet.deposit(revenue_usd)
+    usd_after = usd_wallet.balance
+    usd_entry["balance"] = usd_after
+    return before, after, usd_before, usd_after
+
+
+def _apply_deposit(p: dict, amount: float) -> tuple[float, float]:
+    usd_entry = _get_wallet_entry(p, "USD", create=True)
+    if not isinstance(usd_entry, dict):
+        raise ValueError("wallet error")
+
+    before = usd_entry.get("balance", 0.0)
+    if not isinstance(before, (int, float)):
+        before = 0.0
+    before = float(before)
+
+    w = Wallet("USD", before)
+    w.deposit(amount)
+    after = w.balance
+    usd_entry["balance"] = after
+    return before, after
+
+
+def _apply_cash_out(p: dict, amount: float) -> tuple[float, float]:
+    usd_entry = _get_wallet_entry(p, "USD", create=True)
+    if not isinstance(usd_entry, dict):
+        raise ValueError("wallet error")
+
+    before = usd_entry.get("balance", 0.0)
+    if not isinstance(before, (int, float)):
+        before = 0.0
+    before = float(before)
+
+    w = Wallet("USD", before)
+    w.withdraw(amount)
+    after = w.balance
+
+    usd_entry["balance"] = after
+    return before, after
+
+
 def get_setting(key: str, default: Any = None) -> Any:
     return SETTINGS.get(key, default)
 
@@ -247,44 +341,14 @@ def buy(
 
     pairs, _ = _ensure_rates_fresh()
 
-    rate_usd_per_unit = _rate_to_base(pairs, code, "USD", pivot="USD") 
+    rate_usd_per_unit = _rate_to_base(pairs, code, "USD")
     cost_usd = amount * float(rate_usd_per_unit)
 
-    portfolios = _load_portfolios()
-    idx, p = _ensure_portfolio(portfolios, user_id)
-
-    usd_entry = _get_wallet_entry(p, "USD", create=True)
-    if not isinstance(usd_entry, dict):
-        raise ValueError("wallet error")
-
-    usd_before = usd_entry.get("balance", 0.0)
-    if not isinstance(usd_before, (int, float)):
-        usd_before = 0.0
-    usd_before = float(usd_before)
-
-    usd_wallet = Wallet("USD", usd_before)
-    usd_wallet.withdraw(cost_usd) 
-    usd_after = usd_wallet.balance
-    usd_entry["balance"] = usd_after
-
-    entry = _get_wallet_entry(p, code, create=True)
-    if not isinstance(entry, dict):
-        raise ValueError("wallet error")
-
-    before = entry.get("balance", 0.0)
-    if not isinstance(before, (int, float)):
-        before = 0.0
-    before = float(before)
-
-    wallet = Wallet(code, before)
-    wallet.deposit(amount)
-    after = wallet.balance
-    entry["balance"] = after
-
-    portfolios[idx] = p
-    _save_portfolios(portfolios)
+    before, after, usd_before, usd_after = _update_user_portfolio(
+        user_id, lambda p: _apply_buy(p, code, amount, cost_usd)
+    )
 
-    return {
+    return _record_trade({
         "action": "BUY",
         "user_id": user_id,
         "username": username,
@@ -298,7 +362,7 @@ def buy(
         "usd_before": usd_before,
         "usd_after": usd_after,
         "result": "OK",
-    }
+    })
 
 
 @log_action("SELL", verbose=True)
@@ -324,46 +388,14 @@ def sell(
 
     pairs, _ = _ensure_rates_fresh()
 
-    rate_usd_per_unit = _rate_to_base(pairs, code, "USD", pivot="USD")
+    rate_usd_per_unit = _rate_to_base(pairs, code, "USD")
     revenue_usd = amount * float(rate_usd_per_unit)
 
-    portfolios = _load_portfolios()
-    idx, p = _ensure_portfolio(portfolios, user_id) 
-
-    entry = _get_wallet_entry(p, code, create=False)
-    if not isinstance(entry, dict):
-        if code in ("BTC", "ETH"):
-            raise InsufficientFundsError(available="0.0000", required=f"{amount:.4f}", code=code)
-        raise InsufficientFundsError(available="0.00", required=f"{amount:.2f}", code=code)
-
-    before = entry.get("balance", 0.0)
-    if not isinstance(before, (int, float)):
-        before = 0.0
-    before = float(before)
-
-    sold_wallet = Wallet(code, before)
-    sold_wallet.withdraw(amount)
-    after = sold_wallet.balance
-    entry["balance"] = after
-
-    usd_entry = _get_wallet_entry(p, "USD", create=True)
-    if not isinstance(usd_entry, dict):
-        raise ValueError("wallet error")
+    before, after, usd_before, usd_after = _update_user_portfolio(
+        user_id, lambda p: _apply_sell(p, code, amount, revenue_usd)
+    )
 
-    usd_before = usd_entry.get("balance", 0.0)
-    if not isinstance(usd_before, (int, float)):
-        usd_before = 0.0
-    usd_before = float(usd_before)
-
-    usd_wallet = Wallet("USD", usd_before)
-    usd_wallet.deposit(revenue_usd)
-    usd_after = usd_wallet.balance
-    usd_entry["balance"] = usd_after
-
-    portfolios[idx] = p
-    _save_portfolios(portfolios)
-
-    return {
+    return _record_trade({
         "action": "SELL",
         "user_id": user_id,
         "username": username,
@@ -377,7 +409,7 @@ def sell(
         "usd_before": usd_before,
         "usd_after": usd_after,
         "result": "OK",
-    }
+    })
 
 
 @log_action("DEPOSIT_USD", verbose=True)
@@ -393,27 +425,9 @@ def deposit_usd(
         raise ValueError("amount invalid")
     amount = float(amount)
 
-    portfolios = _load_portfolios()
-    idx, p = _ensure_portfolio(portfolios, user_id)
-
-    usd_entry = _get_wallet_entry(p, "USD", create=True)
-    if not isinstance(usd_entry, dict):
-        raise ValueError("wallet error")
-
-    before = usd_entry.get("balance", 0.0)
-    if not isinstance(before, (int, float)):
-        before = 0.0
-    before = float(before)
-
-    w = Wallet("USD", before)
-    w.deposit(amount)
-    after = w.balance
-    usd_entry["balance"] = after
-
-    portfolios[idx] = p
-    _save_portfolios(portfolios)
+    before, after = _update_user_portfolio(user_id, lambda p: _apply_deposit(p, amount))
 
-    return {
+    return _record_trade({
         "action": "DEPOSIT_USD",
         "user_id": user_id,
         "username": username,
@@ -421,7 +435,7 @@ def deposit_usd(
         "before_balance": before,
         "after_balance": after,
         "result": "OK",
-    }
+    })
 
 @log_action("CASH_OUT_USD", verbose=True)
 def cash_out_usd(
@@ -436,27 +450,9 @@ def cash_out_usd(
         raise ValueError("amount invalid")
     amount = float(amount)
 
-    portfolios = _load_portfolios()
-    idx, p = _ensure_portfolio(portfolios, user_id)
+    before, after = _update_user_portfolio(user_id, lambda p: _apply_cash_out(p, amount))
 
-    usd_entry = _get_wallet_entry(p, "USD", create=True)
-    if not isinstance(usd_entry, dict):
-        raise ValueError("wallet error")
-
-    before = usd_entry.get("balance", 0.0)
-    if not isinstance(before, (int, float)):
-        before = 0.0
-    before = float(before)
-
-    w = Wallet("USD", before)
-    w.withdraw(amount)
-    after = w.balance
-
-    usd_entry["balance"] = after
-    portfolios[idx] = p
-    _save_portfolios(portfolios)
-
-    return {
+    return _record_trade({
         "action": "CASH_OUT_USD",
         "user_id": user_id,
         "username": username,
@@ -464,8 +460,138 @@ def cash_out_usd(
         "before_balance": before,
         "after_balance": after,
         "result": "OK",
-    }
+    })
+
+
+
+_BATCH_ACTIONS = {
+    "buy": "BUY",
+    "sell": "SELL",
+    "deposit": "DEPOSIT_USD",
+    "deposit_usd": "DEPOSIT_USD",
+    "cash-out": "CASH_OUT_USD",
+    "cash_out": "CASH_OUT_USD",
+    "cash_out_usd": "CASH_OUT_USD",
+}
+
+
+class _BatchAborted(Exception):
+    def __init__(self, results: list[dict]):
+        self.results = results
+        super().__init__("batch aborted")
+
+
+class BatchRolledBackError(Exception):
+    # Атомарный пакет откатан: исключение доходит до log_action (result=ERROR), сводка — в summary.
+    def __init__(self, summary: dict, index: int, error: str):
+        self.summary = summary
+        super().__init__(f"rolled back at order #{index + 1}: {error}")
+
+
+def _parse_order(order: Any) -> tuple[str, str, float]:
+    if not isinstance(order, dict):
+        raise ValueError("Заявка должна быть JSON-объектом")
+    action = _BATCH_ACTIONS.get(str(order.get("action", "")).strip().lower())
+    if action is None:
+        raise ValueError(f"Неизвестное действие '{order.get('action')}'")
+    amount = order.get("amount")
+    if isinstance(amount, bool) or not isinstance(amount, (int, float)) or float(amount) <= 0:
+        raise ValueError("'amount' должен быть положительным числом")
+    if action in ("DEPOSIT_USD", "CASH_OUT_USD"):
+        return action, "USD", float(amount)
+    code = get_currency(str(order.get("currency", ""))).code
+    if code == "USD":
+        raise ValueError("Покупать и продавать можно только не-USD валюты")
+    return action, code, float(amount)
+
 
+def _apply_order(p: dict, order: Any, pairs: dict | None) -> dict:
+    action, code, amount = _parse_order(order)
+    result = {"action": action, "currency_code": code, "amount": amount, "base": "USD", "rate": 1.0}
+    if action in ("BUY", "SELL"):
+        if pairs is None:
+            raise ApiRequestError("rates unavailable")
+        rate = _rate_to_base(pairs, code, "USD")
+        apply = _apply_buy if action == "BUY" else _apply_sell
+        before, after, usd_before, usd_after = apply(p, code, amount, amount * rate)
+        result.update(rate=rate, usd_before=usd_before, usd_after=usd_after)
+    elif action == "DEPOSIT_USD":
+        before, after = _apply_deposit(p, amount)
+    else:
+        before, after = _apply_cash_out(p, amount)
+    result.update(before_balance=before, after_balance=after, result="OK")
+    return result
+
+
+def execute_batch(
+    orders: list[Any],
+    *,
+    user_id: int,
+    username: str | None = None,
+    atomic: bool = True,
+) -> dict:
+    # Пакет заявок одного пользователя: один снимок курсов, одна транзакция портфеля и одна запись
+    # в журнал сделок. atomic=True — при первой ошибке не применяется ничего (выполненные до неё
+    # заявки — ROLLED_BACK, следующие — SKIPPED); atomic=False — ошибочные заявки пропускаются.
+    try:
+        return _execute_batch(orders, user_id=user_id, username=username, atomic=atomic)
+    except BatchRolledBackError as e:
+        return e.summary
+
+
+@log_action("BATCH")
+def _execute_batch(orders: list[Any], *, user_id: int, username: str | None, atomic: bool) -> dict:
+    if not isinstance(user_id, int) or user_id <= 0:
+        raise ValueError("user_id invalid")
+    orders = list(orders)
+
+    pairs = None
+    if any(isinstance(o, dict) and str(o.get("action", "")).strip().lower() in ("buy", "sell") for o in orders):
+        pairs, _ = _ensure_rates_fresh()
+
+    def apply(p: dict) -> list[dict]:
+        results = []
+        for i, order in enumerate(orders):
+            saved = copy.deepcopy(p.get("wallets"))
+            try:
+                result = _apply_order(p, order, pairs)
+            except (InsufficientFundsError, CurrencyNotFoundError, ApiRequestError, ValueError) as e:
+                p["wallets"] = saved
+                results.append({"index": i, "result": "ERROR", "error": str(e)})
+                if atomic:
+                    for r in results:
+                        if r["result"] == "OK":
+                            r["result"] = "ROLLED_BACK"
+                    results.extend({"index": j, "result": "SKIPPED"} for j in range(i + 1, len(orders)))
+                    raise _BatchAborted(results) from e
+                continue
+            result.update(index=i, user_id=user_id, username=username)
+            results.append(result)
+        return results
+
+    try:
+        results = _update_user_portfolio(user_id, apply) if orders else []
+        committed = True
+    except _BatchAborted as e:
+        results = e.results
+        committed = False
+
+    done = [r for r in results if r["result"] == "OK"] if committed else []
+    if done:
+        get_repositories().trades.append_many([_trade_record(r) for r in done])
+    summary = {
+        "user_id": user_id,
+        "username": username,
+        "atomic": atomic,
+        "committed": committed,
+        "ok": len(done),
+        "failed": sum(1 for r in results if r["result"] == "ERROR"),
+        "results": results,
+    }
+    if not committed:
+        failed = next(r for r in results if r["result"] == "ERROR")
+        raise BatchRolledBackError(summary, failed["index"], failed["error"])
+    return summary
 
 
 def get_rate(from_code: str, to_code: str) -> dict:
@@ -484,7 +610,7 @@ def get_rate(from_code: str, to_code: str) -> dict:
         raise CurrencyNotFoundError(str(to_code).strip().upper() if isinstance(to_code, str) else str(to_code))
 
     pairs, refreshed_at = _ensure_rates_fresh()
-    rate = _rate_to_base(pairs, f, t, pivot="USD")
+    rate = _rate_to_base(pairs, f, t)
 
     direct = pairs.get(f"{f}_{t}")
     updated_at = None
@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import csv
+import math
+from array import array
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from valutatrade_hub.core.rates import RateMatrix, get_rate_matrix
+from valutatrade_hub.infra.repositories import get_repositories
+
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+
+CSV_CHUNK = 100_000
+
+
+class BalanceMatrix:
+    # Балансы всех пользователей: строка — пользователь (user_ids отсортированы), столбец — валюта
+    # из codes. С NumPy — плотный массив float64, без него — словари по пользователям.
+    def __init__(self, user_ids, codes: tuple[str, ...], balances):
+        self.user_ids = user_ids
+        self.codes = codes
+        self.balances = balances
+
+    def __len__(self) -> int:
+        return len(self.user_ids)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[tuple[int, str, float]]) -> BalanceMatrix:
+        code_index: dict[str, int] = {}
+        if np is None:
+            by_user: dict[int, dict[int, float]] = {}
+            for user_id, code, bal in rows:
+                ci = code_index.setdefault(code, len(code_index))
+                by_user.setdefault(user_id, {})[ci] = bal
+            user_ids = sorted(by_user)
+            return cls(user_ids, tuple(code_index), [by_user[u] for u in user_ids])
+
+        uids = array("q")
+        cids = array("q")
+        bals = array("d")
+        for user_id, code, bal in rows:
+            uids.append(user_id)
+            cids.append(code_index.setdefault(code, len(code_index)))
+            bals.append(bal)
+        user_ids, rows_idx = np.unique(np.frombuffer(uids, dtype=np.int64), return_inverse=True)
+        balances = np.zeros((len(user_ids), len(code_index)), dtype=np.float64)
+        balances[rows_idx, np.frombuffer(cids, dtype=np.int64)] = np.frombuffer(bals, dtype=np.float64)
+        return cls(user_ids, tuple(code_index), balances)
+
+    def valuate(self, rates: RateMatrix, base: str):
+        # Стоимость каждого портфеля в base одним умножением матрицы на вектор курсов.
+        # Портфель с ненулевым балансом в валюте без курса получает NaN.
+        col = rates.vector(base)
+        vec = [float(col[rates.index[c]]) if c in rates else math.nan for c in self.codes]
+        if np is None:
+            out = []
+            for wallets in self.balances:
+                total = 0.0
+                for ci, bal in wallets.items():
+                    if bal:
+                        total += bal * vec[ci]
+                out.append(total)
+            return out
+
+        vec_arr = np.asarray(vec, dtype=np.float64)
+        missing = np.isnan(vec_arr)
+        values = self.balances @ np.where(missing, 0.0, vec_arr)
+        if missing.any():
+            values[(self.balances[:, missing] != 0).any(axis=1)] = np.nan
+        return values
+
+
+def _csv_chunks(user_ids, values, usernames: dict[int, str]) -> Iterator[list[tuple[int, str, str]]]:
+    for start in range(0, len(user_ids), CSV_CHUNK):
+        ids = user_ids[start : start + CSV_CHUNK]
+        vals = values[start : start + CSV_CHUNK]
+        if np is not None:
+            ids = ids.tolist()
+            vals = vals.tolist()
+        yield [(u, usernames.get(u, ""), "" if math.isnan(v) else f"{v:.8f}") for u, v in zip(ids, vals)]
+
+
+def valuate_all(base: str, out_path: Path) -> dict:
+    repos = get_repositories()
+    snap = repos.rates.get_snapshot()
+    pairs = snap.get("pairs") if isinstance(snap, dict) else None
+    rates = get_rate_matrix(pairs if isinstance(pairs, dict) else {})
+    if base not in rates:
+        raise KeyError(base)
+
+    matrix = BalanceMatrix.from_rows(repos.portfolios.iter_balances())
+    values = matrix.valuate(rates, base)
+    usernames = {
+        u["user_id"]: str(u.get("username", ""))
+        for u in repos.users.iter_all()
+        if isinstance(u, dict) and isinstance(u.get("user_id"), int)
+    }
+
+    out_path = Path(out_path)
+    if out_path.parent != Path("."):
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out_path.with_name(f".{out_path.name}.part")
+    with tmp.open("w", encoding="utf-8", newline="") as fh:
+        writer = csv.writer(fh, lineterminator="\n")
+        writer.writerow(("user_id", "username", "value"))
+        for rows in _csv_chunks(matrix.user_ids, values, usernames):
+            writer.writerows(rows)
+    tmp.replace(out_path)
+
+    if np is not None:
+        unpriced = int(np.isnan(values).sum())
+        total = float(np.nansum(values))
+    else:
+        unpriced = sum(1 for v in values if math.isnan(v))
+        total = math.fsum(v for v in values if not math.isnan(v))
+    return {"base": base, "path": str(out_path), "accounts": len(matrix), "unpriced": unpriced, "total": total}
@@ -0,0 +1,370 @@
+from __future__ import annotations
+
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator
+
+from valutatrade_hub.infra.settings import SettingsLoader
+from valutatrade_hub.infra.trade_ledger import trade_ts
+
+SETTINGS = SettingsLoader()
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    username TEXT NOT NULL UNIQUE,
+    hashed_password TEXT NOT NULL,
+    salt TEXT NOT NULL,
+    registration_date TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS wallets (
+    user_id INTEGER NOT NULL,
+    currency TEXT NOT NULL,
+    balance REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, currency)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS session (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    user_id INTEGER NOT NULL,
+    username TEXT NOT NULL,
+    login_date TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rate_pairs (
+    pair TEXT PRIMARY KEY,
+    rate REAL NOT NULL,
+    updated_at TEXT NOT NULL,
+    source TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rates_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rate_history (
+    pair TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    from_currency TEXT NOT NULL,
+    to_currency TEXT NOT NULL,
+    rate REAL NOT NULL,
+    source TEXT NOT NULL,
+    meta TEXT NOT NULL DEFAULT '{}',
+    PRIMARY KEY (pair, timestamp)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS rate_history_timestamp ON rate_history (timestamp);
+CREATE TABLE IF NOT EXISTS trades (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    ts INTEGER NOT NULL,
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS trades_user_ts ON trades (user_id, ts, id);
+"""
+
+
+class SqliteDatabase:
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._local = threading.local()
+
+    def connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        self._local.conn = conn
+        return conn
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def data_version(self) -> int:
+        return int(self.connect().execute("PRAGMA data_version").fetchone()[0])
+
+    def get_user(self, username: str) -> dict | None:
+        row = self.connect().execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def get_user_by_id(self, user_id: int) -> dict | None:
+        row = self.connect().execute("SELECT * FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def iter_users(self) -> Iterator[dict]:
+        for row in self.connect().execute("SELECT * FROM users ORDER BY user_id"):
+            yield dict(row)
+
+    def create_user(self, username: str, hashed_password: str, salt: str, registration_date: str) -> int | None:
+        conn = self.connect()
+        try:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                cur = conn.execute(
+                    "INSERT INTO users (username, hashed_password, salt, registration_date) VALUES (?, ?, ?, ?)",
+                    (username, hashed_password, salt, registration_date),
+                )
+                user_id = int(cur.lastrowid)
+        except sqlite3.IntegrityError:
+            return None
+        return user_id
+
+    def get_portfolio(self, user_id: int) -> dict | None:
+        rows = self.connect().execute("SELECT currency, balance FROM wallets WHERE user_id = ?", (user_id,)).fetchall()
+        if not rows:
+            return None
+        return {"user_id": user_id, "wallets": {r["currency"]: {"balance": float(r["balance"])} for r in rows}}
+
+    def iter_portfolios(self) -> Iterator[dict]:
+        current = None
+        for row in self.connect().execute("SELECT user_id, currency, balance FROM wallets ORDER BY user_id"):
+            if current is None or current["user_id"] != row["user_id"]:
+                if current is not None:
+                    yield current
+                current = {"user_id": row["user_id"], "wallets": {}}
+            current["wallets"][row["currency"]] = {"balance": float(row["balance"])}
+        if current is not None:
+            yield current
+
+    def iter_wallet_rows(self) -> Iterator[tuple[int, str, float]]:
+        cur = self.connect().execute("SELECT user_id, currency, balance FROM wallets")
+        while True:
+            rows = cur.fetchmany(10000)
+            if not rows:
+                return
+            for r in rows:
+                yield r[0], r[1], float(r[2])
+
+    @staticmethod
+    def _wallet_rows(portfolio: dict) -> list[tuple]:
+        user_id = portfolio["user_id"]
+        rows = []
+        for code, entry in (portfolio.get("wallets") or {}).items():
+            bal = entry.get("balance", 0.0) if isinstance(entry, dict) else 0.0
+            rows.append((user_id, str(code).upper(), float(bal) if isinstance(bal, (int, float)) else 0.0))
+        return rows
+
+    def save_portfolio(self, portfolio: dict) -> None:
+        rows = self._wallet_rows(portfolio)
+        conn = self.connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM wallets WHERE user_id = ?", (portfolio["user_id"],))
+            conn.executemany("INSERT INTO wallets (user_id, currency, balance) VALUES (?, ?, ?)", rows)
+
+    def update_portfolio(self, user_id: int, fn: Callable[[dict], Any]) -> Any:
+        # Чтение, изменение и запись в одной транзакции BEGIN IMMEDIATE — SQLite сам сериализует писателей.
+        conn = self.connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            p = self.get_portfolio(user_id) or {"user_id": user_id, "wallets": {}}
+            result = fn(p)
+            conn.execute("DELETE FROM wallets WHERE user_id = ?", (user_id,))
+            conn.executemany("INSERT INTO wallets (user_id, currency, balance) VALUES (?, ?, ?)", self._wallet_rows(p))
+        return result
+
+    def get_session(self) -> dict:
+        row = self.connect().execute("SELECT user_id, username, login_date FROM session WHERE id = 1").fetchone()
+        return dict(row) if row is not None else {}
+
+    def set_session(self, session: dict) -> None:
+        conn = self.connect()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO session (id, user_id, username, login_date) VALUES (1, ?, ?, ?)",
+                (session["user_id"], session["username"], session["login_date"]),
+            )
+
+    def get_rates_snapshot(self) -> dict:
+        conn = self.connect()
+        pairs = {
+            r["pair"]: {"rate": float(r["rate"]), "updated_at": r["updated_at"], "source": r["source"]}
+            for r in conn.execute("SELECT pair, rate, updated_at, source FROM rate_pairs")
+        }
+        snap: dict[str, Any] = {"pairs": pairs}
+        row = conn.execute("SELECT value FROM rates_meta WHERE key = 'last_refresh'").fetchone()
+        if row is not None and row["value"]:
+            snap["last_refresh"] = row["value"]
+        return snap
+
+    def save_rates_snapshot(self, snap: dict) -> None:
+        pairs = snap.get("pairs") if isinstance(snap.get("pairs"), dict) else {}
+        rows = [(k, float(v["rate"]), v["updated_at"], v["source"]) for k, v in pairs.items() if isinstance(v, dict)]
+        conn = self.connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany("INSERT OR REPLACE INTO rate_pairs (pair, rate, updated_at, source) VALUES (?, ?, ?, ?)", rows)
+            if isinstance(snap.get("last_refresh"), str):
+                conn.execute("INSERT OR REPLACE INTO rates_meta (key, value) VALUES ('last_refresh', ?)", (snap["last_refresh"],))
+
+    def append_measurements(self, records: list[dict]) -> list[bool]:
+        conn = self.connect()
+        out = []
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for r in records:
+                cur = conn.execute(
+                    "INSERT OR IGNORE INTO rate_history (pair, timestamp, from_currency, to_currency, rate, source, meta) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        f"{r['from_currency']}_{r['to_currency']}",
+                        r["timestamp"],
+                        r["from_currency"],
+                        r["to_currency"],
+                        float(r["rate"]),
+                        r["source"],
+                        json.dumps(r.get("meta") or {}, ensure_ascii=False),
+                    ),
+                )
+                out.append(cur.rowcount == 1)
+        return out
+
+    def iter_measurements(
+        self,
+        from_currency: str | None = None,
+        to_currency: str | None = None,
+        since: str | None = None,
+        until: str | None = None,
+    ) -> Iterable[dict]:
+        where = []
+        params: list[Any] = []
+        if from_currency is not None and to_currency is not None:
+            where.append("pair = ?")
+            params.append(f"{from_currency}_{to_currency}")
+        elif from_currency is not None:
+            where.append("from_currency = ?")
+            params.append(from_currency)
+        elif to_currency is not None:
+            where.append("to_currency = ?")
+            params.append(to_currency)
+        if since is not None:
+            where.append("timestamp >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("timestamp <= ?")
+            params.append(until)
+        sql = "SELECT * FROM rate_history"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY timestamp"
+        for r in self.connect().execute(sql, params):
+            try:
+                meta = json.loads(r["meta"])
+            except Exception:
+                meta = {}
+            yield {
+                "id": f"{r['pair']}_{r['timestamp']}",
+                "from_currency": r["from_currency"],
+                "to_currency": r["to_currency"],
+                "rate": float(r["rate"]),
+                "timestamp": r["timestamp"],
+                "source": r["source"],
+                "meta": meta if isinstance(meta, dict) else {},
+            }
+
+    @staticmethod
+    def _trade_rows(trades: Iterable[dict]) -> list[tuple]:
+        return [
+            (t["user_id"], trade_ts(t.get("timestamp")) or 0, json.dumps(t, ensure_ascii=False))
+            for t in trades
+            if isinstance(t, dict) and isinstance(t.get("user_id"), int)
+        ]
+
+    def append_trades(self, records: list[dict]) -> None:
+        conn = self.connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany("INSERT INTO trades (user_id, ts, record) VALUES (?, ?, ?)", self._trade_rows(records))
+
+    def iter_user_trades(self, user_id: int, since: int | None = None, limit: int | None = None) -> Iterator[dict]:
+        sql = "SELECT record FROM trades WHERE user_id = ?"
+        params: list[Any] = [user_id]
+        if since is not None:
+            sql += " AND ts >= ?"
+            params.append(since)
+        sql += " ORDER BY ts DESC, id DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        rows = self.connect().execute(sql, params).fetchall()
+        for row in reversed(rows):
+            yield json.loads(row["record"])
+
+    def iter_trades(self) -> Iterator[dict]:
+        for row in self.connect().execute("SELECT record FROM trades ORDER BY id"):
+            yield json.loads(row["record"])
+
+    def import_json(
+        self,
+        users: list[dict],
+        portfolios: list[dict],
+        session: dict,
+        rates_snapshot: dict,
+        history: list[dict],
+        trades: list[dict] | None = None,
+    ) -> dict[str, int]:
+        conn = self.connect()
+        user_rows = []
+        for u in users:
+            if not isinstance(u, dict) or not isinstance(u.get("user_id"), int) or not isinstance(u.get("username"), str):
+                continue
+            user_rows.append(
+                (u["user_id"], u["username"], str(u.get("hashed_password", "")), str(u.get("salt", "")), str(u.get("registration_date", "")))
+            )
+        wallet_rows = []
+        for p in portfolios:
+            if not isinstance(p, dict) or not isinstance(p.get("user_id"), int) or not isinstance(p.get("wallets"), dict):
+                continue
+            for code, entry in p["wallets"].items():
+                bal = entry.get("balance", 0.0) if isinstance(entry, dict) else 0.0
+                wallet_rows.append((p["user_id"], str(code).upper(), float(bal) if isinstance(bal, (int, float)) else 0.0))
+
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT OR REPLACE INTO users (user_id, username, hashed_password, salt, registration_date) VALUES (?, ?, ?, ?, ?)",
+                user_rows,
+            )
+            conn.executemany("INSERT OR REPLACE INTO wallets (user_id, currency, balance) VALUES (?, ?, ?)", wallet_rows)
+        if isinstance(session.get("user_id"), int) and isinstance(session.get("username"), str):
+            self.set_session({"user_id": session["user_id"], "username": session["username"], "login_date": str(session.get("login_date", ""))})
+        if isinstance(rates_snapshot.get("pairs"), dict):
+            self.save_rates_snapshot(rates_snapshot)
+        inserted = self.append_measurements(history)
+        trade_count = self._import_trades(trades or [])
+        return {
+            "users": len(user_rows),
+            "wallets": len(wallet_rows),
+            "pairs": len(rates_snapshot.get("pairs") or {}),
+            "history": sum(1 for x in inserted if x),
+            "trades": trade_count,
+        }
+
+    def _import_trades(self, trades: list[dict]) -> int:
+        # Журнал переносится целиком один раз: если в базе сделки уже есть, повторный импорт их не дублирует.
+        conn = self.connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("SELECT 1 FROM trades LIMIT 1").fetchone() is not None:
+                return 0
+            rows = self._trade_rows(trades)
+            conn.executemany("INSERT INTO trades (user_id, ts, record) VALUES (?, ?, ?)", rows)
+        return len(rows)
+
+
+_DATABASES: dict[str, SqliteDatabase] = {}
+
+
+def get_database() -> SqliteDatabase:
+    path = str(Path(SETTINGS.get("SQLITE_PATH")))
+    db = _DATABASES.get(path)
+    if db is None:
+        db = SqliteDatabase(Path(path))
+        _DATABASES[path] = db
+    return db
@@ -0,0 +1,39 @@
+from __future__ import annotations
+
+import os
+import threading
+from pathlib import Path
+from typing import Any, Callable
+
+
+class FileCache:
+    # Разобранное содержимое файла в памяти процесса. Ключ — (st_mtime_ns, st_size, st_ino):
+    # атомарная замена файла всегда даёт новый inode, поэтому файл разбирается не чаще
+    # одного раза на изменение, а повторное чтение стоит одного stat().
+    def __init__(self, path: Path, parse: Callable[[Path], Any]):
+        self.path = Path(path)
+        self._parse = parse
+        self._lock = threading.Lock()
+        self._entry: tuple[tuple | None, Any] | None = None
+
+    def _stamp(self) -> tuple | None:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def get(self) -> Any:
+        stamp = self._stamp()
+        entry = self._entry
+        if entry is not None and entry[0] == stamp:
+            return entry[1]
+        with self._lock:
+            # stat берём до чтения: если файл поменяется во время разбора, следующий get это увидит.
+            stamp = self._stamp()
+            value = self._parse(self.path)
+            self._entry = (stamp, value)
+        return value
+
+    def invalidate(self) -> None:
+        self._entry = None
@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import json
+import os
+import time
+from pathlib import Path
+
+from valutatrade_hub.infra.files import atomic_write_text
+
+
+class PortfolioWal:
+    # Журнал изменений кошельков: строка JSON на сделку {"seq", "ts", "user_id", "version",
+    # "wallets": {CODE: {"delta", "balance"}}}. При replay применяется итоговый balance, поэтому повторное
+    # применение записи (например, после сбоя посреди checkpoint) безопасно.
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.balances: dict[int, dict[str, float]] = {}
+        self.versions: dict[int, int] = {}
+        self.count = 0
+        self.first_ts: float | None = None
+        self.last_seq = 0
+        self._offset = 0
+        self._ident: tuple[int, int] | None = None
+
+    def _reset_state(self) -> None:
+        self.balances = {}
+        self.versions = {}
+        self.count = 0
+        self.first_ts = None
+        self._offset = 0
+
+    def _apply(self, rec: dict) -> None:
+        if isinstance(rec.get("checkpoint"), int):
+            self.last_seq = max(self.last_seq, rec["checkpoint"])
+            return
+        user_id = rec.get("user_id")
+        wallets = rec.get("wallets")
+        if not isinstance(user_id, int) or not isinstance(wallets, dict):
+            return
+        target = self.balances.setdefault(user_id, {})
+        for code, change in wallets.items():
+            if isinstance(change, dict) and isinstance(change.get("balance"), (int, float)):
+                target[code] = float(change["balance"])
+        if isinstance(rec.get("version"), int):
+            self.versions[user_id] = rec["version"]
+        self.count += 1
+        if self.first_ts is None and isinstance(rec.get("ts"), (int, float)):
+            self.first_ts = float(rec["ts"])
+        if isinstance(rec.get("seq"), int):
+            self.last_seq = max(self.last_seq, rec["seq"])
+
+    def refresh(self) -> None:
+        # Дочитываем только новые полные строки; если файл подменили (checkpoint в другом
+        # процессе) или он стал короче — перечитываем с начала.
+        try:
+            st = self.path.stat()
+        except FileNotFoundError:
+            self._reset_state()
+            self._ident = None
+            return
+        ident = (st.st_dev, st.st_ino)
+        if ident != self._ident or st.st_size < self._offset:
+            self._reset_state()
+            self._ident = ident
+        if st.st_size == self._offset:
+            return
+
+        with self.path.open("rb") as fh:
+            fh.seek(self._offset)
+            chunk = fh.read()
+        end = chunk.rfind(b"\n") + 1
+        for line in chunk[:end].splitlines():
+            try:
+                rec = json.loads(line)
+            except Exception:
+                continue
+            if isinstance(rec, dict):
+                self._apply(rec)
+        self._offset += end
+
+    def append(self, user_id: int, changes: dict[str, tuple[float, float]], version: int) -> int:
+        self.refresh()
+        seq = self.last_seq + 1
+        rec = {
+            "seq": seq,
+            "ts": round(time.time(), 3),
+            "user_id": user_id,
+            "version": version,
+            "wallets": {code: {"delta": delta, "balance": balance} for code, (delta, balance) in changes.items()},
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open("ab") as fh:
+            fh.write(json.dumps(rec, ensure_ascii=False).encode("utf-8") + b"\n")
+            fh.flush()
+            os.fsync(fh.fileno())
+        self.refresh()
+        return seq
+
+    def reset(self) -> None:
+        # Новый пустой журнал с отметкой последнего seq — нумерация продолжается после checkpoint.
+        atomic_write_text(self.path, json.dumps({"checkpoint": self.last_seq}) + "\n")
+        self.refresh()
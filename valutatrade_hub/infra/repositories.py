@@ -0,0 +1,1169 @@
+from __future__ import annotations
+
+import contextlib
+import copy
+import json
+import shutil
+import threading
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Iterable, Iterator
+
+from valutatrade_hub.infra.database import SqliteDatabase, get_database
+from valutatrade_hub.infra.file_cache import FileCache
+from valutatrade_hub.infra.files import ConcurrentUpdateError, atomic_write_text, file_lock, make_temp_dir
+from valutatrade_hub.infra.portfolio_wal import PortfolioWal
+from valutatrade_hub.infra.settings import SettingsLoader
+from valutatrade_hub.infra.trade_ledger import TradeLedger, trade_ts
+from valutatrade_hub.infra.user_index import UserIndex, append_json_array, read_json_at, scan_json_array
+from valutatrade_hub.parser_service import history_files
+
+SETTINGS = SettingsLoader()
+
+
+def _read_json(path: Path, default):
+    if not path.exists():
+        return default
+    text = path.read_text(encoding="utf-8").strip()
+    if not text:
+        return default
+    try:
+        return json.loads(text)
+    except Exception:
+        return default
+
+
+def _read_json_list(path: Path) -> list[dict]:
+    data = _read_json(path, [])
+    if not isinstance(data, list):
+        return []
+    return [x for x in data if isinstance(x, dict)]
+
+
+def _read_json_dict(path: Path) -> dict:
+    data = _read_json(path, {})
+    return data if isinstance(data, dict) else {}
+
+
+def _write_json_atomic(path: Path, data: Any) -> None:
+    atomic_write_text(path, json.dumps(data, ensure_ascii=False, indent=2))
+
+
+class UserRepository(ABC):
+    @abstractmethod
+    def get_by_username(self, username: str) -> dict | None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_by_id(self, user_id: int) -> dict | None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def create(self, username: str, hashed_password: str, salt: str, registration_date: str) -> dict | None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def iter_all(self) -> Iterator[dict]:
+        raise NotImplementedError
+
+
+class PortfolioRepository(ABC):
+    @abstractmethod
+    def get(self, user_id: int) -> dict | None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def save(self, portfolio: dict) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def iter_all(self) -> Iterator[dict]:
+        raise NotImplementedError
+
+    def get_many(self, user_ids: Iterable[int]) -> dict[int, dict]:
+        out = {}
+        for user_id in user_ids:
+            p = self.get(user_id)
+            if p is not None:
+                out[user_id] = p
+        return out
+
+    def save_many(self, portfolios: Iterable[dict]) -> None:
+        for p in portfolios:
+            self.save(p)
+
+    def iter_balances(self) -> Iterator[tuple[int, str, float]]:
+        # Плоский поток (user_id, code, balance) для пакетной оценки всех портфелей.
+        for p in self.iter_all():
+            user_id = p.get("user_id")
+            wallets = p.get("wallets")
+            if not isinstance(user_id, int) or not isinstance(wallets, dict):
+                continue
+            for code, entry in wallets.items():
+                bal = entry.get("balance") if isinstance(entry, dict) else None
+                if isinstance(bal, (int, float)):
+                    yield user_id, str(code).upper(), float(bal)
+
+    def _commit(self, portfolio: dict, expected_version: int | None) -> bool:
+        self.save(portfolio)
+        return True
+
+    def change_stamp(self) -> object:
+        # Метка, которая меняется, когда портфели изменил кто-то кроме этого объекта (другой процесс).
+        # None — изменения не отслеживаются, кеши поверх хранилища должны перечитывать его каждый раз.
+        return None
+
+    def update(self, user_id: int, fn: Callable[[dict], Any], retries: int = 10) -> Any:
+        # Оптимистичная транзакция: fn меняет копию портфеля вне блокировки, запись проходит,
+        # только если version не изменилась с момента чтения; иначе — повтор с новыми данными.
+        for _ in range(retries):
+            current = self.get(user_id)
+            expected = _portfolio_version(current)
+            work = copy.deepcopy(current) if current is not None else {"user_id": user_id, "wallets": {}}
+            result = fn(work)
+            if self._commit(work, expected):
+                return result
+        raise ConcurrentUpdateError(f"портфель пользователя {user_id}")
+
+
+def _portfolio_version(portfolio: dict | None) -> int:
+    version = portfolio.get("version") if isinstance(portfolio, dict) else None
+    return version if isinstance(version, int) else 0
+
+
+def _stat_key(path: Path) -> tuple[int, int, int] | None:
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+class _ChangeTracker:
+    # Счётчик чужих изменений файлов хранилища. keys() перечисляет файлы (или каталоги шардов),
+    # stamp() увеличивает generation, если их stat отличается от виденного. Свою запись репозиторий
+    # оборачивает в own_write() под той же блокировкой файла, что и саму запись: чужая запись до неё
+    # засчитывается, а своя — нет.
+    def __init__(self, keys: Callable[[], Iterable[Path]]):
+        self.keys = keys
+        self.generation = 0
+        self._seen: dict[Path, tuple[int, int, int] | None] | None = None
+        self._lock = threading.Lock()
+
+    def stamp(self) -> int:
+        current = {key: _stat_key(key) for key in self.keys()}
+        with self._lock:
+            if current != self._seen:
+                self.generation += 1
+                self._seen = current
+            return self.generation
+
+    @contextlib.contextmanager
+    def own_write(self, key: Path) -> Iterator[None]:
+        with self._lock:
+            if self._seen is not None and self._seen.get(key) != _stat_key(key):
+                self.generation += 1
+        yield
+        with self._lock:
+            if self._seen is not None:
+                self._seen[key] = _stat_key(key)
+
+
+class SessionRepository(ABC):
+    @abstractmethod
+    def get(self) -> dict:
+        raise NotImplementedError
+
+    @abstractmethod
+    def set(self, session: dict) -> None:
+        raise NotImplementedError
+
+
+class RatesRepository(ABC):
+    # get_snapshot может отдавать один и тот же закешированный dict — менять его нельзя,
+    # для правки сначала copy.deepcopy.
+    @abstractmethod
+    def get_snapshot(self) -> dict:
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_snapshot(self, snapshot: dict) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def append_measurements(self, records: list[dict]) -> list[bool]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def iter_measurements(
+        self,
+        from_currency: str | None = None,
+        to_currency: str | None = None,
+        since: str | None = None,
+        until: str | None = None,
+    ) -> Iterator[dict]:
+        raise NotImplementedError
+
+
+class TradeRepository(ABC):
+    # Журнал сделок только на дозапись; since — ISO-время UTC, limit — последние limit сделок.
+    @abstractmethod
+    def append(self, record: dict) -> None:
+        raise NotImplementedError
+
+    def append_many(self, records: list[dict]) -> None:
+        for r in records:
+            self.append(r)
+
+    @abstractmethod
+    def iter_user(self, user_id: int, since: str | None = None, limit: int | None = None) -> Iterator[dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def iter_all(self) -> Iterator[dict]:
+        raise NotImplementedError
+
+
+class JsonUserRepository(UserRepository):
+    # users.json остаётся обычным JSON-массивом; поиск по имени/id и выдача следующего id идут
+    # через UserIndex, новая запись дописывается в конец массива без перезаписи файла.
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.index = UserIndex(self.path)
+
+    def rebuild_index(self) -> int:
+        with file_lock(self.path):
+            return self._rebuild_index_locked()
+
+    def _rebuild_index_locked(self) -> int:
+        # Вызывать только под file_lock(self.path): пересборка подменяет каталог индекса целиком.
+        return self.index.rebuild(scan_json_array(self.path))
+
+    def _ensure_index(self, locked: bool = False) -> None:
+        if self.index.is_in_sync():
+            return
+        if locked:
+            self._rebuild_index_locked()
+            return
+        with file_lock(self.path):
+            # Пока ждали блокировку, индекс мог пересобрать другой процесс.
+            if not self.index.is_in_sync():
+                self._rebuild_index_locked()
+
+    def _read_indexed(self, entry: tuple[int, int, int] | None, key: str, value: Any, locked: bool = False) -> dict | None:
+        if entry is None:
+            return None
+        user = read_json_at(self.path, entry[1], entry[2])
+        if user is not None and user.get(key) == value:
+            return user
+        # Индекс разошёлся с файлом — пересобираем и ищем заново.
+        if locked:
+            self._rebuild_index_locked()
+        else:
+            self.rebuild_index()
+        entry = self.index.find_username(value) if key == "username" else self.index.find_id(value)
+        return read_json_at(self.path, entry[1], entry[2]) if entry is not None else None
+
+    def _get_by_username(self, username: str, locked: bool) -> dict | None:
+        self._ensure_index(locked)
+        return self._read_indexed(self.index.find_username(username), "username", username, locked)
+
+    def get_by_username(self, username: str) -> dict | None:
+        return self._get_by_username(username, locked=False)
+
+    def get_by_id(self, user_id: int) -> dict | None:
+        if not isinstance(user_id, int):
+            return None
+        self._ensure_index()
+        return self._read_indexed(self.index.find_id(user_id), "user_id", user_id)
+
+    def create(self, username: str, hashed_password: str, salt: str, registration_date: str) -> dict | None:
+        # Проверка имени, выдача id и дозапись — под одной блокировкой users.json.
+        with file_lock(self.path):
+            if self._get_by_username(username, locked=True) is not None:
+                return None
+
+            user = {
+                "user_id": self.index.last_id() + 1,
+                "username": username,
+                "hashed_password": hashed_password,
+                "salt": salt,
+                "registration_date": registration_date,
+            }
+            offset, length = append_json_array(self.path, user)
+            self.index.add(user["user_id"], username, offset, length)
+        return user
+
+    def iter_all(self) -> Iterator[dict]:
+        yield from _read_json_list(self.path)
+
+
+class JsonPortfolioRepository(PortfolioRepository):
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._changes = _ChangeTracker(lambda: (self.path,))
+
+    def get(self, user_id: int) -> dict | None:
+        for p in _read_json_list(self.path):
+            if p.get("user_id") == user_id:
+                return p
+        return None
+
+    def save(self, portfolio: dict) -> None:
+        self._commit(portfolio, None)
+
+    def _commit(self, portfolio: dict, expected_version: int | None) -> bool:
+        with file_lock(self.path):
+            portfolios = _read_json_list(self.path)
+            for i, p in enumerate(portfolios):
+                if p.get("user_id") == portfolio.get("user_id"):
+                    break
+            else:
+                i, p = len(portfolios), None
+                portfolios.append(portfolio)
+            version = _portfolio_version(p)
+            if expected_version is not None and version != expected_version:
+                return False
+            portfolio["version"] = version + 1
+            portfolios[i] = portfolio
+            with self._changes.own_write(self.path):
+                _write_json_atomic(self.path, portfolios)
+        return True
+
+    def get_many(self, user_ids: Iterable[int]) -> dict[int, dict]:
+        wanted = set(user_ids)
+        return {p["user_id"]: p for p in _read_json_list(self.path) if p.get("user_id") in wanted}
+
+    def save_many(self, portfolios: Iterable[dict]) -> None:
+        updates = {p["user_id"]: p for p in portfolios}
+        if not updates:
+            return
+        with file_lock(self.path):
+            items = _read_json_list(self.path)
+            for i, p in enumerate(items):
+                uid = p.get("user_id")
+                if uid in updates:
+                    items[i] = updates.pop(uid)
+            items.extend(updates.values())
+            with self._changes.own_write(self.path):
+                _write_json_atomic(self.path, items)
+
+    def iter_all(self) -> Iterator[dict]:
+        yield from _read_json_list(self.path)
+
+    def change_stamp(self) -> object:
+        return self._changes.stamp()
+
+
+class ShardedJsonPortfolioRepository(PortfolioRepository):
+    # Портфель каждого пользователя — отдельный файл <root>/<shard>/<user_id>.json: сделка читает
+    # и атомарно заменяет только свой файл, независимо от числа пользователей.
+    def __init__(self, root_dir: Path, shards: int = 256):
+        if not isinstance(shards, int) or not (1 <= shards <= 4096):
+            raise ValueError("shards invalid")
+        self.root_dir = Path(root_dir)
+        self.shards = shards
+        # Запись шарда — атомарная подмена файла в его каталоге, поэтому достаточно stat каталогов.
+        self._changes = _ChangeTracker(self._shard_dirs)
+
+    def _path(self, user_id: int) -> Path:
+        return self.root_dir / f"{user_id % self.shards:03x}" / f"{user_id}.json"
+
+    def exists(self) -> bool:
+        return self.root_dir.is_dir()
+
+    def _shard_dirs(self) -> list[Path]:
+        if not self.root_dir.is_dir():
+            return []
+        return sorted(p for p in self.root_dir.iterdir() if p.is_dir() and not p.name.startswith("."))
+
+    def change_stamp(self) -> object:
+        return self._changes.stamp()
+
+    def get(self, user_id: int) -> dict | None:
+        if not isinstance(user_id, int):
+            return None
+        data = _read_json(self._path(user_id), None)
+        return data if isinstance(data, dict) else None
+
+    def save(self, portfolio: dict) -> None:
+        self._commit(portfolio, None)
+
+    def save_many(self, portfolios: Iterable[dict]) -> None:
+        for p in portfolios:
+            path = self._path(p["user_id"])
+            with file_lock(path.parent), self._changes.own_write(path.parent):
+                _write_json_atomic(path, p)
+
+    def _commit(self, portfolio: dict, expected_version: int | None) -> bool:
+        path = self._path(portfolio["user_id"])
+        # Блокировка на шард: писатели разных шардов не мешают друг другу.
+        with file_lock(path.parent):
+            version = _portfolio_version(_read_json(path, None))
+            if expected_version is not None and version != expected_version:
+                return False
+            portfolio["version"] = version + 1
+            with self._changes.own_write(path.parent):
+                _write_json_atomic(path, portfolio)
+        return True
+
+    def iter_all(self) -> Iterator[dict]:
+        if not self.root_dir.exists():
+            return
+        ids = []
+        for path in self.root_dir.glob("*/*.json"):
+            if path.stem.isdigit():
+                ids.append(int(path.stem))
+        for user_id in sorted(ids):
+            p = self.get(user_id)
+            if p is not None:
+                yield p
+
+    def import_all(self, portfolios: Iterable[dict]) -> int:
+        # Раскладываем файлы во временный каталог и подменяем целиком — прерванный перенос
+        # не оставит наполовину заполненных шардов.
+        tmp = ShardedJsonPortfolioRepository(make_temp_dir(self.root_dir), self.shards)
+        count = 0
+        for p in portfolios:
+            if isinstance(p, dict) and isinstance(p.get("user_id"), int):
+                _write_json_atomic(tmp._path(p["user_id"]), p)
+                count += 1
+        if self.root_dir.exists():
+            shutil.rmtree(self.root_dir)
+        tmp.root_dir.replace(self.root_dir)
+        return count
+
+
+class WalPortfolioRepository(PortfolioRepository):
+    # Сделка дописывает в журнал только изменённые кошельки; основное хранилище (base)
+    # перезаписывается раз в WAL_CHECKPOINT_RECORDS записей или WAL_CHECKPOINT_SECONDS секунд.
+    # Запись в журнал и checkpoint идут под одной блокировкой журнала.
+    def __init__(self, base: PortfolioRepository, wal_path: Path, checkpoint_records: int = 100, checkpoint_seconds: int = 60):
+        self.base = base
+        self.wal = PortfolioWal(wal_path)
+        # Все записи, свои и чужие, идут через журнал (сделка — дозапись, checkpoint — подмена файла).
+        self._changes = _ChangeTracker(lambda: (self.wal.path,))
+        self.checkpoint_records = checkpoint_records
+        self.checkpoint_seconds = checkpoint_seconds
+        # Восстановление: всё, что осталось в журнале с прошлого запуска, сразу переносим в base.
+        self.checkpoint()
+
+    def _merge(self, user_id: int, portfolio: dict | None) -> dict | None:
+        balances = self.wal.balances.get(user_id)
+        if balances is None:
+            return portfolio
+        p = copy.deepcopy(portfolio) if portfolio is not None else {"user_id": user_id, "wallets": {}}
+        wallets = p.get("wallets")
+        if not isinstance(wallets, dict):
+            wallets = {}
+            p["wallets"] = wallets
+        for code, balance in balances.items():
+            entry = wallets.get(code)
+            if isinstance(entry, dict):
+                entry["balance"] = balance
+            else:
+                wallets[code] = {"balance": balance}
+        if user_id in self.wal.versions:
+            p["version"] = self.wal.versions[user_id]
+        return p
+
+    def get(self, user_id: int) -> dict | None:
+        self.wal.refresh()
+        return self._merge(user_id, self.base.get(user_id))
+
+    def save(self, portfolio: dict) -> None:
+        self._commit(portfolio, None)
+
+    def _commit(self, portfolio: dict, expected_version: int | None) -> bool:
+        user_id = portfolio["user_id"]
+        with file_lock(self.wal.path):
+            current = self.get(user_id) or {"wallets": {}}
+            version = _portfolio_version(current)
+            if expected_version is not None and version != expected_version:
+                return False
+            old_wallets = current.get("wallets") if isinstance(current.get("wallets"), dict) else {}
+            changes = {}
+            for code, entry in (portfolio.get("wallets") or {}).items():
+                bal = entry.get("balance", 0.0) if isinstance(entry, dict) else 0.0
+                bal = float(bal) if isinstance(bal, (int, float)) else 0.0
+                old = old_wallets.get(code)
+                if isinstance(old, dict) and isinstance(old.get("balance"), (int, float)):
+                    if float(old["balance"]) == bal:
+                        continue
+                    changes[code] = (bal - float(old["balance"]), bal)
+                else:
+                    changes[code] = (bal, bal)
+            portfolio["version"] = version
+            if changes:
+                portfolio["version"] = version + 1
+                with self._changes.own_write(self.wal.path):
+                    self.wal.append(user_id, changes, version + 1)
+        if self._checkpoint_due():
+            self.checkpoint()
+        return True
+
+    def iter_all(self) -> Iterator[dict]:
+        self.wal.refresh()
+        pending = set(self.wal.balances)
+        for p in self.base.iter_all():
+            user_id = p.get("user_id")
+            pending.discard(user_id)
+            yield self._merge(user_id, p)
+        for user_id in sorted(pending):
+            yield self._merge(user_id, None)
+
+    def _checkpoint_due(self) -> bool:
+        if self.wal.count >= self.checkpoint_records:
+            return True
+        return self.wal.first_ts is not None and time.time() - self.wal.first_ts >= self.checkpoint_seconds
+
+    def checkpoint(self) -> int:
+        with file_lock(self.wal.path):
+            self.wal.refresh()
+            if not self.wal.count:
+                return 0
+            current = self.base.get_many(self.wal.balances)
+            self.base.save_many(self._merge(user_id, current.get(user_id)) for user_id in list(self.wal.balances))
+            folded = self.wal.count
+            with self._changes.own_write(self.wal.path):
+                self.wal.reset()
+        return folded
+
+    def change_stamp(self) -> object:
+        return self._changes.stamp()
+
+
+class JsonSessionRepository(SessionRepository):
+    def __init__(self, path: Path):
+        self.path = Path(path)
+
+    def get(self) -> dict:
+        return _read_json_dict(self.path)
+
+    def set(self, session: dict) -> None:
+        _write_json_atomic(self.path, session)
+
+
+class JsonRatesRepository(RatesRepository):
+    # Снимок курсов — rates.json, история — в формате HISTORY_FORMAT (см. parser_service.history_files).
+    def __init__(self, snapshot_path: Path):
+        self.snapshot_path = Path(snapshot_path)
+        self._cache = FileCache(self.snapshot_path, _read_json_dict)
+
+    def get_snapshot(self) -> dict:
+        return self._cache.get()
+
+    def save_snapshot(self, snapshot: dict) -> None:
+        _write_json_atomic(self.snapshot_path, snapshot)
+        self._cache.invalidate()
+
+    def append_measurements(self, records: list[dict]) -> list[bool]:
+        return history_files.append_validated(records)
+
+    def iter_measurements(
+        self,
+        from_currency: str | None = None,
+        to_currency: str | None = None,
+        since: str | None = None,
+        until: str | None = None,
+    ) -> Iterator[dict]:
+        return history_files.iter_history(since=since, until=until, from_currency=from_currency, to_currency=to_currency)
+
+
+class JsonTradeRepository(TradeRepository):
+    def __init__(self, path: Path):
+        self.ledger = TradeLedger(path)
+
+    def append(self, record: dict) -> None:
+        self.ledger.append_many([record])
+
+    def append_many(self, records: list[dict]) -> None:
+        self.ledger.append_many(records)
+
+    def iter_user(self, user_id: int, since: str | None = None, limit: int | None = None) -> Iterator[dict]:
+        return self.ledger.iter_user(user_id, trade_ts(since) if since is not None else None, limit)
+
+    def iter_all(self) -> Iterator[dict]:
+        return self.ledger.iter_all()
+
+
+class InMemoryUserRepository(UserRepository):
+    def __init__(self, users: list[dict] | None = None):
+        self._by_id: dict[int, dict] = {}
+        self._by_name: dict[str, int] = {}
+        self._last_id = 0
+        for u in users or []:
+            self._by_id[u["user_id"]] = copy.deepcopy(u)
+            self._by_name[u["username"]] = u["user_id"]
+            self._last_id = max(self._last_id, u["user_id"])
+
+    def get_by_username(self, username: str) -> dict | None:
+        uid = self._by_name.get(username)
+        return copy.deepcopy(self._by_id[uid]) if uid is not None else None
+
+    def get_by_id(self, user_id: int) -> dict | None:
+        u = self._by_id.get(user_id)
+        return copy.deepcopy(u) if u is not None else None
+
+    def create(self, username: str, hashed_password: str, salt: str, registration_date: str) -> dict | None:
+        if username in self._by_name:
+            return None
+        self._last_id += 1
+        user_id = self._last_id
+        user = {
+            "user_id": user_id,
+            "username": username,
+            "hashed_password": hashed_password,
+            "salt": salt,
+            "registration_date": registration_date,
+        }
+        self._by_id[user_id] = user
+        self._by_name[username] = user_id
+        return copy.deepcopy(user)
+
+    def iter_all(self) -> Iterator[dict]:
+        for u in list(self._by_id.values()):
+            yield copy.deepcopy(u)
+
+
+class InMemoryPortfolioRepository(PortfolioRepository):
+    def __init__(self, portfolios: list[dict] | None = None):
+        self._items: dict[int, dict] = {p["user_id"]: copy.deepcopy(p) for p in portfolios or []}
+
+    def get(self, user_id: int) -> dict | None:
+        p = self._items.get(user_id)
+        return copy.deepcopy(p) if p is not None else None
+
+    def save(self, portfolio: dict) -> None:
+        self._items[portfolio["user_id"]] = copy.deepcopy(portfolio)
+
+    def iter_all(self) -> Iterator[dict]:
+        for p in list(self._items.values()):
+            yield copy.deepcopy(p)
+
+    def change_stamp(self) -> object:
+        # Других писателей у портфелей в памяти процесса нет.
+        return 0
+
+
+class InMemorySessionRepository(SessionRepository):
+    def __init__(self, session: dict | None = None):
+        self._session = dict(session or {})
+
+    def get(self) -> dict:
+        return dict(self._session)
+
+    def set(self, session: dict) -> None:
+        self._session = dict(session)
+
+
+class InMemoryRatesRepository(RatesRepository):
+    def __init__(self, snapshot: dict | None = None, history: list[dict] | None = None):
+        self._snapshot = copy.deepcopy(snapshot or {})
+        self._history: dict[str, dict] = {}
+        self.append_measurements(list(history or []))
+
+    def get_snapshot(self) -> dict:
+        return self._snapshot
+
+    def save_snapshot(self, snapshot: dict) -> None:
+        self._snapshot = copy.deepcopy(snapshot)
+
+    def append_measurements(self, records: list[dict]) -> list[bool]:
+        out = []
+        for r in records:
+            if r["id"] in self._history:
+                out.append(False)
+                continue
+            self._history[r["id"]] = dict(r)
+            out.append(True)
+        return out
+
+    def iter_measurements(
+        self,
+        from_currency: str | None = None,
+        to_currency: str | None = None,
+        since: str | None = None,
+        until: str | None = None,
+    ) -> Iterator[dict]:
+        for r in list(self._history.values()):
+            if from_currency is not None and r["from_currency"] != from_currency:
+                continue
+            if to_currency is not None and r["to_currency"] != to_currency:
+                continue
+            if since is not None and r["timestamp"] < since:
+                continue
+            if until is not None and r["timestamp"] > until:
+                continue
+            yield dict(r)
+
+
+class InMemoryTradeRepository(TradeRepository):
+    def __init__(self, records: list[dict] | None = None):
+        self._by_user: dict[int, list[tuple[int, dict]]] = {}
+        self._all: list[dict] = []
+        self._lock = threading.Lock()
+        for r in records or []:
+            self.append(r)
+
+    def append(self, record: dict) -> None:
+        user_id = record.get("user_id")
+        if not isinstance(user_id, int):
+            return
+        with self._lock:
+            entries = self._by_user.setdefault(user_id, [])
+            ts = max(trade_ts(record.get("timestamp")) or 0, entries[-1][0] if entries else 0)
+            entries.append((ts, copy.deepcopy(record)))
+            self._all.append(entries[-1][1])
+
+    def iter_user(self, user_id: int, since: str | None = None, limit: int | None = None) -> Iterator[dict]:
+        entries = self._by_user.get(user_id, [])
+        start = bisect_left(entries, trade_ts(since), key=lambda e: e[0]) if since is not None else 0
+        if limit is not None:
+            start = max(start, len(entries) - limit)
+        return iter([copy.deepcopy(r) for _, r in entries[start:]])
+
+    def iter_all(self) -> Iterator[dict]:
+        return iter(list(self._all))
+
+
+class WriteBackPortfolioRepository(PortfolioRepository):
+    # Портфели, прочитанные за сеанс скрипта, живут в памяти; изменённые (dirty) уходят в target
+    # при flush. Запросы по всем портфелям сначала сбрасывают изменения.
+    # Вместе с каждым портфелем хранится его состояние на момент чтения (_loaded): flush пишет
+    # портфель через target.update, только если в target он всё ещё такой же, — иначе изменения
+    # сеанса по этому пользователю отбрасываются (и его сделки — через on_discard), остальные
+    # записываются, а затем поднимается ConcurrentUpdateError. Чужие сделки не затираются.
+    def __init__(self, target: PortfolioRepository, on_discard: Callable[[set[int]], None] | None = None):
+        self.target = target
+        self.on_discard = on_discard
+        self._items: dict[int, dict | None] = {}
+        self._loaded: dict[int, dict | None] = {}
+        self._dirty: set[int] = set()
+
+    def _current(self, user_id: int) -> dict | None:
+        if user_id not in self._items:
+            p = self.target.get(user_id)
+            self._loaded[user_id] = p
+            self._items[user_id] = copy.deepcopy(p)
+        return self._items[user_id]
+
+    def get(self, user_id: int) -> dict | None:
+        p = self._current(user_id)
+        return copy.deepcopy(p) if p is not None else None
+
+    def save(self, portfolio: dict) -> None:
+        self._current(portfolio["user_id"])
+        portfolio["version"] = _portfolio_version(portfolio) + 1
+        self._items[portfolio["user_id"]] = copy.deepcopy(portfolio)
+        self._dirty.add(portfolio["user_id"])
+
+    def _commit(self, portfolio: dict, expected_version: int | None) -> bool:
+        current = self._current(portfolio["user_id"])
+        if expected_version is not None and _portfolio_version(current) != expected_version:
+            return False
+        self.save(portfolio)
+        return True
+
+    def iter_all(self) -> Iterator[dict]:
+        self.flush()
+        return self.target.iter_all()
+
+    def iter_balances(self) -> Iterator[tuple[int, str, float]]:
+        self.flush()
+        return self.target.iter_balances()
+
+    def change_stamp(self) -> object:
+        return self.target.change_stamp()
+
+    def _write(self, user_id: int, portfolio: dict) -> dict:
+        loaded = self._loaded.get(user_id) or {"wallets": {}}
+
+        def apply(current: dict) -> dict:
+            if _portfolio_version(current) != _portfolio_version(loaded) or current.get("wallets") != loaded.get("wallets"):
+                raise ConcurrentUpdateError(f"портфель пользователя {user_id}")
+            current.clear()
+            current.update(copy.deepcopy(portfolio))
+            return current
+
+        # update возвращает тот же словарь, которому target при записи проставил новую версию.
+        return self.target.update(user_id, apply)
+
+    def flush(self) -> int:
+        written = 0
+        rejected: set[int] = set()
+        for uid in sorted(self._dirty):
+            p = self._items.get(uid)
+            if p is None:
+                continue
+            try:
+                stored = self._write(uid, p)
+            except ConcurrentUpdateError:
+                rejected.add(uid)
+                self._items.pop(uid, None)
+                self._loaded.pop(uid, None)
+                continue
+            self._items[uid] = stored
+            self._loaded[uid] = copy.deepcopy(stored)
+            written += 1
+        self._dirty.clear()
+        if rejected:
+            if self.on_discard is not None:
+                self.on_discard(rejected)
+            users = ", ".join(str(uid) for uid in sorted(rejected))
+            raise ConcurrentUpdateError(f"портфели пользователей {users}; их изменения за сеанс скрипта отменены")
+        return written
+
+
+class WriteBackSessionRepository(SessionRepository):
+    def __init__(self, target: SessionRepository):
+        self.target = target
+        self._session: dict | None = None
+        self._dirty = False
+
+    def get(self) -> dict:
+        if self._session is None:
+            self._session = self.target.get()
+        return dict(self._session)
+
+    def set(self, session: dict) -> None:
+        self._session = dict(session)
+        self._dirty = True
+
+    def flush(self) -> int:
+        if not self._dirty:
+            return 0
+        self.target.set(self._session)
+        self._dirty = False
+        return 1
+
+
+class WriteBackRatesRepository(RatesRepository):
+    # Снимок читается из target один раз; запись снимка и истории идёт сразу в target.
+    def __init__(self, target: RatesRepository):
+        self.target = target
+        self._snapshot: dict | None = None
+
+    def get_snapshot(self) -> dict:
+        if self._snapshot is None:
+            self._snapshot = self.target.get_snapshot()
+        return self._snapshot
+
+    def save_snapshot(self, snapshot: dict) -> None:
+        self.target.save_snapshot(snapshot)
+        self._snapshot = None
+
+    def append_measurements(self, records: list[dict]) -> list[bool]:
+        return self.target.append_measurements(records)
+
+    def iter_measurements(
+        self,
+        from_currency: str | None = None,
+        to_currency: str | None = None,
+        since: str | None = None,
+        until: str | None = None,
+    ) -> Iterator[dict]:
+        return self.target.iter_measurements(from_currency, to_currency, since=since, until=until)
+
+
+class WriteBackTradeRepository(TradeRepository):
+    def __init__(self, target: TradeRepository):
+        self.target = target
+        self._pending: list[dict] = []
+
+    def append(self, record: dict) -> None:
+        self._pending.append(copy.deepcopy(record))
+
+    def append_many(self, records: list[dict]) -> None:
+        self._pending.extend(copy.deepcopy(records))
+
+    def discard_users(self, user_ids: set[int]) -> None:
+        # Сделки, чьи изменения портфеля не удалось записать, в журнал не попадают.
+        self._pending = [r for r in self._pending if r.get("user_id") not in user_ids]
+
+    def iter_user(self, user_id: int, since: str | None = None, limit: int | None = None) -> Iterator[dict]:
+        self.flush()
+        return self.target.iter_user(user_id, since, limit)
+
+    def iter_all(self) -> Iterator[dict]:
+        self.flush()
+        return self.target.iter_all()
+
+    def flush(self) -> int:
+        pending, self._pending = self._pending, []
+        self.target.append_many(pending)
+        return len(pending)
+
+
+class SqliteUserRepository(UserRepository):
+    def __init__(self, db: SqliteDatabase):
+        self.db = db
+
+    def get_by_username(self, username: str) -> dict | None:
+        return self.db.get_user(username)
+
+    def get_by_id(self, user_id: int) -> dict | None:
+        return self.db.get_user_by_id(user_id)
+
+    def create(self, username: str, hashed_password: str, salt: str, registration_date: str) -> dict | None:
+        user_id = self.db.create_user(username, hashed_password, salt, registration_date)
+        if user_id is None:
+            return None
+        return {
+            "user_id": user_id,
+            "username": username,
+            "hashed_password": hashed_password,
+            "salt": salt,
+            "registration_date": registration_date,
+        }
+
+    def iter_all(self) -> Iterator[dict]:
+        return self.db.iter_users()
+
+
+class SqlitePortfolioRepository(PortfolioRepository):
+    def __init__(self, db: SqliteDatabase):
+        self.db = db
+
+    def get(self, user_id: int) -> dict | None:
+        return self.db.get_portfolio(user_id)
+
+    def save(self, portfolio: dict) -> None:
+        self.db.save_portfolio(portfolio)
+
+    def update(self, user_id: int, fn: Callable[[dict], Any], retries: int = 10) -> Any:
+        return self.db.update_portfolio(user_id, fn)
+
+    def iter_all(self) -> Iterator[dict]:
+        return self.db.iter_portfolios()
+
+    def iter_balances(self) -> Iterator[tuple[int, str, float]]:
+        return self.db.iter_wallet_rows()
+
+    def change_stamp(self) -> object:
+        # data_version своего соединения меняется только от чужих коммитов; соединения — на поток.
+        return threading.get_ident(), self.db.data_version()
+
+
+class SqliteSessionRepository(SessionRepository):
+    def __init__(self, db: SqliteDatabase):
+        self.db = db
+
+    def get(self) -> dict:
+        return self.db.get_session()
+
+    def set(self, session: dict) -> None:
+        self.db.set_session(session)
+
+
+class SqliteRatesRepository(RatesRepository):
+    def __init__(self, db: SqliteDatabase):
+        self.db = db
+        self._local = threading.local()
+
+    def get_snapshot(self) -> dict:
+        # PRAGMA data_version меняется, когда базу изменило другое соединение; свои записи
+        # сбрасывают кеш в save_snapshot. Соединения потоковые, поэтому и кеш — на поток.
+        version = self.db.data_version()
+        cached = getattr(self._local, "snapshot", None)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        snap = self.db.get_rates_snapshot()
+        self._local.snapshot = (version, snap)
+        return snap
+
+    def save_snapshot(self, snapshot: dict) -> None:
+        self.db.save_rates_snapshot(snapshot)
+        self._local.snapshot = None
+
+    def append_measurements(self, records: list[dict]) -> list[bool]:
+        return self.db.append_measurements(records)
+
+    def iter_measurements(
+        self,
+        from_currency: str | None = None,
+        to_currency: str | None = None,
+        since: str | None = None,
+        until: str | None = None,
+    ) -> Iterator[dict]:
+        return iter(self.db.iter_measurements(from_currency, to_currency, since=since, until=until))
+
+
+class SqliteTradeRepository(TradeRepository):
+    def __init__(self, db: SqliteDatabase):
+        self.db = db
+
+    def append(self, record: dict) -> None:
+        self.db.append_trades([record])
+
+    def append_many(self, records: list[dict]) -> None:
+        self.db.append_trades(records)
+
+    def iter_user(self, user_id: int, since: str | None = None, limit: int | None = None) -> Iterator[dict]:
+        return self.db.iter_user_trades(user_id, trade_ts(since) if since is not None else None, limit)
+
+    def iter_all(self) -> Iterator[dict]:
+        return self.db.iter_trades()
+
+
+@dataclass(frozen=True)
+class Repositories:
+    users: UserRepository
+    portfolios: PortfolioRepository
+    sessions: SessionRepository
+    rates: RatesRepository
+    trades: TradeRepository
+
+
+def storage_backend() -> str:
+    backend = SETTINGS.get("STORAGE_BACKEND", "json")
+    if not isinstance(backend, str) or backend.strip().lower() not in ("json", "sqlite", "memory"):
+        return "json"
+    return backend.strip().lower()
+
+
+def migrate_portfolios_to_shards() -> int:
+    repo = ShardedJsonPortfolioRepository(Path(SETTINGS.get("PORTFOLIOS_DIR")))
+    return repo.import_all(JsonPortfolioRepository(Path(SETTINGS.get("PORTFOLIOS_JSON"))).iter_all())
+
+
+def rebuild_user_index() -> int:
+    return JsonUserRepository(Path(SETTINGS.get("USERS_JSON"))).rebuild_index()
+
+
+def _portfolio_repository() -> PortfolioRepository:
+    if SETTINGS.get("PORTFOLIOS_LAYOUT", "single") != "sharded":
+        repo: PortfolioRepository = JsonPortfolioRepository(Path(SETTINGS.get("PORTFOLIOS_JSON")))
+    else:
+        repo = ShardedJsonPortfolioRepository(Path(SETTINGS.get("PORTFOLIOS_DIR")))
+        if not repo.exists():
+            migrate_portfolios_to_shards()
+    if not SETTINGS.get("PORTFOLIOS_WAL", False):
+        return repo
+    portfolios_json = Path(SETTINGS.get("PORTFOLIOS_JSON"))
+    return WalPortfolioRepository(
+        repo,
+        portfolios_json.with_suffix(portfolios_json.suffix + ".wal"),
+        checkpoint_records=int(SETTINGS.get("WAL_CHECKPOINT_RECORDS", 100)),
+        checkpoint_seconds=int(SETTINGS.get("WAL_CHECKPOINT_SECONDS", 60)),
+    )
+
+
+def json_repositories() -> Repositories:
+    return Repositories(
+        users=JsonUserRepository(Path(SETTINGS.get("USERS_JSON"))),
+        portfolios=_portfolio_repository(),
+        sessions=JsonSessionRepository(Path(SETTINGS.get("SESSION_JSON"))),
+        rates=JsonRatesRepository(Path(SETTINGS.get("RATES_JSON"))),
+        trades=JsonTradeRepository(Path(SETTINGS.get("TRADES_JSONL"))),
+    )
+
+
+def sqlite_repositories(db: SqliteDatabase | None = None) -> Repositories:
+    db = db or get_database()
+    return Repositories(
+        users=SqliteUserRepository(db),
+        portfolios=SqlitePortfolioRepository(db),
+        sessions=SqliteSessionRepository(db),
+        rates=SqliteRatesRepository(db),
+        trades=SqliteTradeRepository(db),
+    )
+
+
+def memory_repositories(seed: Repositories | None = None) -> Repositories:
+    if seed is None:
+        return Repositories(
+            users=InMemoryUserRepository(),
+            portfolios=InMemoryPortfolioRepository(),
+            sessions=InMemorySessionRepository(),
+            rates=InMemoryRatesRepository(),
+            trades=InMemoryTradeRepository(),
+        )
+    return Repositories(
+        users=InMemoryUserRepository(list(seed.users.iter_all())),
+        portfolios=InMemoryPortfolioRepository(list(seed.portfolios.iter_all())),
+        sessions=InMemorySessionRepository(seed.sessions.get()),
+        rates=InMemoryRatesRepository(seed.rates.get_snapshot(), list(seed.rates.iter_measurements())),
+        trades=InMemoryTradeRepository(list(seed.trades.iter_all())),
+    )
+
+
+def write_back_repositories(target: Repositories) -> Repositories:
+    # Режим скрипта: состояние держится в памяти между командами, на диск — по flush_repositories().
+    # Пользователи пишутся сразу, чтобы user_id совпадали с хранилищем.
+    trades = WriteBackTradeRepository(target.trades)
+    return Repositories(
+        users=target.users,
+        portfolios=WriteBackPortfolioRepository(target.portfolios, on_discard=trades.discard_users),
+        sessions=WriteBackSessionRepository(target.sessions),
+        rates=WriteBackRatesRepository(target.rates),
+        trades=trades,
+    )
+
+
+def flush_repositories(repos: Repositories) -> int:
+    # Портфели — раньше журнала сделок: после сбоя между ними потеряется запись в журнале, а не баланс.
+    # Конфликт записи портфелей не мешает сбросить остальное; ошибка поднимается в конце.
+    flushed = 0
+    conflict: ConcurrentUpdateError | None = None
+    for repo in (repos.portfolios, repos.trades, repos.sessions):
+        flush = getattr(repo, "flush", None)
+        if flush is None:
+            continue
+        try:
+            flushed += flush()
+        except ConcurrentUpdateError as e:
+            conflict = e
+    if conflict is not None:
+        raise conflict
+    return flushed
+
+
+_OVERRIDE: Repositories | None = None
+_CACHE: dict[tuple, Repositories] = {}
+
+
+def set_repositories(repos: Repositories | None) -> Repositories | None:
+    # Подмена хранилища целиком (бенчмарки, прогон на in-memory данных); None — вернуть выбор по настройкам.
+    # Возвращает предыдущую подмену, чтобы её можно было восстановить.
+    global _OVERRIDE
+    previous, _OVERRIDE = _OVERRIDE, repos
+    return previous
+
+
+def get_repositories() -> Repositories:
+    if _OVERRIDE is not None:
+        return _OVERRIDE
+
+    backend = storage_backend()
+    if backend == "memory":
+        key = ("memory",)
+    elif backend == "sqlite":
+        key = ("sqlite", SETTINGS.get("SQLITE_PATH"))
+    else:
+        key = (
+            "json",
+            SETTINGS.get("USERS_JSON"),
+            SETTINGS.get("PORTFOLIOS_JSON"),
+            SETTINGS.get("PORTFOLIOS_LAYOUT"),
+            SETTINGS.get("PORTFOLIOS_DIR"),
+            SETTINGS.get("PORTFOLIOS_WAL"),
+            SETTINGS.get("SESSION_JSON"),
+            SETTINGS.get("RATES_JSON"),
+            SETTINGS.get("TRADES_JSONL"),
+        )
+
+    repos = _CACHE.get(key)
+    if repos is None:
+        if backend == "memory":
+            # Стартовые данные берём из JSON-файлов один раз, дальше — без дискового I/O.
+            repos = memory_repositories(seed=json_repositories())
+        elif backend == "sqlite":
+            repos = sqlite_repositories()
+        else:
+            repos = json_repositories()
+        _CACHE[key] = repos
+    return repos
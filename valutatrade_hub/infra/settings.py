@@ -108,8 +108,83 @@ class SettingsLoader:
 
         users_json = cfg.get("USERS_JSON", cfg.get("users_json", str(data_dir_path / "users.json")))
         portfolios_json = cfg.get("PORTFOLIOS_JSON", cfg.get("portfolios_json", str(data_dir_path / "portfolios.json")))
+        portfolios_layout = cfg.get("PORTFOLIOS_LAYOUT", cfg.get("portfolios_layout", "single"))
+        if not isinstance(portfolios_layout, str) or portfolios_layout.strip().lower() not in ("single", "sharded"):
+            portfolios_layout = "single"
+        portfolios_layout = portfolios_layout.strip().lower()
+        portfolios_dir = cfg.get("PORTFOLIOS_DIR", cfg.get("portfolios_dir", None))
+        portfolios_wal = cfg.get("PORTFOLIOS_WAL", cfg.get("portfolios_wal", False))
+        if not isinstance(portfolios_wal, bool):
+            portfolios_wal = str(portfolios_wal).strip().lower() in ("1", "true", "yes", "on")
+        wal_records = cfg.get("WAL_CHECKPOINT_RECORDS", cfg.get("wal_checkpoint_records", 100))
+        try:
+            wal_records = int(wal_records)
+        except Exception:
+            wal_records = 100
+        if wal_records <= 0:
+            wal_records = 100
+        wal_seconds = cfg.get("WAL_CHECKPOINT_SECONDS", cfg.get("wal_checkpoint_seconds", 60))
+        try:
+            wal_seconds = int(wal_seconds)
+        except Exception:
+            wal_seconds = 60
+        if wal_seconds <= 0:
+            wal_seconds = 60
+        script_flush = cfg.get("SCRIPT_FLUSH_EVERY", cfg.get("script_flush_every", 100))
+        try:
+            script_flush = int(script_flush)
+        except Exception:
+            script_flush = 100
+        if script_flush <= 0:
+            script_flush = 100
+        update_deadline = cfg.get("UPDATE_DEADLINE_SECONDS", cfg.get("update_deadline_seconds", 15))
+        try:
+            update_deadline = float(update_deadline)
+        except Exception:
+            update_deadline = 15.0
+        if not update_deadline > 0:
+            update_deadline = 15.0
         rates_json = cfg.get("RATES_JSON", cfg.get("rates_json", str(data_dir_path / "rates.json")))
         session_json = cfg.get("SESSION_JSON", cfg.get("session_json", str(data_dir_path / "session.json")))
+        trades_jsonl = cfg.get("TRADES_JSONL", cfg.get("trades_jsonl", None))
+        daemon_socket = cfg.get("DAEMON_SOCKET", cfg.get("daemon_socket", None))
+        http_cache_json = cfg.get("HTTP_CACHE_JSON", cfg.get("http_cache_json", None))
+        provider_health_json = cfg.get("PROVIDER_HEALTH_JSON", cfg.get("provider_health_json", None))
+        quote_host = cfg.get("QUOTE_SERVER_HOST", cfg.get("quote_server_host", "127.0.0.1"))
+        if not isinstance(quote_host, str) or not quote_host.strip():
+            quote_host = "127.0.0.1"
+        quote_host = quote_host.strip()
+        quote_port = cfg.get("QUOTE_SERVER_PORT", cfg.get("quote_server_port", 8765))
+        try:
+            quote_port = int(quote_port)
+        except Exception:
+            quote_port = 8765
+        if not 0 < quote_port < 65536:
+            quote_port = 8765
+        exchange_rates_json = cfg.get("EXCHANGE_RATES_JSON", cfg.get("exchange_rates_json", str(data_dir_path / "exchange_rates.json")))
+        exchange_rates_jsonl = cfg.get("EXCHANGE_RATES_JSONL", cfg.get("exchange_rates_jsonl", None))
+
+        history_format = cfg.get("HISTORY_FORMAT", cfg.get("history_format", "json"))
+        if not isinstance(history_format, str) or history_format.strip().lower() not in ("json", "jsonl", "partitioned", "columnar"):
+            history_format = "json"
+        history_format = history_format.strip().lower()
+
+        history_segments_dir = cfg.get("HISTORY_SEGMENTS_DIR", cfg.get("history_segments_dir", None))
+        history_segment = cfg.get("HISTORY_SEGMENT", cfg.get("history_segment", "day"))
+        if not isinstance(history_segment, str) or history_segment.strip().lower() not in ("day", "month"):
+            history_segment = "day"
+        history_segment = history_segment.strip().lower()
+
+        storage_backend = cfg.get("STORAGE_BACKEND", cfg.get("storage_backend", "json"))
+        if not isinstance(storage_backend, str) or storage_backend.strip().lower() not in ("json", "sqlite", "memory"):
+            storage_backend = "json"
+        storage_backend = storage_backend.strip().lower()
+        sqlite_path = cfg.get("SQLITE_PATH", cfg.get("sqlite_path", None))
+
+        history_columnar_dir = cfg.get("HISTORY_COLUMNAR_DIR", cfg.get("history_columnar_dir", None))
+        history_columnar = cfg.get("HISTORY_COLUMNAR", cfg.get("history_columnar", False))
+        if not isinstance(history_columnar, bool):
+            history_columnar = str(history_columnar).strip().lower() in ("1", "true", "yes", "on")
 
         def _as_path(value, default_path: Path) -> str:
             if not isinstance(value, str) or not value.strip():
@@ -122,9 +197,31 @@ class SettingsLoader:
             "DATA_DIR": str(data_dir_path),
             "USERS_JSON": _as_path(users_json, data_dir_path / "users.json"),
             "PORTFOLIOS_JSON": _as_path(portfolios_json, data_dir_path / "portfolios.json"),
+            "PORTFOLIOS_LAYOUT": portfolios_layout,
+            "PORTFOLIOS_DIR": _as_path(portfolios_dir, data_dir_path / "portfolios"),
+            "PORTFOLIOS_WAL": portfolios_wal,
+            "WAL_CHECKPOINT_RECORDS": wal_records,
+            "WAL_CHECKPOINT_SECONDS": wal_seconds,
+            "SCRIPT_FLUSH_EVERY": script_flush,
             "RATES_JSON": _as_path(rates_json, data_dir_path / "rates.json"),
             "SESSION_JSON": _as_path(session_json, data_dir_path / "session.json"),
+            "TRADES_JSONL": _as_path(trades_jsonl, data_dir_path / "trades.jsonl"),
+            "DAEMON_SOCKET": _as_path(daemon_socket, data_dir_path / "valutatrade.sock"),
+            "HTTP_CACHE_JSON": _as_path(http_cache_json, data_dir_path / "http_cache.json"),
+            "PROVIDER_HEALTH_JSON": _as_path(provider_health_json, data_dir_path / "provider_health.json"),
+            "QUOTE_SERVER_HOST": quote_host,
+            "QUOTE_SERVER_PORT": quote_port,
+            "EXCHANGE_RATES_JSON": _as_path(exchange_rates_json, data_dir_path / "exchange_rates.json"),
+            "EXCHANGE_RATES_JSONL": _as_path(exchange_rates_jsonl, data_dir_path / "exchange_rates.jsonl"),
+            "HISTORY_FORMAT": history_format,
+            "HISTORY_SEGMENTS_DIR": _as_path(history_segments_dir, data_dir_path / "history"),
+            "HISTORY_SEGMENT": history_segment,
+            "STORAGE_BACKEND": storage_backend,
+            "SQLITE_PATH": _as_path(sqlite_path, data_dir_path / "valutatrade.db"),
+            "HISTORY_COLUMNAR": history_columnar,
+            "HISTORY_COLUMNAR_DIR": _as_path(history_columnar_dir, data_dir_path / "columnar"),
             "RATES_TTL_SECONDS": ttl,
+            "UPDATE_DEADLINE_SECONDS": update_deadline,
             "BASE_CURRENCY": base,
             "LOG_DIR": str(log_dir_path),
             "LOG_LEVEL": log_level,
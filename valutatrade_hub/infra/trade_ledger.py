@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import struct
+from bisect import bisect_left
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterator
+
+from valutatrade_hub.infra.files import atomic_write_text, file_lock, make_temp_dir
+
+_META_NAME = "_meta.json"
+# Запись индекса: время сделки (секунды UTC), смещение и длина строки в журнале.
+_ENTRY = struct.Struct("<qqi")
+
+
+def trade_ts(value) -> int | None:
+    if not isinstance(value, str) or not value.strip():
+        return None
+    try:
+        dt = datetime.fromisoformat(value.strip())
+    except Exception:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+class TradeLedger:
+    # Журнал сделок: строка JSON на сделку в <path>, дописывается только в конец. Рядом —
+    # индекс <path>.idx/<shard>/<user_id>.idx с записями фиксированной ширины по каждому
+    # пользователю в порядке времени, поэтому выборка истории — двоичный поиск по since и чтение
+    # ровно тех строк, что попадут в ответ. _meta.json хранит, до какого байта журнал проиндексирован:
+    # хвост после сбоя между записью строки и индекса доиндексируется при следующем обращении.
+    def __init__(self, path: Path, shards: int = 256):
+        self.path = Path(path)
+        self.index_dir = self.path.with_name(self.path.name + ".idx")
+        self.shards = shards
+
+    def _index_path(self, user_id: int, root: Path | None = None) -> Path:
+        return (root or self.index_dir) / f"{user_id % self.shards:03x}" / f"{user_id}.idx"
+
+    def _indexed_size(self) -> int | None:
+        try:
+            meta = json.loads((self.index_dir / _META_NAME).read_text(encoding="utf-8"))
+        except Exception:
+            return None
+        size = meta.get("size") if isinstance(meta, dict) else None
+        return size if isinstance(size, int) else None
+
+    def _mark_indexed(self, size: int, root: Path | None = None) -> None:
+        atomic_write_text((root or self.index_dir) / _META_NAME, json.dumps({"size": size}))
+
+    def _ledger_size(self) -> int:
+        try:
+            return self.path.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def _iter_lines(self, start: int) -> Iterator[tuple[dict, int, int]]:
+        if not self.path.exists():
+            return
+        with self.path.open("rb") as fh:
+            fh.seek(start)
+            offset = start
+            for line in fh:
+                if not line.endswith(b"\n"):
+                    return
+                try:
+                    rec = json.loads(line)
+                except Exception:
+                    rec = None
+                if isinstance(rec, dict) and isinstance(rec.get("user_id"), int):
+                    yield rec, offset, len(line)
+                offset += len(line)
+
+    def _last_ts(self, path: Path) -> int:
+        try:
+            with path.open("rb") as fh:
+                size = fh.seek(0, os.SEEK_END)
+                size -= size % _ENTRY.size
+                if size == 0:
+                    return 0
+                fh.seek(size - _ENTRY.size)
+                return _ENTRY.unpack(fh.read(_ENTRY.size))[0]
+        except FileNotFoundError:
+            return 0
+
+    def _append_entries(self, user_id: int, entries: list[tuple[int, int, int]], root: Path | None = None) -> None:
+        # Время в индексе не убывает: при гонке часов между процессами берём не меньше предыдущего.
+        path = self._index_path(user_id, root)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        last = self._last_ts(path)
+        packed = []
+        for ts, offset, length in entries:
+            last = max(last, ts)
+            packed.append(_ENTRY.pack(last, offset, length))
+        with path.open("ab") as fh:
+            fh.write(b"".join(packed))
+
+    def _index_tail(self, start: int, root: Path | None = None) -> int:
+        end = start
+        batches: dict[int, list[tuple[int, int, int]]] = {}
+        for rec, offset, length in self._iter_lines(start):
+            ts = trade_ts(rec.get("timestamp")) or 0
+            batches.setdefault(rec["user_id"], []).append((ts, offset, length))
+            end = offset + length
+        for user_id, entries in batches.items():
+            self._append_entries(user_id, entries, root)
+        return end
+
+    def rebuild(self) -> int:
+        # Полная пересборка индекса во временном каталоге с последующей подменой.
+        with file_lock(self.path):
+            tmp = make_temp_dir(self.index_dir)
+            try:
+                size = self._index_tail(0, tmp)
+                self._mark_indexed(size, tmp)
+                if self.index_dir.exists():
+                    shutil.rmtree(self.index_dir)
+                os.replace(tmp, self.index_dir)
+            except BaseException:
+                shutil.rmtree(tmp, ignore_errors=True)
+                raise
+        return size
+
+    def _ensure_index(self) -> None:
+        indexed = self._indexed_size()
+        if indexed is None or indexed > self._ledger_size():
+            self.rebuild()
+            return
+        if indexed < self._ledger_size():
+            with file_lock(self.path):
+                indexed = self._indexed_size() or 0
+                if indexed < self._ledger_size():
+                    self._mark_indexed(self._index_tail(indexed))
+
+    def append_many(self, records: list[dict]) -> None:
+        # Все записи пакета — одной дозаписью и одним fsync.
+        records = [r for r in records if isinstance(r.get("user_id"), int)]
+        if not records:
+            return
+        lines = [json.dumps(r, ensure_ascii=False).encode("utf-8") + b"\n" for r in records]
+        self._ensure_index()
+        with file_lock(self.path):
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("a+b") as fh:
+                offset = fh.seek(0, os.SEEK_END)
+                prefix = b""
+                if offset > 0:
+                    fh.seek(-1, os.SEEK_END)
+                    if fh.read(1) != b"\n":
+                        # Оборванная строка после сбоя — новая запись начинается с новой строки.
+                        prefix = b"\n"
+                        offset += 1
+                fh.write(prefix + b"".join(lines))
+                fh.flush()
+                os.fsync(fh.fileno())
+            batches: dict[int, list[tuple[int, int, int]]] = {}
+            for rec, line in zip(records, lines):
+                batches.setdefault(rec["user_id"], []).append((trade_ts(rec.get("timestamp")) or 0, offset, len(line)))
+                offset += len(line)
+            for user_id, entries in batches.items():
+                self._append_entries(user_id, entries)
+            self._mark_indexed(offset)
+
+    def _read_entries(self, user_id: int) -> list[tuple[int, int, int]]:
+        try:
+            data = self._index_path(user_id).read_bytes()
+        except FileNotFoundError:
+            return []
+        usable = len(data) - len(data) % _ENTRY.size
+        return list(_ENTRY.iter_unpack(data[:usable]))
+
+    def iter_user(self, user_id: int, since: int | None = None, limit: int | None = None) -> Iterator[dict]:
+        # Сделки пользователя начиная с since (секунды UTC) в порядке времени; при limit — последние limit.
+        self._ensure_index()
+        entries = self._read_entries(user_id)
+        start = bisect_left(entries, (since,)) if since is not None else 0
+        if limit is not None:
+            start = max(start, len(entries) - limit)
+        if start >= len(entries):
+            return
+        with self.path.open("rb") as fh:
+            for _, offset, length in entries[start:]:
+                fh.seek(offset)
+                try:
+                    rec = json.loads(fh.read(length))
+                except Exception:
+                    continue
+                if isinstance(rec, dict):
+                    yield rec
+
+    def iter_all(self) -> Iterator[dict]:
+        for rec, _, _ in self._iter_lines(0):
+            yield rec
@@ -0,0 +1,207 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from valutatrade_hub.infra.files import atomic_write_text, make_temp_dir
+
+_META_NAME = "_meta.json"
+_WS = " \t\r\n"
+
+
+def scan_json_array(path: Path) -> Iterator[tuple[dict, int, int]]:
+    # Элементы JSON-массива вместе с байтовым смещением и длиной каждого в файле.
+    if not path.exists():
+        return
+    text = path.read_bytes().decode("utf-8")
+    decoder = json.JSONDecoder()
+
+    def skip(p: int) -> int:
+        while p < len(text) and text[p] in _WS:
+            p += 1
+        return p
+
+    pos = skip(0)
+    if pos >= len(text) or text[pos] != "[":
+        return
+    pos += 1
+    byte_pos = len(text[:pos].encode("utf-8"))
+    while True:
+        start = skip(pos)
+        if start >= len(text) or text[start] == "]":
+            return
+        try:
+            obj, end = decoder.raw_decode(text, start)
+        except ValueError:
+            return
+        byte_pos += len(text[pos:start].encode("utf-8"))
+        length = len(text[start:end].encode("utf-8"))
+        if isinstance(obj, dict):
+            yield obj, byte_pos, length
+        byte_pos += length
+        pos = skip(end)
+        if pos < len(text) and text[pos] == ",":
+            byte_pos += len(text[end : pos + 1].encode("utf-8"))
+            pos += 1
+        else:
+            byte_pos += len(text[end:pos].encode("utf-8"))
+
+
+def append_json_array(path: Path, item: dict) -> tuple[int, int]:
+    # Дописывает элемент в конец JSON-массива на месте, без перезаписи файла; формат — как у
+    # json.dumps(..., indent=2). Возвращает смещение и длину записи.
+    body = json.dumps(item, ensure_ascii=False, indent=2).replace("\n", "\n  ").encode("utf-8")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if not path.exists():
+        path.write_bytes(b"[]")
+
+    with path.open("r+b") as fh:
+        size = fh.seek(0, os.SEEK_END)
+        tail_start = max(0, size - 64)
+        fh.seek(tail_start)
+        tail = fh.read()
+        close = tail.rfind(b"]")
+        if close < 0:
+            raise ValueError(f"json is not a list: {path}")
+        before = tail[:close].rstrip()
+        # Пустой массив "[]" — без запятой перед первым элементом.
+        prefix = b"\n  " if before.endswith(b"[") else b",\n  "
+        pos = tail_start + len(before)
+        fh.seek(pos)
+        fh.truncate()
+        fh.write(prefix + body + b"\n]")
+        fh.flush()
+        os.fsync(fh.fileno())
+    offset = pos + len(prefix)
+    return offset, len(body)
+
+
+def read_json_at(path: Path, offset: int, length: int) -> dict | None:
+    try:
+        with path.open("rb") as fh:
+            fh.seek(offset)
+            data = json.loads(fh.read(length).decode("utf-8"))
+    except Exception:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+class UserIndex:
+    # Индекс users.json: имя пользователя и user_id → смещение записи в файле, разложенные по
+    # хеш-корзинам, плюс последовательность id в _meta.json. Пересобирается из users.json.
+    def __init__(self, data_path: Path, buckets: int = 256):
+        if not isinstance(buckets, int) or not (1 <= buckets <= 4096):
+            raise ValueError("buckets invalid")
+        self.data_path = Path(data_path)
+        self.index_dir = self.data_path.with_suffix(self.data_path.suffix + ".idx")
+        self.buckets = buckets
+
+    def _bucket_of(self, key: str) -> int:
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=4).digest()
+        return int.from_bytes(digest, "big") % self.buckets
+
+    def _bucket_path(self, bucket: int) -> Path:
+        return self.index_dir / f"{bucket:03x}.idx"
+
+    def _data_stamp(self) -> dict:
+        try:
+            st = self.data_path.stat()
+        except FileNotFoundError:
+            return {"size": None, "mtime_ns": None}
+        return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+    def _read_meta(self) -> dict:
+        path = self.index_dir / _META_NAME
+        if not path.exists():
+            return {}
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except Exception:
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def _write_meta(self, last_id: int) -> None:
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        meta = {"buckets": self.buckets, "last_id": last_id, **self._data_stamp()}
+        atomic_write_text(self.index_dir / _META_NAME, json.dumps(meta))
+
+    def is_in_sync(self) -> bool:
+        meta = self._read_meta()
+        if meta.get("buckets") != self.buckets or not isinstance(meta.get("last_id"), int):
+            return False
+        stamp = self._data_stamp()
+        return meta.get("size") == stamp["size"] and meta.get("mtime_ns") == stamp["mtime_ns"]
+
+    def last_id(self) -> int:
+        value = self._read_meta().get("last_id")
+        return value if isinstance(value, int) else 0
+
+    @staticmethod
+    def _lines(user_id: int, username: str, offset: int, length: int) -> list[tuple[str, str]]:
+        return [
+            ("u:" + username, json.dumps(["u", username, user_id, offset, length], ensure_ascii=False)),
+            (f"i:{user_id}", json.dumps(["i", str(user_id), user_id, offset, length])),
+        ]
+
+    def rebuild(self, entries: Iterable[tuple[dict, int, int]]) -> int:
+        grouped: dict[int, list[str]] = {}
+        last_id = 0
+        count = 0
+        for user, offset, length in entries:
+            user_id = user.get("user_id")
+            username = user.get("username")
+            if not isinstance(user_id, int) or not isinstance(username, str):
+                continue
+            last_id = max(last_id, user_id)
+            count += 1
+            for key, line in self._lines(user_id, username, offset, length):
+                grouped.setdefault(self._bucket_of(key), []).append(line)
+
+        # Сборка во временном каталоге с последующей подменой; вызывающий держит блокировку users.json.
+        tmp_dir = make_temp_dir(self.index_dir)
+        try:
+            for bucket, lines in grouped.items():
+                (tmp_dir / self._bucket_path(bucket).name).write_text("".join(x + "\n" for x in lines), encoding="utf-8")
+            if self.index_dir.exists():
+                shutil.rmtree(self.index_dir)
+            tmp_dir.replace(self.index_dir)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        self._write_meta(last_id)
+        return count
+
+    def _lookup(self, kind: str, key: str) -> tuple[int, int, int] | None:
+        path = self._bucket_path(self._bucket_of(f"{kind}:{key}"))
+        found = None
+        try:
+            with path.open("r", encoding="utf-8") as fh:
+                for line in fh:
+                    try:
+                        k, name, user_id, offset, length = json.loads(line)
+                    except Exception:
+                        continue
+                    if k == kind and name == key:
+                        found = (user_id, offset, length)
+        except FileNotFoundError:
+            return None
+        return found
+
+    def find_username(self, username: str) -> tuple[int, int, int] | None:
+        return self._lookup("u", username)
+
+    def find_id(self, user_id: int) -> tuple[int, int, int] | None:
+        return self._lookup("i", str(user_id))
+
+    def add(self, user_id: int, username: str, offset: int, length: int) -> None:
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        for key, line in self._lines(user_id, username, offset, length):
+            with self._bucket_path(self._bucket_of(key)).open("a", encoding="utf-8") as fh:
+                fh.write(line + "\n")
+                fh.flush()
+                os.fsync(fh.fileno())
+        self._write_meta(max(self.last_id(), user_id))
@@ -1,35 +1,331 @@
 from __future__ import annotations
 
+import hashlib
+import json
+import random
+import threading
+import time
 from abc import ABC, abstractmethod
+from email.utils import parsedate_to_datetime
+from pathlib import Path
 from time import perf_counter
+from typing import Any, Callable
+from urllib.parse import urlencode
 
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException
 
 from valutatrade_hub.core.exceptions import ApiRequestError
+from valutatrade_hub.infra.files import atomic_write_text
 from valutatrade_hub.parser_service.config import ParserConfig
 
+_sessions_lock = threading.Lock()
+_sessions: dict[str, requests.Session] = {}
+_caches: dict[str, ResponseCache] = {}
+
+
+def _retry_after_seconds(value: str | None) -> float | None:
+    if not value or not value.strip():
+        return None
+    v = value.strip()
+    try:
+        return max(0.0, float(v))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(v).timestamp() - time.time())
+    except Exception:
+        return None
+
+
+def _http_ts(value: str | None) -> float | None:
+    if not value or not value.strip():
+        return None
+    try:
+        return parsedate_to_datetime(value.strip()).timestamp()
+    except Exception:
+        return None
+
+
+def _cache_control(value: str | None) -> dict[str, str | None]:
+    out: dict[str, str | None] = {}
+    for part in (value or "").split(","):
+        name, eq, arg = part.strip().partition("=")
+        if name:
+            out[name.lower()] = arg.strip().strip('"') if eq else None
+    return out
+
+
+def _cache_key(url: str, params: dict | None) -> str:
+    # В URL ExchangeRate-API лежит ключ API, поэтому на диск попадает только хеш адреса.
+    query = urlencode(sorted((params or {}).items()))
+    return hashlib.sha256(f"{url}?{query}".encode("utf-8")).hexdigest()
+
+
+class CachedResponse:
+    # Ответ из кеша с тем же интерфейсом, что нужен клиентам от requests.Response.
+    status_code = 200
+
+    def __init__(self, text: str):
+        self.text = text
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class ResponseCache:
+    # Кеш успешных ответов источников в одном JSON-файле в каталоге данных: тело, ETag, Last-Modified
+    # и момент, до которого ответ свежий. Файл переписывается атомарно; при гонке процессов побеждает
+    # последняя запись, что для кеша безопасно.
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._entries: dict[str, dict] | None = None
+
+    def _load(self) -> dict[str, dict]:
+        if self._entries is None:
+            try:
+                data = json.loads(self.path.read_text(encoding="utf-8"))
+            except Exception:
+                data = {}
+            self._entries = {k: v for k, v in data.items() if isinstance(v, dict)} if isinstance(data, dict) else {}
+        return self._entries
+
+    def get(self, key: str) -> dict | None:
+        with self._lock:
+            entry = self._load().get(key)
+            return dict(entry) if entry is not None else None
+
+    def put(self, key: str, entry: dict | None) -> None:
+        with self._lock:
+            entries = self._load()
+            if entry is None:
+                if entries.pop(key, None) is None:
+                    return
+            else:
+                entries[key] = entry
+            atomic_write_text(self.path, json.dumps(entries, ensure_ascii=False, indent=2))
+
+
+def _no_cache_write() -> None:
+    return None
+
+
+def close_sessions() -> None:
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.close()
+
 
 class BaseApiClient(ABC):
+    # Сессия requests общая для всех экземпляров клиента в процессе: планировщик, демон и повторные
+    # update-rates переиспользуют keep-alive соединения вместо нового TCP/TLS-рукопожатия на каждый запрос.
     def __init__(self, config: ParserConfig):
         self.config = config
 
+    @property
+    def session(self) -> requests.Session:
+        key = type(self).__name__
+        session = _sessions.get(key)
+        if session is None:
+            with _sessions_lock:
+                session = _sessions.get(key)
+                if session is None:
+                    cfg = self.config
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=cfg.HTTP_POOL_CONNECTIONS, pool_maxsize=cfg.HTTP_POOL_MAXSIZE, max_retries=0)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    _sessions[key] = session
+        return session
+
+    def _backoff(self, attempt: int, retry_after: float | None) -> float | None:
+        # Пауза перед повтором номер attempt (с нуля) или None, если повторять не нужно.
+        cfg = self.config
+        if attempt >= cfg.RETRY_ATTEMPTS:
+            return None
+        delay = random.uniform(0, min(cfg.RETRY_BACKOFF_MAX, cfg.RETRY_BACKOFF_BASE * (2**attempt)))
+        if retry_after is not None:
+            if retry_after > cfg.RETRY_BACKOFF_MAX:
+                return None
+            delay = max(delay, retry_after)
+        return delay
+
+    @property
+    def cache(self) -> ResponseCache | None:
+        path = self.config.HTTP_CACHE_PATH
+        if not path:
+            return None
+        with _sessions_lock:
+            cache = _caches.get(path)
+            if cache is None:
+                cache = _caches[path] = ResponseCache(Path(path))
+        return cache
+
+    def provider_fresh_until(self, resp) -> float | None:
+        # Момент следующего обновления данных, если источник сообщает его в теле ответа.
+        return None
+
+    def _fresh_until(self, headers, resp, now: float) -> float | None:
+        # До какого момента ответ можно отдавать без запроса; None — ответ хранить нельзя (no-store).
+        cc = _cache_control(headers.get("Cache-Control"))
+        if "no-store" in cc:
+            return None
+        fresh = now
+        if "no-cache" not in cc:
+            try:
+                max_age = int(cc["max-age"]) if cc.get("max-age") is not None else None
+            except ValueError:
+                max_age = None
+            if max_age is not None:
+                try:
+                    age = int(headers.get("Age") or 0)
+                except ValueError:
+                    age = 0
+                fresh = now + max(0, max_age - age)
+            else:
+                expires = _http_ts(headers.get("Expires"))
+                if expires is not None:
+                    fresh = expires
+        # Источник сам знает, когда обновит данные: до этого момента повторный запрос ничего не даст.
+        try:
+            provider = self.provider_fresh_until(resp)
+        except Exception:
+            provider = None
+        if provider is not None and provider > fresh:
+            fresh = provider
+        return fresh
+
+    def _get_cached(self, url: str, params: dict | None = None) -> tuple[Any, Callable[[], None]]:
+        # Свежий ответ из кеша — без сети; устаревший — условным запросом (If-None-Match /
+        # If-Modified-Since), и на 304 отдаётся сохранённое тело с обновлённым сроком свежести.
+        # Запись в кеш возвращается отдельно: клиент вызывает её, только когда разобрал из ответа
+        # курсы, иначе ответ-ошибка со статусом 200 отдавался бы из кеша до истечения max-age.
+        cache = self.cache
+        if cache is None:
+            return self._get(url, params=params), _no_cache_write
+        key = _cache_key(url, params)
+        entry = cache.get(key)
+        now = time.time()
+        if entry is not None and isinstance(entry.get("body"), str):
+            if float(entry.get("fresh_until") or 0) > now:
+                return CachedResponse(entry["body"]), _no_cache_write
+        else:
+            entry = None
+
+        headers = {}
+        if entry is not None and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry is not None and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        resp = self._get(url, params=params, headers=headers)
+
+        if resp.status_code == 304 and entry is not None:
+            cached = CachedResponse(entry["body"])
+            fresh = self._fresh_until(resp.headers, cached, now)
+            if fresh is None:
+                cache.put(key, None)
+                return cached, _no_cache_write
+            entry["fresh_until"] = fresh
+            entry["etag"] = resp.headers.get("ETag") or entry.get("etag")
+            entry["last_modified"] = resp.headers.get("Last-Modified") or entry.get("last_modified")
+            return cached, lambda: cache.put(key, entry)
+
+        if resp.status_code == 200:
+            fresh = self._fresh_until(resp.headers, resp, now)
+            etag = resp.headers.get("ETag")
+            last_modified = resp.headers.get("Last-Modified")
+            if fresh is None:
+                cache.put(key, None)
+            elif fresh > now or etag or last_modified:
+                new_entry = {
+                    "source": type(self).__name__,
+                    "stored_at": now,
+                    "fresh_until": fresh,
+                    "etag": etag,
+                    "last_modified": last_modified,
+                    "body": resp.text,
+                }
+                return resp, lambda: cache.put(key, new_entry)
+        return resp, _no_cache_write
+
+    def _get(self, url: str, params: dict | None = None, headers: dict | None = None) -> requests.Response:
+        # GET с повторами при сетевых ошибках и статусах из RETRY_STATUSES. После исчерпания попыток
+        # возвращает последний ответ (статус проверяет вызывающий) или пробрасывает последнюю ошибку.
+        attempt = 0
+        while True:
+            try:
+                resp = self.session.get(url, params=params, headers=headers, timeout=self.config.REQUEST_TIMEOUT)
+            except RequestException:
+                delay = self._backoff(attempt, None)
+                if delay is None:
+                    raise
+            else:
+                if resp.status_code not in self.config.RETRY_STATUSES:
+                    return resp
+                delay = self._backoff(attempt, _retry_after_seconds(resp.headers.get("Retry-After")))
+                if delay is None:
+                    return resp
+                resp.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def cache_fresh(self, at: float | None = None) -> bool:
+        # Будет ли к моменту at ответ на запрос курсов взят из кеша без обращения к сети.
+        cache = self.cache
+        if cache is None:
+            return False
+        try:
+            url, params = self.request_target()
+        except Exception:
+            return False
+        entry = cache.get(_cache_key(url, params))
+        if entry is None or not isinstance(entry.get("body"), str):
+            return False
+        return float(entry.get("fresh_until") or 0) > (time.time() if at is None else at)
+
+    def warm_up_url(self) -> str | None:
+        return None
+
+    def warm_up(self) -> None:
+        # Открыть соединение заранее, чтобы запрос курсов не ждал рукопожатия. Ошибки не важны.
+        url = self.warm_up_url()
+        if not url:
+            return
+        try:
+            self.session.head(url, timeout=self.config.REQUEST_TIMEOUT).close()
+        except RequestException:
+            pass
+
+    @abstractmethod
+    def request_target(self) -> tuple[str, dict | None]:
+        # URL и параметры запроса курсов — по ним же ищется запись в кеше ответов.
+        raise NotImplementedError
+
     @abstractmethod
     def fetch_rates(self) -> dict[str, float]:
         raise NotImplementedError
 
 
 class CoinGeckoClient(BaseApiClient):
+    def warm_up_url(self) -> str | None:
+        return self.config.COINGECKO_URL
+
+    def request_target(self) -> tuple[str, dict | None]:
+        return self.config.COINGECKO_URL, self.config.coingecko_simple_price_params()
+
     def fetch_rates(self) -> dict[str, float]:
         cfg = self.config
         cfg.validate()
 
-        params = cfg.coingecko_simple_price_params()
-        url = cfg.COINGECKO_URL
+        url, params = self.request_target()
 
         started = perf_counter()
         try:
-            resp = requests.get(url, params=params, timeout=cfg.REQUEST_TIMEOUT)
+            resp, commit_cache = self._get_cached(url, params=params)
         except RequestException as e:
             raise ApiRequestError(f"CoinGecko network error: {e}")
 
@@ -80,20 +376,32 @@ class CoinGeckoClient(BaseApiClient):
             raise ApiRequestError("CoinGecko returned no usable rates")
 
         _ = elapsed_ms
+        commit_cache()
         return out
 
 
 class ExchangeRateApiClient(BaseApiClient):
+    def warm_up_url(self) -> str | None:
+        return self.config.EXCHANGERATE_API_URL
+
+    def provider_fresh_until(self, resp) -> float | None:
+        data = resp.json()
+        ts = data.get("time_next_update_unix") if isinstance(data, dict) else None
+        return float(ts) if isinstance(ts, (int, float)) and not isinstance(ts, bool) else None
+
+    def request_target(self) -> tuple[str, dict | None]:
+        return self.config.exchangerate_latest_url(self.config.BASE_FIAT_CURRENCY), None
+
     def fetch_rates(self) -> dict[str, float]:
         cfg = self.config
         cfg.validate()
 
         base = cfg.BASE_FIAT_CURRENCY.strip().upper()
-        url = cfg.exchangerate_latest_url(base)
+        url, params = self.request_target()
 
         started = perf_counter()
         try:
-            resp = requests.get(url, timeout=cfg.REQUEST_TIMEOUT)
+            resp, commit_cache = self._get_cached(url, params=params)
         except RequestException as e:
             raise ApiRequestError(f"ExchangeRate-API network error: {e}")
 
@@ -141,4 +449,5 @@ class ExchangeRateApiClient(BaseApiClient):
             raise ApiRequestError("ExchangeRate-API returned no usable rates")
 
         _ = elapsed_ms
+        commit_cache()
         return out
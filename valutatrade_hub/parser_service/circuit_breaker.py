@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import json
+import math
+import threading
+import time
+from pathlib import Path
+
+from valutatrade_hub.infra.files import atomic_write_text
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def _percentile(sorted_values: list[float], p: float) -> float | None:
+    # Ближайший ранг: без интерполяции, значение всегда одно из измеренных.
+    if not sorted_values:
+        return None
+    k = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)
+    return sorted_values[k]
+
+
+class CircuitBreaker:
+    # Предохранитель одного источника курсов. В окне последних window вызовов хранятся (успех,
+    # задержка); медленный вызов (дольше slow_call_ms) считается неудачным наравне с ошибкой.
+    # closed: при min_calls и более вызовах в окне с долей неудач от error_rate — переход в open.
+    # open: источник пропускается без запроса до open_until. Затем half_open: один пробный вызов;
+    # успех закрывает предохранитель с чистым окном, неудача снова открывает его на вдвое больший срок
+    # (не более max_open_seconds).
+    def __init__(
+        self,
+        name: str,
+        window: int = 20,
+        min_calls: int = 3,
+        error_rate: float = 0.5,
+        slow_call_ms: float = 5000.0,
+        open_seconds: float = 60.0,
+        max_open_seconds: float = 960.0,
+    ):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call_ms = slow_call_ms
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.state = CLOSED
+        self.open_until = 0.0
+        self.failed_probes = 0
+        self.calls: list[tuple[bool, float]] = []
+
+    def allow(self, now: float | None = None) -> bool:
+        now = time.time() if now is None else now
+        if self.state == OPEN:
+            if now < self.open_until:
+                return False
+            self.state = HALF_OPEN
+        return True
+
+    def is_open(self, now: float | None = None) -> bool:
+        # То же, что not allow(), но без перехода в half_open: для проверок, которые вызова не делают.
+        now = time.time() if now is None else now
+        return self.state == OPEN and now < self.open_until
+
+    def record(self, ok: bool, latency_ms: float, now: float | None = None) -> None:
+        now = time.time() if now is None else now
+        good = ok and latency_ms <= self.slow_call_ms
+        self.calls.append((good, float(latency_ms)))
+        del self.calls[: -self.window]
+
+        if self.state == HALF_OPEN:
+            if good:
+                self.state = CLOSED
+                self.failed_probes = 0
+                self.calls = [self.calls[-1]]
+            else:
+                self.failed_probes += 1
+                self._open(now)
+            return
+
+        failures = sum(1 for g, _ in self.calls if not g)
+        if len(self.calls) >= self.min_calls and failures / len(self.calls) >= self.error_rate:
+            self._open(now)
+
+    def _open(self, now: float) -> None:
+        self.state = OPEN
+        self.open_until = now + min(self.max_open_seconds, self.open_seconds * (2 ** min(self.failed_probes, 16)))
+
+    def stats(self) -> dict:
+        latencies = sorted(ms for _, ms in self.calls)
+        failures = sum(1 for g, _ in self.calls if not g)
+        out = {
+            "state": self.state,
+            "calls": len(self.calls),
+            "error_rate": round(failures / len(self.calls), 4) if self.calls else 0.0,
+            "p50_ms": _percentile(latencies, 50),
+            "p90_ms": _percentile(latencies, 90),
+            "p99_ms": _percentile(latencies, 99),
+        }
+        if self.state == OPEN:
+            out["open_until"] = self.open_until
+        return out
+
+    def to_dict(self) -> dict:
+        return {
+            "state": self.state,
+            "open_until": self.open_until,
+            "failed_probes": self.failed_probes,
+            "calls": [[g, ms] for g, ms in self.calls],
+        }
+
+    def load(self, data: dict) -> None:
+        state = data.get("state")
+        self.state = state if state in (CLOSED, OPEN, HALF_OPEN) else CLOSED
+        # Пробный вызов, прерванный вместе с процессом, повторяется: half_open восстанавливается как open.
+        if self.state == HALF_OPEN:
+            self.state = OPEN
+        try:
+            self.open_until = float(data.get("open_until") or 0.0)
+            self.failed_probes = max(0, int(data.get("failed_probes") or 0))
+        except (TypeError, ValueError):
+            self.open_until, self.failed_probes = 0.0, 0
+        calls = data.get("calls")
+        self.calls = [
+            (bool(c[0]), float(c[1]))
+            for c in (calls if isinstance(calls, list) else [])
+            if isinstance(c, list) and len(c) == 2 and isinstance(c[1], (int, float))
+        ][-self.window :]
+
+
+class BreakerStore:
+    # Состояние предохранителей всех источников в одном JSON-файле в каталоге данных,
+    # чтобы открытый предохранитель пережил перезапуск CLI/планировщика.
+    def __init__(self, path: Path | None):
+        self.path = Path(path) if path else None
+        self._lock = threading.Lock()
+
+    def load(self, names: list[str], **options) -> dict[str, CircuitBreaker]:
+        data: dict = {}
+        if self.path is not None:
+            try:
+                data = json.loads(self.path.read_text(encoding="utf-8"))
+            except Exception:
+                data = {}
+        breakers = {}
+        for name in names:
+            breaker = CircuitBreaker(name, **options)
+            saved = data.get(name) if isinstance(data, dict) else None
+            if isinstance(saved, dict):
+                breaker.load(saved)
+            breakers[name] = breaker
+        return breakers
+
+    def save(self, breakers: dict[str, CircuitBreaker]) -> None:
+        if self.path is None:
+            return
+        with self._lock:
+            try:
+                data = json.loads(self.path.read_text(encoding="utf-8"))
+            except Exception:
+                data = {}
+            if not isinstance(data, dict):
+                data = {}
+            for name, breaker in breakers.items():
+                data[name] = breaker.to_dict()
+            atomic_write_text(self.path, json.dumps(data, ensure_ascii=False, indent=2))
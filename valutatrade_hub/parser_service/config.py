@@ -31,7 +31,18 @@ class ParserConfig:
 
     REQUEST_TIMEOUT: int = 10
 
+    # Пул keep-alive соединений на клиента и повторы при 429/5xx и сетевых ошибках:
+    # пауза перед n-м повтором — случайная в [0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2**n)],
+    # но не меньше Retry-After; если сервер просит ждать дольше RETRY_BACKOFF_MAX — повтора нет.
+    HTTP_POOL_CONNECTIONS: int = 4
+    HTTP_POOL_MAXSIZE: int = 8
+    RETRY_ATTEMPTS: int = 3
+    RETRY_BACKOFF_BASE: float = 0.5
+    RETRY_BACKOFF_MAX: float = 8.0
+    RETRY_STATUSES: tuple[int, ...] = (429, 500, 502, 503, 504)
+
     RATES_FILE_PATH: str = field(default_factory=lambda: str(Path(SETTINGS.get("RATES_JSON"))))
+    HTTP_CACHE_PATH: str | None = field(default_factory=lambda: SETTINGS.get("HTTP_CACHE_JSON", None))
     HISTORY_FILE_PATH: str = field(default_factory=lambda: str(Path(SETTINGS.get("EXCHANGE_RATES_JSON", "data/exchange_rates.json"))))
 
     def validate(self) -> None:
@@ -46,6 +57,17 @@ class ParserConfig:
         if not isinstance(self.REQUEST_TIMEOUT, int) or self.REQUEST_TIMEOUT <= 0:
             raise ValueError("REQUEST_TIMEOUT invalid")
 
+        for name in ("HTTP_POOL_CONNECTIONS", "HTTP_POOL_MAXSIZE"):
+            v = getattr(self, name)
+            if not isinstance(v, int) or v <= 0:
+                raise ValueError(f"{name} invalid")
+        if not isinstance(self.RETRY_ATTEMPTS, int) or self.RETRY_ATTEMPTS < 0:
+            raise ValueError("RETRY_ATTEMPTS invalid")
+        for name in ("RETRY_BACKOFF_BASE", "RETRY_BACKOFF_MAX"):
+            v = getattr(self, name)
+            if not isinstance(v, (int, float)) or v < 0:
+                raise ValueError(f"{name} invalid")
+
         if not isinstance(self.FIAT_CURRENCIES, tuple) or not self.FIAT_CURRENCIES:
             raise ValueError("FIAT_CURRENCIES invalid")
         if not isinstance(self.CRYPTO_CURRENCIES, tuple) or not self.CRYPTO_CURRENCIES:
@@ -0,0 +1,259 @@
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from valutatrade_hub.infra.files import atomic_write_bytes, atomic_write_text
+
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+
+_MAGIC = b"VTCOL\x00\x01\x00"
+_HEADER = struct.Struct("<8sII")
+_RECORD = struct.Struct("<qdH")
+_SOURCES_NAME = "sources.json"
+_MAX_SOURCES = 0xFFFF
+
+
+def ts_to_epoch(timestamp: str) -> int:
+    dt = datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+def epoch_to_ts(epoch: int) -> str:
+    return datetime.fromtimestamp(int(epoch), timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class _TimestampColumn:
+    # Ленивый доступ к колонке времени прямо из mmap — для бинарного поиска без копирования.
+    def __init__(self, buf, count: int):
+        self._buf = buf
+        self._count = count
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, i: int) -> int:
+        return _RECORD.unpack_from(self._buf, _HEADER.size + i * _RECORD.size)[0]
+
+
+class ColumnarSeries:
+    def __init__(self, path: Path, sources: list[str]):
+        self.path = Path(path)
+        self.sources = sources
+        self._fh = None
+        self._mm = None
+        self.count = 0
+        if self.path.exists() and self.path.stat().st_size > _HEADER.size:
+            self._fh = self.path.open("rb")
+            self._mm = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, rec_size, _ = _HEADER.unpack_from(self._mm, 0)
+            if magic != _MAGIC or rec_size != _RECORD.size:
+                self.close()
+                raise ValueError(f"columnar file invalid: {self.path}")
+            self.count = (len(self._mm) - _HEADER.size) // _RECORD.size
+
+    def __enter__(self) -> ColumnarSeries:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def close(self) -> None:
+        if self._mm is not None:
+            try:
+                self._mm.close()
+            except BufferError:
+                # Снаружи ещё живы NumPy-views на mmap — отображение освободит GC вместе с ними.
+                pass
+            self._mm = None
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    def records(self):
+        # С NumPy — структурированное представление поверх mmap без копирования;
+        # поля ts/rate/source доступны как views: series.records()["rate"].
+        if np is None:
+            raise RuntimeError("numpy is not installed")
+        dtype = np.dtype([("ts", "<i8"), ("rate", "<f8"), ("source", "<u2")])
+        if self._mm is None:
+            return np.zeros(0, dtype=dtype)
+        return np.frombuffer(self._mm, dtype=dtype, count=self.count, offset=_HEADER.size)
+
+    def _column(self, idx: int, typecode: str):
+        if np is not None:
+            return self.records()[("ts", "rate", "source")[idx]]
+        out = array(typecode)
+        if self._mm is not None:
+            view = memoryview(self._mm)[_HEADER.size : _HEADER.size + self.count * _RECORD.size]
+            out.extend(rec[idx] for rec in _RECORD.iter_unpack(view))
+            view.release()
+        return out
+
+    @property
+    def timestamps(self):
+        return self._column(0, "q")
+
+    @property
+    def rates(self):
+        return self._column(1, "d")
+
+    @property
+    def source_ids(self):
+        return self._column(2, "H")
+
+    def bounds(self, since: int | None = None, until: int | None = None) -> tuple[int, int]:
+        col = _TimestampColumn(self._mm, self.count) if self._mm is not None else []
+        lo = bisect_left(col, since) if since is not None else 0
+        hi = bisect_right(col, until) if until is not None else self.count
+        return lo, max(lo, hi)
+
+    def last_timestamp(self) -> int | None:
+        if self._mm is None or self.count == 0:
+            return None
+        return _TimestampColumn(self._mm, self.count)[self.count - 1]
+
+    def contains(self, epoch: int) -> bool:
+        lo, hi = self.bounds(epoch, epoch)
+        return hi > lo
+
+    def iter_rows(self, since: int | None = None, until: int | None = None) -> Iterator[tuple[int, float, int]]:
+        if self._mm is None:
+            return
+        lo, hi = self.bounds(since, until)
+        for i in range(lo, hi):
+            yield _RECORD.unpack_from(self._mm, _HEADER.size + i * _RECORD.size)
+
+
+class ColumnarHistory:
+    # Бинарная история: по файлу на пару, записи фиксированной ширины (int64 epoch, float64 rate,
+    # uint16 source id), отсортированные по времени; словарь источников — sources.json.
+    def __init__(self, root_dir: Path):
+        self.root_dir = Path(root_dir)
+
+    @property
+    def sources_path(self) -> Path:
+        return self.root_dir / _SOURCES_NAME
+
+    def exists(self) -> bool:
+        return self.sources_path.exists()
+
+    def load_sources(self) -> list[str]:
+        if not self.sources_path.exists():
+            return []
+        try:
+            data = json.loads(self.sources_path.read_text(encoding="utf-8"))
+        except Exception:
+            return []
+        return [x for x in data if isinstance(x, str)] if isinstance(data, list) else []
+
+    def _save_sources(self, sources: list[str]) -> None:
+        atomic_write_text(self.sources_path, json.dumps(sources, ensure_ascii=False))
+
+    def _pair_path(self, pair: str) -> Path:
+        return self.root_dir / f"{pair}.bin"
+
+    def pairs(self) -> list[str]:
+        if not self.root_dir.exists():
+            return []
+        return sorted(p.stem for p in self.root_dir.glob("*.bin"))
+
+    def open_series(self, pair: str) -> ColumnarSeries:
+        return ColumnarSeries(self._pair_path(pair), self.load_sources())
+
+    def _write_pair(self, path: Path, rows: list[tuple[int, float, int]]) -> None:
+        atomic_write_bytes(path, _HEADER.pack(_MAGIC, _RECORD.size, 0) + b"".join(_RECORD.pack(*r) for r in rows))
+
+    def append(self, records: Iterable[dict]) -> list[bool]:
+        records = list(records)
+        sources = self.load_sources()
+        known_sources = len(sources)
+        source_ids = {name: i for i, name in enumerate(sources)}
+
+        grouped: dict[str, list[int]] = {}
+        rows: list[tuple[int, float, int]] = []
+        for pos, r in enumerate(records):
+            src = r["source"]
+            if src not in source_ids:
+                if len(sources) >= _MAX_SOURCES:
+                    raise ValueError("too many sources for columnar history")
+                source_ids[src] = len(sources)
+                sources.append(src)
+            rows.append((ts_to_epoch(r["timestamp"]), float(r["rate"]), source_ids[src]))
+            grouped.setdefault(f"{r['from_currency']}_{r['to_currency']}", []).append(pos)
+
+        if len(sources) != known_sources:
+            self._save_sources(sources)
+
+        inserted = [False] * len(records)
+        self.root_dir.mkdir(parents=True, exist_ok=True)
+        for pair, positions in grouped.items():
+            path = self._pair_path(pair)
+            new_rows: dict[int, tuple[int, float, int]] = {}
+            with ColumnarSeries(path, sources) as series:
+                for pos in positions:
+                    row = rows[pos]
+                    if row[0] in new_rows or series.contains(row[0]):
+                        continue
+                    new_rows[row[0]] = row
+                    inserted[pos] = True
+                if not new_rows:
+                    continue
+
+                ordered = sorted(new_rows.values())
+                last = series.last_timestamp()
+                if last is not None and ordered[0][0] <= last:
+                    # Запись «из прошлого» — редкий случай, файл пары пересобираем целиком.
+                    ordered = sorted(list(series.iter_rows()) + ordered)
+                    last = None
+
+            if last is None:
+                self._write_pair(path, ordered)
+                continue
+            with path.open("ab") as fh:
+                fh.write(b"".join(_RECORD.pack(*r) for r in ordered))
+                fh.flush()
+                os.fsync(fh.fileno())
+        return inserted
+
+    def contains(self, pair: str, timestamp: str) -> bool:
+        with self.open_series(pair) as series:
+            return series.contains(ts_to_epoch(timestamp))
+
+    def iter_records(
+        self,
+        since: str | None = None,
+        until: str | None = None,
+        pairs: Iterable[str] | None = None,
+    ) -> Iterator[dict]:
+        since_epoch = ts_to_epoch(since) if since is not None else None
+        until_epoch = ts_to_epoch(until) if until is not None else None
+        sources = self.load_sources()
+        for pair in pairs if pairs is not None else self.pairs():
+            f, _, t = pair.partition("_")
+            with ColumnarSeries(self._pair_path(pair), sources) as series:
+                for epoch, rate, sid in series.iter_rows(since_epoch, until_epoch):
+                    ts = epoch_to_ts(epoch)
+                    yield {
+                        "id": f"{pair}_{ts}",
+                        "from_currency": f,
+                        "to_currency": t,
+                        "rate": rate,
+                        "timestamp": ts,
+                        "source": sources[sid] if sid < len(sources) else "UNKNOWN",
+                        "meta": {},
+                    }
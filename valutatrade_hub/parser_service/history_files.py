@@ -0,0 +1,346 @@
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+from typing import Any, Iterator
+
+from valutatrade_hub.infra.files import atomic_write_text, file_lock
+from valutatrade_hub.infra.settings import SettingsLoader
+from valutatrade_hub.parser_service.history_columnar import ColumnarHistory, ColumnarSeries
+from valutatrade_hub.parser_service.history_index import HistoryIdIndex
+from valutatrade_hub.parser_service.history_segments import SegmentedHistory
+from valutatrade_hub.parser_service.measurements import _normalize_code, validate_measurement
+
+SETTINGS = SettingsLoader()
+
+
+def _project_root() -> Path:
+    return Path(SETTINGS.get("PROJECT_ROOT"))
+
+
+def _exchange_rates_path() -> Path:
+    p = SETTINGS.get("EXCHANGE_RATES_JSON", None)
+    if isinstance(p, str) and p.strip():
+        path = Path(p.strip())
+        return path if path.is_absolute() else (_project_root() / path)
+    return _project_root() / "data" / "exchange_rates.json"
+
+
+def _exchange_rates_jsonl_path() -> Path:
+    p = SETTINGS.get("EXCHANGE_RATES_JSONL", None)
+    if isinstance(p, str) and p.strip():
+        path = Path(p.strip())
+        return path if path.is_absolute() else (_project_root() / path)
+    return _exchange_rates_path().with_suffix(".jsonl")
+
+
+def _history_segments_dir() -> Path:
+    p = SETTINGS.get("HISTORY_SEGMENTS_DIR", None)
+    if isinstance(p, str) and p.strip():
+        path = Path(p.strip())
+        return path if path.is_absolute() else (_project_root() / path)
+    return _project_root() / "data" / "history"
+
+
+def _history_segment_granularity() -> str:
+    g = SETTINGS.get("HISTORY_SEGMENT", "day")
+    if not isinstance(g, str) or g.strip().lower() not in ("day", "month"):
+        return "day"
+    return g.strip().lower()
+
+
+def _history_columnar_dir() -> Path:
+    p = SETTINGS.get("HISTORY_COLUMNAR_DIR", None)
+    if isinstance(p, str) and p.strip():
+        path = Path(p.strip())
+        return path if path.is_absolute() else (_project_root() / path)
+    return _project_root() / "data" / "columnar"
+
+
+def _history_format() -> str:
+    fmt = SETTINGS.get("HISTORY_FORMAT", "json")
+    if not isinstance(fmt, str) or fmt.strip().lower() not in ("json", "jsonl", "partitioned", "columnar"):
+        return "json"
+    return fmt.strip().lower()
+
+
+def _history_columnar_mirror() -> bool:
+    return bool(SETTINGS.get("HISTORY_COLUMNAR", False)) and _history_format() != "columnar"
+
+
+def _write_json_atomic(path: Path, data: Any) -> None:
+    atomic_write_text(path, json.dumps(data, ensure_ascii=False, indent=2))
+
+
+def _read_json_list(path: Path) -> list[dict]:
+    if not path.exists():
+        return []
+    text = path.read_text(encoding="utf-8").strip()
+    if not text:
+        return []
+    try:
+        data = json.loads(text)
+    except Exception:
+        return []
+    if not isinstance(data, list):
+        return []
+    out = []
+    for x in data:
+        if isinstance(x, dict):
+            out.append(x)
+    return out
+
+
+def _iter_jsonl(path: Path) -> Iterator[dict]:
+    if not path.exists():
+        return
+    with path.open("r", encoding="utf-8") as fh:
+        for line in fh:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                data = json.loads(line)
+            except Exception:
+                # Оборванная последняя строка после сбоя записи — просто пропускаем.
+                continue
+            if isinstance(data, dict):
+                yield data
+
+
+def _append_jsonl(path: Path, records: list[dict]) -> None:
+    if not records:
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    payload = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+    with path.open("a+b") as fh:
+        fh.seek(0, os.SEEK_END)
+        if fh.tell() > 0:
+            fh.seek(-1, os.SEEK_END)
+            if fh.read(1) != b"\n":
+                payload = "\n" + payload
+        fh.write(payload.encode("utf-8"))
+        fh.flush()
+        os.fsync(fh.fileno())
+
+
+def _write_jsonl_atomic(path: Path, records: list[dict]) -> None:
+    atomic_write_text(path, "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records))
+
+
+def migrate_history_to_jsonl(remove_source: bool = False) -> int:
+    src = _exchange_rates_path()
+    dst = _exchange_rates_jsonl_path()
+
+    seen = set()
+    out = []
+    for x in _iter_jsonl(dst):
+        rid = x.get("id")
+        if isinstance(rid, str) and rid:
+            seen.add(rid)
+        out.append(x)
+
+    migrated = 0
+    for x in _read_json_list(src):
+        try:
+            v = validate_measurement(x)
+        except Exception:
+            continue
+        if v["id"] in seen:
+            continue
+        seen.add(v["id"])
+        out.append(v)
+        migrated += 1
+
+    _write_jsonl_atomic(dst, out)
+    if remove_source and src.exists():
+        src.unlink()
+    return migrated
+
+
+def _ensure_jsonl_history() -> Path:
+    path = _exchange_rates_jsonl_path()
+    if not path.exists() and _exchange_rates_path().exists():
+        migrate_history_to_jsonl()
+    return path
+
+
+def _segmented_history() -> SegmentedHistory:
+    return SegmentedHistory(_history_segments_dir(), _history_segment_granularity())
+
+
+def migrate_history_to_segments() -> int:
+    jsonl_path = _exchange_rates_jsonl_path()
+    legacy = _iter_jsonl(jsonl_path) if jsonl_path.exists() else iter(_read_json_list(_exchange_rates_path()))
+
+    history = _segmented_history()
+    seen = set()
+    out = []
+    for x in history.iter_records() if history.exists() else []:
+        rid = x.get("id")
+        if isinstance(rid, str) and rid:
+            seen.add(rid)
+            out.append(x)
+
+    migrated = 0
+    for x in legacy:
+        try:
+            v = validate_measurement(x)
+        except Exception:
+            continue
+        if v["id"] in seen:
+            continue
+        seen.add(v["id"])
+        out.append(v)
+        migrated += 1
+
+    history.rewrite(out)
+    return migrated
+
+
+def _ensure_segmented_history() -> SegmentedHistory:
+    history = _segmented_history()
+    if not history.exists() and (_exchange_rates_jsonl_path().exists() or _exchange_rates_path().exists()):
+        migrate_history_to_segments()
+    return history
+
+
+def _columnar_history() -> ColumnarHistory:
+    return ColumnarHistory(_history_columnar_dir())
+
+
+def iter_source_history() -> Iterator[dict]:
+    segmented = _segmented_history()
+    if segmented.exists():
+        return segmented.iter_records()
+    jsonl_path = _exchange_rates_jsonl_path()
+    if jsonl_path.exists():
+        return _iter_jsonl(jsonl_path)
+    return iter(_read_json_list(_exchange_rates_path()))
+
+
+def migrate_history_to_columnar() -> int:
+    valid = []
+    for x in iter_source_history():
+        try:
+            valid.append(validate_measurement(x))
+        except Exception:
+            continue
+    history = _columnar_history()
+    inserted = history.append(valid)
+    if not history.exists():
+        history.root_dir.mkdir(parents=True, exist_ok=True)
+        history.sources_path.write_text("[]", encoding="utf-8")
+    return sum(1 for x in inserted if x)
+
+
+def _ensure_columnar_history() -> ColumnarHistory:
+    history = _columnar_history()
+    if not history.exists():
+        migrate_history_to_columnar()
+    return history
+
+
+def open_rate_series(from_currency: str, to_currency: str) -> ColumnarSeries:
+    f = _normalize_code(from_currency)
+    t = _normalize_code(to_currency)
+    return _ensure_columnar_history().open_series(f"{f}_{t}")
+
+
+def iter_history(
+    since: str | None = None,
+    until: str | None = None,
+    from_currency: str | None = None,
+    to_currency: str | None = None,
+) -> Iterator[dict]:
+    pair_filter = None
+    if from_currency is not None or to_currency is not None:
+
+        def pair_filter(pair: str) -> bool:
+            f, _, t = pair.partition("_")
+            return (from_currency is None or f == from_currency) and (to_currency is None or t == to_currency)
+
+    fmt = _history_format()
+    if fmt == "columnar":
+        history = _ensure_columnar_history()
+        pairs = [p for p in history.pairs() if pair_filter is None or pair_filter(p)]
+        yield from history.iter_records(since=since, until=until, pairs=pairs)
+        return
+    if fmt == "partitioned":
+        yield from _ensure_segmented_history().iter_records(since=since, until=until, pair_filter=pair_filter)
+        return
+    if fmt == "jsonl":
+        yield from _iter_jsonl(_ensure_jsonl_history())
+        return
+    yield from _read_json_list(_exchange_rates_path())
+
+
+def _history_path() -> Path:
+    fmt = _history_format()
+    if fmt == "partitioned":
+        history = _ensure_segmented_history()
+        history.load_manifest()
+        return history.manifest_path
+    if fmt == "jsonl":
+        return _ensure_jsonl_history()
+    return _exchange_rates_path()
+
+
+def _history_index() -> HistoryIdIndex:
+    index = HistoryIdIndex(_history_path())
+    if not index.is_in_sync():
+        index.rebuild(x.get("id") for x in iter_history())
+    return index
+
+
+def rebuild_history_index() -> int:
+    # Та же блокировка, что и у дозаписи: append_validated может пересобирать этот же каталог.
+    with file_lock(_exchange_rates_path()):
+        return HistoryIdIndex(_history_path()).rebuild(x.get("id") for x in iter_history())
+
+
+def append_validated(valid_items: list[dict]) -> list[bool]:
+    if not valid_items:
+        return []
+
+    # Проверка дубликатов и дозапись — под блокировкой истории, чтобы параллельные
+    # процессы не записали одно измерение дважды.
+    if _history_format() == "columnar":
+        history = _ensure_columnar_history()
+        with file_lock(history.sources_path):
+            return history.append(valid_items)
+
+    with file_lock(_exchange_rates_path()):
+        return _append_validated_locked(valid_items)
+
+
+def _append_validated_locked(valid_items: list[dict]) -> list[bool]:
+    index = _history_index()
+    seen = index.contains_many(v["id"] for v in valid_items)
+
+    inserted = []
+    new_items = []
+    for valid in valid_items:
+        if valid["id"] in seen:
+            inserted.append(False)
+            continue
+        seen.add(valid["id"])
+        new_items.append(valid)
+        inserted.append(True)
+
+    if new_items:
+        fmt = _history_format()
+        if fmt == "partitioned":
+            _segmented_history().append(new_items)
+        elif fmt == "jsonl":
+            _append_jsonl(index.data_path, new_items)
+        else:
+            items = _read_json_list(index.data_path)
+            items.extend(new_items)
+            _write_json_atomic(index.data_path, items)
+        index.add_many(v["id"] for v in new_items)
+        index.mark_synced()
+        if _history_columnar_mirror():
+            _ensure_columnar_history().append(new_items)
+    return inserted
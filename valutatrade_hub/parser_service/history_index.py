@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Iterable
+
+from valutatrade_hub.infra.files import atomic_write_text, make_temp_dir
+
+_META_NAME = "_meta.json"
+
+
+class HistoryIdIndex:
+    # Индекс id измерений рядом с файлом истории: id раскладываются по хеш-корзинам,
+    # проверка дубликата читает одну маленькую корзину, а не всю историю.
+    def __init__(self, data_path: Path, buckets: int = 256):
+        if not isinstance(buckets, int) or not (1 <= buckets <= 4096):
+            raise ValueError("buckets invalid")
+        self.data_path = Path(data_path)
+        self.index_dir = self.data_path.with_suffix(self.data_path.suffix + ".idx")
+        self.buckets = buckets
+
+    def _bucket_of(self, rec_id: str) -> int:
+        digest = hashlib.blake2b(rec_id.encode("utf-8"), digest_size=4).digest()
+        return int.from_bytes(digest, "big") % self.buckets
+
+    def _bucket_path(self, bucket: int) -> Path:
+        return self.index_dir / f"{bucket:03x}.ids"
+
+    def _data_stamp(self) -> dict:
+        try:
+            st = self.data_path.stat()
+        except FileNotFoundError:
+            return {"size": None, "mtime_ns": None}
+        return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+    def _read_meta(self) -> dict:
+        path = self.index_dir / _META_NAME
+        if not path.exists():
+            return {}
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except Exception:
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def mark_synced(self) -> None:
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        meta = {"buckets": self.buckets, **self._data_stamp()}
+        atomic_write_text(self.index_dir / _META_NAME, json.dumps(meta))
+
+    def is_in_sync(self) -> bool:
+        meta = self._read_meta()
+        if meta.get("buckets") != self.buckets:
+            return False
+        stamp = self._data_stamp()
+        return meta.get("size") == stamp["size"] and meta.get("mtime_ns") == stamp["mtime_ns"]
+
+    def rebuild(self, ids: Iterable[str]) -> int:
+        grouped: dict[int, list[str]] = {}
+        seen = set()
+        for rec_id in ids:
+            if not isinstance(rec_id, str) or not rec_id or rec_id in seen:
+                continue
+            seen.add(rec_id)
+            grouped.setdefault(self._bucket_of(rec_id), []).append(rec_id)
+
+        tmp_dir = make_temp_dir(self.index_dir)
+        try:
+            for bucket, bucket_ids in grouped.items():
+                (tmp_dir / self._bucket_path(bucket).name).write_text("".join(x + "\n" for x in bucket_ids), encoding="utf-8")
+            if self.index_dir.exists():
+                shutil.rmtree(self.index_dir)
+            tmp_dir.replace(self.index_dir)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        self.mark_synced()
+        return len(seen)
+
+    def _read_bucket(self, bucket: int) -> set[str]:
+        path = self._bucket_path(bucket)
+        if not path.exists():
+            return set()
+        with path.open("r", encoding="utf-8") as fh:
+            return {line.strip() for line in fh if line.strip()}
+
+    def contains_many(self, ids: Iterable[str]) -> set[str]:
+        grouped: dict[int, list[str]] = {}
+        for rec_id in ids:
+            grouped.setdefault(self._bucket_of(rec_id), []).append(rec_id)
+
+        found = set()
+        for bucket, bucket_ids in grouped.items():
+            present = self._read_bucket(bucket)
+            found.update(x for x in bucket_ids if x in present)
+        return found
+
+    def contains(self, rec_id: str) -> bool:
+        return rec_id in self.contains_many([rec_id])
+
+    def add_many(self, ids: Iterable[str]) -> None:
+        grouped: dict[int, list[str]] = {}
+        for rec_id in ids:
+            grouped.setdefault(self._bucket_of(rec_id), []).append(rec_id)
+        if not grouped:
+            return
+
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        for bucket, bucket_ids in grouped.items():
+            with self._bucket_path(bucket).open("a", encoding="utf-8") as fh:
+                fh.write("".join(x + "\n" for x in bucket_ids))
+                fh.flush()
+                os.fsync(fh.fileno())
@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+
+from valutatrade_hub.infra.files import atomic_write_text
+
+_MANIFEST_NAME = "manifest.json"
+
+
+def _iter_segment(path: Path) -> Iterator[dict]:
+    if not path.exists():
+        return
+    with path.open("r", encoding="utf-8") as fh:
+        for line in fh:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                data = json.loads(line)
+            except Exception:
+                continue
+            if isinstance(data, dict):
+                yield data
+
+
+class SegmentedHistory:
+    # История курсов, разложенная по сегментам (UTC-день или месяц) + манифест с min/max
+    # временем и списком пар в каждом сегменте, чтобы читать только нужные файлы.
+    def __init__(self, root_dir: Path, granularity: str = "day"):
+        if granularity not in ("day", "month"):
+            raise ValueError("granularity invalid")
+        self.root_dir = Path(root_dir)
+        self.granularity = granularity
+
+    @property
+    def manifest_path(self) -> Path:
+        return self.root_dir / _MANIFEST_NAME
+
+    def segment_key(self, timestamp: str) -> str:
+        return timestamp[:10] if self.granularity == "day" else timestamp[:7]
+
+    def _segment_path(self, key: str) -> Path:
+        return self.root_dir / f"{key}.jsonl"
+
+    def _scan_segment(self, path: Path) -> dict:
+        ts_min = None
+        ts_max = None
+        pairs = set()
+        count = 0
+        for x in _iter_segment(path):
+            ts = x.get("timestamp")
+            if not isinstance(ts, str):
+                continue
+            ts_min = ts if ts_min is None or ts < ts_min else ts_min
+            ts_max = ts if ts_max is None or ts > ts_max else ts_max
+            pairs.add(f"{x.get('from_currency')}_{x.get('to_currency')}")
+            count += 1
+        return {
+            "min_ts": ts_min,
+            "max_ts": ts_max,
+            "pairs": sorted(pairs),
+            "count": count,
+            "size": path.stat().st_size if path.exists() else 0,
+        }
+
+    def _save_manifest(self, segments: dict[str, dict]) -> None:
+        data = {"granularity": self.granularity, "segments": dict(sorted(segments.items()))}
+        atomic_write_text(self.manifest_path, json.dumps(data, ensure_ascii=False, indent=2))
+
+    def load_manifest(self) -> dict[str, dict]:
+        segments: dict[str, dict] = {}
+        path = self.manifest_path
+        if path.exists():
+            try:
+                data = json.loads(path.read_text(encoding="utf-8"))
+            except Exception:
+                data = {}
+            raw = data.get("segments") if isinstance(data, dict) else None
+            if isinstance(raw, dict) and data.get("granularity") == self.granularity:
+                segments = {k: v for k, v in raw.items() if isinstance(k, str) and isinstance(v, dict)}
+
+        # Самовосстановление: сегмент, дописанный без обновления манифеста, пересканируем.
+        changed = False
+        on_disk = {p.stem: p for p in self.root_dir.glob("*.jsonl")} if self.root_dir.exists() else {}
+        for key in list(segments):
+            if key not in on_disk:
+                del segments[key]
+                changed = True
+        for key, seg_path in on_disk.items():
+            entry = segments.get(key)
+            if entry is None or entry.get("size") != seg_path.stat().st_size:
+                segments[key] = self._scan_segment(seg_path)
+                changed = True
+        if changed:
+            self._save_manifest(segments)
+        return segments
+
+    def exists(self) -> bool:
+        return self.manifest_path.exists()
+
+    def append(self, records: list[dict]) -> None:
+        if not records:
+            return
+        grouped: dict[str, list[dict]] = {}
+        for r in records:
+            grouped.setdefault(self.segment_key(r["timestamp"]), []).append(r)
+
+        segments = self.load_manifest()
+        self.root_dir.mkdir(parents=True, exist_ok=True)
+        for key, items in grouped.items():
+            path = self._segment_path(key)
+            with path.open("a", encoding="utf-8") as fh:
+                fh.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in items))
+                fh.flush()
+                os.fsync(fh.fileno())
+
+            entry = segments.get(key) or {"min_ts": None, "max_ts": None, "pairs": [], "count": 0}
+            pairs = set(entry.get("pairs") or [])
+            for r in items:
+                ts = r["timestamp"]
+                if entry["min_ts"] is None or ts < entry["min_ts"]:
+                    entry["min_ts"] = ts
+                if entry["max_ts"] is None or ts > entry["max_ts"]:
+                    entry["max_ts"] = ts
+                pairs.add(f"{r['from_currency']}_{r['to_currency']}")
+            entry["pairs"] = sorted(pairs)
+            entry["count"] = int(entry.get("count") or 0) + len(items)
+            entry["size"] = path.stat().st_size
+            segments[key] = entry
+        self._save_manifest(segments)
+
+    def rewrite(self, records: Iterable[dict]) -> int:
+        grouped: dict[str, list[dict]] = {}
+        for r in records:
+            grouped.setdefault(self.segment_key(r["timestamp"]), []).append(r)
+
+        self.root_dir.mkdir(parents=True, exist_ok=True)
+        for old in self.root_dir.glob("*.jsonl"):
+            if old.stem not in grouped:
+                old.unlink()
+        segments = {}
+        total = 0
+        for key, items in grouped.items():
+            path = self._segment_path(key)
+            atomic_write_text(path, "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in items))
+            segments[key] = self._scan_segment(path)
+            total += len(items)
+        self._save_manifest(segments)
+        return total
+
+    def iter_records(
+        self,
+        since: str | None = None,
+        until: str | None = None,
+        pair_filter: Callable[[str], bool] | None = None,
+    ) -> Iterator[dict]:
+        for key, entry in sorted(self.load_manifest().items()):
+            ts_min = entry.get("min_ts")
+            ts_max = entry.get("max_ts")
+            if since is not None and isinstance(ts_max, str) and ts_max < since:
+                continue
+            if until is not None and isinstance(ts_min, str) and ts_min > until:
+                continue
+            if pair_filter is not None:
+                pairs = entry.get("pairs")
+                if isinstance(pairs, list) and not any(pair_filter(p) for p in pairs if isinstance(p, str)):
+                    continue
+            yield from _iter_segment(self._segment_path(key))
@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+from datetime import datetime, timezone
+from typing import Any
+
+
+def _format_dt(dt: datetime) -> str:
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    dt = dt.astimezone(timezone.utc).replace(microsecond=0)
+    return dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _parse_dt(value: Any) -> datetime | None:
+    if isinstance(value, datetime):
+        dt = value
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return dt.astimezone(timezone.utc).replace(microsecond=0)
+
+    if not isinstance(value, str) or not value.strip():
+        return None
+
+    s = value.strip()
+
+    if s.endswith("Z"):
+        s2 = s[:-1]
+        try:
+            dt = datetime.fromisoformat(s2)
+        except Exception:
+            return None
+        return dt.replace(tzinfo=timezone.utc).replace(microsecond=0)
+
+    try:
+        dt = datetime.fromisoformat(s)
+    except Exception:
+        try:
+            dt = datetime.strptime(s, "%Y-%m-%d %H:%M:%S")
+        except Exception:
+            return None
+
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc).replace(microsecond=0)
+
+
+def _is_code(code: Any) -> bool:
+    if not isinstance(code, str):
+        return False
+    s = code.strip().upper()
+    if " " in s or not (2 <= len(s) <= 5) or not s.isalnum():
+        return False
+    return True
+
+
+def _normalize_code(code: Any) -> str:
+    if not _is_code(code):
+        raise ValueError("invalid currency code")
+    return str(code).strip().upper()
+
+
+def _normalize_timestamp(ts: Any) -> str:
+    if isinstance(ts, datetime):
+        dt = ts
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        dt = dt.astimezone(timezone.utc).replace(microsecond=0)
+        return _format_dt(dt)
+
+    if not isinstance(ts, str) or not ts.strip():
+        raise ValueError("invalid timestamp")
+
+    s = ts.strip()
+
+    if s.endswith("Z"):
+        dt = _parse_dt(s)
+        if dt is None:
+            raise ValueError("invalid timestamp")
+        return _format_dt(dt)
+
+    dt = _parse_dt(s)
+    if dt is None:
+        raise ValueError("invalid timestamp")
+    return _format_dt(dt)
+
+
+def make_measurement_id(from_currency: str, to_currency: str, timestamp_utc: str) -> str:
+    f = _normalize_code(from_currency)
+    t = _normalize_code(to_currency)
+    ts = _normalize_timestamp(timestamp_utc)
+    return f"{f}_{t}_{ts}"
+
+
+def validate_measurement(record: dict) -> dict:
+    if not isinstance(record, dict):
+        raise ValueError("record must be dict")
+
+    f = _normalize_code(record.get("from_currency"))
+    t = _normalize_code(record.get("to_currency"))
+    ts = _normalize_timestamp(record.get("timestamp"))
+
+    rate = record.get("rate")
+    if not isinstance(rate, (int, float)):
+        raise ValueError("rate invalid")
+    rate = float(rate)
+    if rate <= 0:
+        raise ValueError("rate invalid")
+
+    source = record.get("source")
+    if not isinstance(source, str) or not source.strip():
+        raise ValueError("source invalid")
+    source = source.strip()
+
+    meta = record.get("meta", {})
+    if meta is None:
+        meta = {}
+    if not isinstance(meta, dict):
+        raise ValueError("meta invalid")
+
+    expected_id = make_measurement_id(f, t, ts)
+    rec_id = record.get("id")
+    if rec_id is None or (isinstance(rec_id, str) and not rec_id.strip()):
+        rec_id = expected_id
+    if not isinstance(rec_id, str) or rec_id.strip() != expected_id:
+        raise ValueError("id invalid")
+
+    return {
+        "id": expected_id,
+        "from_currency": f,
+        "to_currency": t,
+        "rate": rate,
+        "timestamp": ts,
+        "source": source,
+        "meta": meta,
+    }
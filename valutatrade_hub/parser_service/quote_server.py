@@ -0,0 +1,218 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import time
+import zlib
+from email.utils import format_datetime, parsedate_to_datetime
+from urllib.parse import parse_qs, urlsplit
+
+import valutatrade_hub.parser_service.storage as parser_storage
+from valutatrade_hub.core.rates import RateMatrix, get_rate_matrix
+from valutatrade_hub.parser_service.measurements import _normalize_code, _parse_dt
+
+# Как часто сверяться со снимком на диске: чаще — лишние stat/запросы, реже — дольше отдаётся старый снимок.
+SNAPSHOT_CHECK_SECONDS = 1.0
+IDLE_TIMEOUT_SECONDS = 30.0
+MAX_HEADER_LINES = 100
+
+_REASONS = {
+    200: "OK",
+    304: "Not Modified",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    503: "Service Unavailable",
+}
+
+
+class QuoteSnapshot:
+    # Неизменяемая копия снимка курсов для отдачи по HTTP. ETag — время last_refresh плюс CRC32
+    # тела /rates: клиенты получают 304, пока снимок не изменился, даже если пары переписали без
+    # смены last_refresh. Тела ответов /rate собираются по требованию и кешируются до смены снимка.
+    def __init__(self, snapshot: dict):
+        pairs = snapshot.get("pairs") if isinstance(snapshot, dict) else None
+        self.pairs = pairs if isinstance(pairs, dict) else {}
+        self.last_refresh = snapshot.get("last_refresh") if isinstance(snapshot, dict) else None
+        refreshed = _parse_dt(self.last_refresh)
+        self.last_modified = format_datetime(refreshed, usegmt=True) if refreshed is not None else None
+        self.modified_ts = int(refreshed.timestamp()) if refreshed is not None else None
+
+        body = {"last_refresh": self.last_refresh, "pairs": self.pairs}
+        self.rates_body = json.dumps(body, ensure_ascii=False, sort_keys=True).encode("utf-8")
+        self.etag = f'"{self.modified_ts or 0:x}-{zlib.crc32(self.rates_body):08x}"'
+        self.matrix: RateMatrix = get_rate_matrix(self.pairs)
+        self._rate_bodies: dict[tuple[str, str], bytes | None] = {}
+
+    def rate_body(self, from_code: str, to_code: str) -> bytes | None:
+        key = (from_code, to_code)
+        if key not in self._rate_bodies:
+            rate = self.matrix.rate(from_code, to_code)
+            if rate is None:
+                body = None
+            else:
+                direct = self.pairs.get(f"{from_code}_{to_code}")
+                updated_at = direct.get("updated_at") if isinstance(direct, dict) else None
+                body = json.dumps(
+                    {"from": from_code, "to": to_code, "rate": float(rate), "updated_at": updated_at or self.last_refresh},
+                    ensure_ascii=False,
+                ).encode("utf-8")
+            self._rate_bodies[key] = body
+        return self._rate_bodies[key]
+
+    def not_modified(self, headers: dict[str, str]) -> bool:
+        # If-None-Match важнее If-Modified-Since (RFC 9110, 13.2.2).
+        inm = headers.get("if-none-match")
+        if inm is not None:
+            tags = [t.strip() for t in inm.split(",")]
+            return "*" in tags or any(t.removeprefix("W/") == self.etag for t in tags)
+        ims = headers.get("if-modified-since")
+        if ims is None or self.modified_ts is None:
+            return False
+        try:
+            since = parsedate_to_datetime(ims)
+        except Exception:
+            return False
+        return since is not None and since.timestamp() >= self.modified_ts
+
+
+class QuoteServer:
+    # Только чтение: снимок берётся из parser_service.storage (для JSON — общий файловый кеш), раз в
+    # SNAPSHOT_CHECK_SECONDS сверяется с хранилищем и пересобирается, лишь когда объект снимка сменился.
+    # Чтение хранилища и сборка снимка идут в отдельном потоке, чтобы не останавливать цикл событий.
+    def __init__(self, host: str = "127.0.0.1", port: int = 8765):
+        self.host = host
+        self.port = port
+        self.logger = logging.getLogger("valutatrade.parser.quote_server")
+        self._snapshot: QuoteSnapshot | None = None
+        self._source: dict | None = None
+        self._checked_at = 0.0
+        self._refresh_lock = asyncio.Lock()
+        self.requests = 0
+
+    def _due(self) -> bool:
+        return self._snapshot is None or time.monotonic() - self._checked_at >= SNAPSHOT_CHECK_SECONDS
+
+    def _load(self) -> QuoteSnapshot | None:
+        source = parser_storage.shared_rates_snapshot()
+        if source is not self._source:
+            self._source = source
+            self._snapshot = QuoteSnapshot(source)
+        return self._snapshot
+
+    async def snapshot(self) -> QuoteSnapshot | None:
+        if not self._due():
+            return self._snapshot
+        # Одна сверка на всех: запросы, пришедшие во время неё, ждут её результата.
+        async with self._refresh_lock:
+            if self._due():
+                self._checked_at = time.monotonic()
+                try:
+                    await asyncio.to_thread(self._load)
+                except Exception as e:
+                    self.logger.info(f"Quote server snapshot ERROR error_type={type(e).__name__} error_message='{str(e)}'")
+        return self._snapshot
+
+    async def respond(self, method: str, target: str, headers: dict[str, str]) -> tuple[int, dict[str, str], bytes]:
+        if method not in ("GET", "HEAD"):
+            return _json_error(405, "method not allowed", {"Allow": "GET, HEAD"})
+        url = urlsplit(target)
+        if url.path not in ("/rate", "/rates"):
+            return _json_error(404, "not found")
+        snap = await self.snapshot()
+        if snap is None:
+            return _json_error(503, "rates unavailable")
+
+        if url.path == "/rates":
+            body = snap.rates_body
+        else:
+            query = parse_qs(url.query)
+            try:
+                from_code = _normalize_code((query.get("from") or [""])[0])
+                to_code = _normalize_code((query.get("to") or [""])[0])
+            except Exception:
+                return _json_error(400, "query parameters 'from' and 'to' are required")
+            body = snap.rate_body(from_code, to_code)
+            if body is None:
+                return _json_error(404, f"no rate for {from_code}->{to_code}")
+
+        validators = {"ETag": snap.etag, "Cache-Control": "no-cache"}
+        if snap.last_modified is not None:
+            validators["Last-Modified"] = snap.last_modified
+        if snap.not_modified(headers):
+            return 304, validators, b""
+        return 200, {**validators, "Content-Type": "application/json; charset=utf-8"}, body
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        # HTTP/1.1 с keep-alive: соединение обслуживает запросы по очереди, пока клиент не закроет его.
+        try:
+            while True:
+                try:
+                    line = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT_SECONDS)
+                except asyncio.TimeoutError:
+                    break
+                if not line:
+                    break
+                parts = line.decode("latin-1").split()
+                if not parts:
+                    continue
+                headers: dict[str, str] = {}
+                for _ in range(MAX_HEADER_LINES):
+                    h = await reader.readline()
+                    if h in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = h.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                if len(parts) != 3 or not parts[2].startswith("HTTP/"):
+                    status, extra, body = _json_error(400, "bad request line")
+                    keep_alive = False
+                else:
+                    method, target, version = parts
+                    status, extra, body = await self.respond(method, target, headers)
+                    conn = headers.get("connection", "").lower()
+                    keep_alive = conn != "close" if version == "HTTP/1.1" else conn == "keep-alive"
+                    # Тело запроса не читается: иначе его байты разобрались бы как следующий запрос.
+                    if method not in ("GET", "HEAD") or headers.get("content-length", "0") != "0" or "transfer-encoding" in headers:
+                        keep_alive = False
+                    if method == "HEAD":
+                        extra = {**extra, "Content-Length": str(len(body))}
+                        body = b""
+                self.requests += 1
+
+                head = [f"HTTP/1.1 {status} {_REASONS.get(status, '')}"]
+                head.extend(f"{k}: {v}" for k, v in extra.items())
+                if "Content-Length" not in extra:
+                    head.append(f"Content-Length: {len(body)}")
+                head.append("Connection: keep-alive" if keep_alive else "Connection: close")
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self) -> None:
+        server = await asyncio.start_server(self.handle, self.host, self.port)
+        bound = ", ".join(f"{s.getsockname()[0]}:{s.getsockname()[1]}" for s in server.sockets)
+        self.logger.info(f"Quote server started listen={bound}")
+        print(f"Сервер котировок слушает http://{self.host}:{self.port} (/rate?from=BTC&to=USD, /rates)", flush=True)
+        async with server:
+            await server.serve_forever()
+
+
+def _json_error(status: int, message: str, extra: dict[str, str] | None = None) -> tuple[int, dict[str, str], bytes]:
+    headers = {"Content-Type": "application/json; charset=utf-8", **(extra or {})}
+    return status, headers, json.dumps({"error": message}, ensure_ascii=False).encode("utf-8")
+
+
+def run_quote_server(host: str = "127.0.0.1", port: int = 8765) -> None:
+    server = QuoteServer(host, port)
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        pass
+    server.logger.info(f"Quote server stopped requests={server.requests}")
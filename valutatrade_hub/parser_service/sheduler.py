@@ -2,6 +2,7 @@ from __future__ import annotations
 
 import logging
 import threading
+import time
 from dataclasses import dataclass
 from typing import Any
 
@@ -19,14 +20,28 @@ class SchedulerState:
     last_error: str | None = None
 
 
+# За сколько секунд до тика открыть соединения с источниками: keep-alive серверов обычно короче
+# интервала обновления, и без прогрева каждый тик платил бы за TCP/TLS-рукопожатие.
+WARM_UP_LEAD_SECONDS = 5
+
+
 class RatesScheduler:
     def __init__(self, updater: RatesUpdater, interval_seconds: int = 300):
         self.updater = updater
         self.interval_seconds = int(interval_seconds) if isinstance(interval_seconds, int) and interval_seconds > 0 else 300
         self.logger = logging.getLogger("valutatrade.parser.scheduler")
         self._timer: threading.Timer | None = None
+        self._warm_timer: threading.Timer | None = None
         self.state = SchedulerState()
 
+    def _warm_up(self) -> None:
+        if not self.state.is_running:
+            return
+        try:
+            self.updater.warm_up(time.time() + WARM_UP_LEAD_SECONDS)
+        except Exception as e:
+            self.logger.info(f"Scheduled warm-up ERROR error_type={type(e).__name__} error_message='{str(e)}'")
+
     def _tick(self) -> None:
         if not self.state.is_running:
             return
@@ -52,6 +67,10 @@ class RatesScheduler:
         self._timer = threading.Timer(self.interval_seconds, self._tick)
         self._timer.daemon = True
         self._timer.start()
+        if self.interval_seconds > 2 * WARM_UP_LEAD_SECONDS:
+            self._warm_timer = threading.Timer(self.interval_seconds - WARM_UP_LEAD_SECONDS, self._warm_up)
+            self._warm_timer.daemon = True
+            self._warm_timer.start()
 
     def start(self) -> None:
         if self.state.is_running:
@@ -62,13 +81,16 @@ class RatesScheduler:
 
     def stop(self) -> None:
         self.state.is_running = False
-        t = self._timer
+        timers = (self._timer, self._warm_timer)
         self._timer = None
-        if t is not None:
-            try:
-                t.cancel()
-            except Exception:
-                pass
+        self._warm_timer = None
+        for t in timers:
+            if t is not None:
+                try:
+                    t.cancel()
+                except Exception:
+                    pass
+        # HTTP-сессии общие для процесса (демон, update-rates), поэтому планировщик их не закрывает.
         self.logger.info("Scheduler stopped")
 
 
@@ -1,26 +1,53 @@
 from __future__ import annotations
 
-import json
+import copy
 from dataclasses import dataclass
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any
+from typing import Iterator
 
+from valutatrade_hub.infra.repositories import get_repositories
 from valutatrade_hub.infra.settings import SettingsLoader
+from valutatrade_hub.parser_service.history_files import (
+    iter_source_history,
+    migrate_history_to_columnar,
+    migrate_history_to_jsonl,
+    migrate_history_to_segments,
+    open_rate_series,
+    rebuild_history_index,
+)
+from valutatrade_hub.parser_service.measurements import (
+    _normalize_code,
+    _normalize_timestamp,
+    _parse_dt,
+    make_measurement_id,
+    validate_measurement,
+)
 
 SETTINGS = SettingsLoader()
 
-
-def _project_root() -> Path:
-    return Path(SETTINGS.get("PROJECT_ROOT"))
-
-
-def _exchange_rates_path() -> Path:
-    p = SETTINGS.get("EXCHANGE_RATES_JSON", None)
-    if isinstance(p, str) and p.strip():
-        path = Path(p.strip())
-        return path if path.is_absolute() else (_project_root() / path)
-    return _project_root() / "data" / "exchange_rates.json"
+__all__ = [
+    "AppendResult",
+    "UpsertResult",
+    "append_measurement",
+    "append_measurements",
+    "get_rates_snapshot_pair",
+    "is_rates_snapshot_stale",
+    "iter_file_history",
+    "load_measurements",
+    "make_measurement_id",
+    "migrate_history_to_columnar",
+    "migrate_history_to_jsonl",
+    "migrate_history_to_segments",
+    "open_rate_series",
+    "read_rates_snapshot",
+    "rebuild_history_index",
+    "set_rates_last_refresh",
+    "shared_rates_snapshot",
+    "upsert_rates_snapshot_pair",
+    "upsert_rates_snapshot_pairs",
+    "validate_measurement",
+]
 
 
 def _rates_snapshot_path() -> Path:
@@ -40,199 +67,30 @@ def _now() -> datetime:
     return datetime.now(timezone.utc).replace(microsecond=0)
 
 
-def _format_dt(dt: datetime) -> str:
-    if dt.tzinfo is None:
-        dt = dt.replace(tzinfo=timezone.utc)
-    dt = dt.astimezone(timezone.utc).replace(microsecond=0)
-    return dt.strftime("%Y-%m-%dT%H:%M:%SZ")
-
-
-def _parse_dt(value: Any) -> datetime | None:
-    if isinstance(value, datetime):
-        dt = value
-        if dt.tzinfo is None:
-            dt = dt.replace(tzinfo=timezone.utc)
-        return dt.astimezone(timezone.utc).replace(microsecond=0)
-
-    if not isinstance(value, str) or not value.strip():
-        return None
-
-    s = value.strip()
-
-    if s.endswith("Z"):
-        s2 = s[:-1]
-        try:
-            dt = datetime.fromisoformat(s2)
-        except Exception:
-            return None
-        return dt.replace(tzinfo=timezone.utc).replace(microsecond=0)
-
-    try:
-        dt = datetime.fromisoformat(s)
-    except Exception:
-        try:
-            dt = datetime.strptime(s, "%Y-%m-%d %H:%M:%S")
-        except Exception:
-            return None
-
-    if dt.tzinfo is None:
-        dt = dt.replace(tzinfo=timezone.utc)
-    return dt.astimezone(timezone.utc).replace(microsecond=0)
-
-
-def _write_json_atomic(path: Path, data: Any) -> None:
-    path.parent.mkdir(parents=True, exist_ok=True)
-    tmp = path.with_suffix(path.suffix + ".tmp")
-    tmp.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
-    tmp.replace(path)
-
-
-def _read_json_list(path: Path) -> list[dict]:
-    if not path.exists():
-        return []
-    text = path.read_text(encoding="utf-8").strip()
-    if not text:
-        return []
-    try:
-        data = json.loads(text)
-    except Exception:
-        return []
-    if not isinstance(data, list):
-        return []
-    out = []
-    for x in data:
-        if isinstance(x, dict):
-            out.append(x)
-    return out
-
-
-def _read_json_dict(path: Path) -> dict:
-    if not path.exists():
-        return {}
-    text = path.read_text(encoding="utf-8").strip()
-    if not text:
-        return {}
-    try:
-        data = json.loads(text)
-    except Exception:
-        return {}
-    return data if isinstance(data, dict) else {}
-
-
-def _is_code(code: Any) -> bool:
-    if not isinstance(code, str):
-        return False
-    s = code.strip().upper()
-    if " " in s or not (2 <= len(s) <= 5) or not s.isalnum():
-        return False
-    return True
-
-
-def _normalize_code(code: Any) -> str:
-    if not _is_code(code):
-        raise ValueError("invalid currency code")
-    return str(code).strip().upper()
-
-
-def _normalize_timestamp(ts: Any) -> str:
-    if isinstance(ts, datetime):
-        dt = ts
-        if dt.tzinfo is None:
-            dt = dt.replace(tzinfo=timezone.utc)
-        dt = dt.astimezone(timezone.utc).replace(microsecond=0)
-        return _format_dt(dt)
-
-    if not isinstance(ts, str) or not ts.strip():
-        raise ValueError("invalid timestamp")
-
-    s = ts.strip()
-
-    if s.endswith("Z"):
-        dt = _parse_dt(s)
-        if dt is None:
-            raise ValueError("invalid timestamp")
-        return _format_dt(dt)
-
-    dt = _parse_dt(s)
-    if dt is None:
-        raise ValueError("invalid timestamp")
-    return _format_dt(dt)
-
-
-def make_measurement_id(from_currency: str, to_currency: str, timestamp_utc: str) -> str:
-    f = _normalize_code(from_currency)
-    t = _normalize_code(to_currency)
-    ts = _normalize_timestamp(timestamp_utc)
-    return f"{f}_{t}_{ts}"
-
-
-def validate_measurement(record: dict) -> dict:
-    if not isinstance(record, dict):
-        raise ValueError("record must be dict")
-
-    f = _normalize_code(record.get("from_currency"))
-    t = _normalize_code(record.get("to_currency"))
-    ts = _normalize_timestamp(record.get("timestamp"))
-
-    rate = record.get("rate")
-    if not isinstance(rate, (int, float)):
-        raise ValueError("rate invalid")
-    rate = float(rate)
-    if rate <= 0:
-        raise ValueError("rate invalid")
-
-    source = record.get("source")
-    if not isinstance(source, str) or not source.strip():
-        raise ValueError("source invalid")
-    source = source.strip()
-
-    meta = record.get("meta", {})
-    if meta is None:
-        meta = {}
-    if not isinstance(meta, dict):
-        raise ValueError("meta invalid")
-
-    expected_id = make_measurement_id(f, t, ts)
-    rec_id = record.get("id")
-    if rec_id is None or (isinstance(rec_id, str) and not rec_id.strip()):
-        rec_id = expected_id
-    if not isinstance(rec_id, str) or rec_id.strip() != expected_id:
-        raise ValueError("id invalid")
-
-    return {
-        "id": expected_id,
-        "from_currency": f,
-        "to_currency": t,
-        "rate": rate,
-        "timestamp": ts,
-        "source": source,
-        "meta": meta,
-    }
-
-
 @dataclass(frozen=True)
 class AppendResult:
     inserted: bool
     record: dict
 
 
-def append_measurement(record: dict) -> AppendResult:
-    valid = validate_measurement(record)
-    path = _exchange_rates_path()
+def append_measurements(records: list[dict], skip_invalid: bool = False) -> list[AppendResult]:
+    valid_items = []
+    for record in records:
+        try:
+            valid_items.append(validate_measurement(record))
+        except ValueError:
+            if not skip_invalid:
+                raise
 
-    items = _read_json_list(path)
-    seen = set()
-    for x in items:
-        rid = x.get("id") if isinstance(x, dict) else None
-        if isinstance(rid, str) and rid:
-            seen.add(rid)
+    if not valid_items:
+        return []
+
+    inserted = get_repositories().rates.append_measurements(valid_items)
+    return [AppendResult(inserted=ok, record=v) for ok, v in zip(inserted, valid_items)]
 
-    if valid["id"] in seen:
-        return AppendResult(inserted=False, record=valid)
 
-    items.append(valid)
-    _write_json_atomic(path, items)
-    return AppendResult(inserted=True, record=valid)
+def append_measurement(record: dict) -> AppendResult:
+    return append_measurements([record])[0]
 
 
 def load_measurements(
@@ -240,15 +98,17 @@ def load_measurements(
     to_currency: str | None = None,
     source: str | None = None,
     limit: int | None = None,
+    since: str | datetime | None = None,
+    until: str | datetime | None = None,
 ) -> list[dict]:
-    items = _read_json_list(_exchange_rates_path())
-
     fc = _normalize_code(from_currency) if isinstance(from_currency, str) and from_currency.strip() else None
     tc = _normalize_code(to_currency) if isinstance(to_currency, str) and to_currency.strip() else None
     src = source.strip() if isinstance(source, str) and source.strip() else None
+    ts_from = _normalize_timestamp(since) if since is not None else None
+    ts_to = _normalize_timestamp(until) if until is not None else None
 
     out = []
-    for x in items:
+    for x in get_repositories().rates.iter_measurements(fc, tc, since=ts_from, until=ts_to):
         if not isinstance(x, dict):
             continue
         try:
@@ -261,6 +121,10 @@ def load_measurements(
             continue
         if src is not None and v["source"] != src:
             continue
+        if ts_from is not None and v["timestamp"] < ts_from:
+            continue
+        if ts_to is not None and v["timestamp"] > ts_to:
+            continue
         out.append(v)
 
     out.sort(key=lambda r: r["timestamp"])
@@ -269,72 +133,129 @@ def load_measurements(
     return out
 
 
-def upsert_rates_snapshot_pair(
-    *,
-    from_currency: str,
-    to_currency: str,
-    rate: float,
-    updated_at: str | datetime,
-    source: str,
-) -> dict:
-    f = _normalize_code(from_currency)
-    t = _normalize_code(to_currency)
+def _rates_snapshot() -> dict:
+    # Общий закешированный снимок — только для чтения.
+    snap = get_repositories().rates.get_snapshot()
+    return snap if isinstance(snap, dict) else {}
+
+
+def read_rates_snapshot() -> dict:
+    return copy.deepcopy(_rates_snapshot())
+
+
+def shared_rates_snapshot() -> dict:
+    # Без копирования: объект меняется только вместе со снимком, поэтому читатели могут сравнивать
+    # его по identity. Изменять его нельзя — для правок есть read_rates_snapshot().
+    return _rates_snapshot()
+
+
+def _write_rates_snapshot(snap: dict) -> None:
+    get_repositories().rates.save_snapshot(snap)
+
+
+def iter_file_history() -> Iterator[dict]:
+    for x in iter_source_history():
+        try:
+            yield validate_measurement(x)
+        except Exception:
+            continue
+
 
+@dataclass(frozen=True)
+class UpsertResult:
+    accepted: int
+    updated: int
+    snapshot: dict
+
+
+def _validate_snapshot_pair(pair: dict) -> tuple[str, dict, datetime]:
+    if not isinstance(pair, dict):
+        raise ValueError("pair must be dict")
+
+    f = _normalize_code(pair.get("from_currency"))
+    t = _normalize_code(pair.get("to_currency"))
+
+    rate = pair.get("rate")
     if not isinstance(rate, (int, float)) or float(rate) <= 0:
         raise ValueError("rate invalid")
     rate = float(rate)
 
+    source = pair.get("source")
     if not isinstance(source, str) or not source.strip():
         raise ValueError("source invalid")
     source = source.strip()
 
-    ts = _normalize_timestamp(updated_at)
+    ts = _normalize_timestamp(pair.get("updated_at"))
     new_ts = _parse_dt(ts)
     if new_ts is None:
         raise ValueError("updated_at invalid")
 
-    path = _rates_snapshot_path()
-    snap = _read_json_dict(path)
-    if not isinstance(snap, dict):
-        snap = {}
+    return f"{f}_{t}", {"rate": rate, "updated_at": ts, "source": source}, new_ts
 
-    pairs = snap.get("pairs")
-    if not isinstance(pairs, dict):
-        pairs = {}
 
-    key = f"{f}_{t}"
-    current = pairs.get(key)
-    current_ts = _parse_dt(current.get("updated_at")) if isinstance(current, dict) else None
+def upsert_rates_snapshot_pairs(
+    pairs: list[dict],
+    last_refresh: str | datetime | None = None,
+    skip_invalid: bool = False,
+) -> UpsertResult:
+    valid_items = []
+    for pair in pairs:
+        try:
+            valid_items.append(_validate_snapshot_pair(pair))
+        except ValueError:
+            if not skip_invalid:
+                raise
 
-    if current_ts is not None and new_ts <= current_ts:
-        snap["pairs"] = pairs
-        return snap
+    refresh_ts = _normalize_timestamp(last_refresh) if last_refresh is not None else None
 
-    pairs[key] = {"rate": rate, "updated_at": ts, "source": source}
-    snap["pairs"] = pairs
-    _write_json_atomic(path, snap)
-    return snap
+    snap = read_rates_snapshot()
 
+    current_pairs = snap.get("pairs")
+    if not isinstance(current_pairs, dict):
+        current_pairs = {}
+    snap["pairs"] = current_pairs
 
-def set_rates_last_refresh(timestamp_utc: str | datetime | None = None) -> dict:
-    path = _rates_snapshot_path()
-    snap = _read_json_dict(path)
-    if not isinstance(snap, dict):
-        snap = {}
+    updated = 0
+    for key, value, new_ts in valid_items:
+        current = current_pairs.get(key)
+        current_ts = _parse_dt(current.get("updated_at")) if isinstance(current, dict) else None
+        if current_ts is not None and new_ts <= current_ts:
+            continue
+        current_pairs[key] = value
+        updated += 1
 
-    pairs = snap.get("pairs")
-    if not isinstance(pairs, dict):
-        pairs = {}
-    snap["pairs"] = pairs
+    if refresh_ts is not None:
+        snap["last_refresh"] = refresh_ts
+
+    if updated or refresh_ts is not None:
+        _write_rates_snapshot(snap)
+    return UpsertResult(accepted=len(valid_items), updated=updated, snapshot=snap)
 
-    ts = _normalize_timestamp(_now() if timestamp_utc is None else timestamp_utc)
-    snap["last_refresh"] = ts
-    _write_json_atomic(path, snap)
-    return snap
+
+def upsert_rates_snapshot_pair(
+    *,
+    from_currency: str,
+    to_currency: str,
+    rate: float,
+    updated_at: str | datetime,
+    source: str,
+) -> dict:
+    pair = {
+        "from_currency": from_currency,
+        "to_currency": to_currency,
+        "rate": rate,
+        "updated_at": updated_at,
+        "source": source,
+    }
+    return upsert_rates_snapshot_pairs([pair]).snapshot
+
+
+def set_rates_last_refresh(timestamp_utc: str | datetime | None = None) -> dict:
+    return upsert_rates_snapshot_pairs([], last_refresh=_now() if timestamp_utc is None else timestamp_utc).snapshot
 
 
 def is_rates_snapshot_stale() -> bool:
-    snap = _read_json_dict(_rates_snapshot_path())
+    snap = _rates_snapshot()
     if not isinstance(snap, dict):
         return True
 
@@ -350,7 +271,7 @@ def get_rates_snapshot_pair(from_currency: str, to_currency: str) -> dict | None
     f = _normalize_code(from_currency)
     t = _normalize_code(to_currency)
 
-    snap = _read_json_dict(_rates_snapshot_path())
+    snap = _rates_snapshot()
     pairs = snap.get("pairs")
     if not isinstance(pairs, dict):
         return None
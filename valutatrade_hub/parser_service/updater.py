@@ -1,12 +1,18 @@
 from __future__ import annotations
 
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from dataclasses import dataclass
 from datetime import datetime, timezone
+from pathlib import Path
+from time import perf_counter
 from typing import Any
 
 from valutatrade_hub.core.exceptions import ApiRequestError
+from valutatrade_hub.infra.settings import SettingsLoader
 from valutatrade_hub.parser_service.api_clients import BaseApiClient
+from valutatrade_hub.parser_service.circuit_breaker import BreakerStore, CircuitBreaker
 
 
 def _utc_ts() -> str:
@@ -33,25 +39,106 @@ class ClientSpec:
     client: BaseApiClient
 
 
+@dataclass
+class FetchOutcome:
+    spec: ClientSpec
+    data: Any = None
+    error: BaseException | None = None
+    latency_ms: float | None = None
+    skipped: bool = False
+
+
+def _timed_fetch(client: BaseApiClient) -> tuple[Any, BaseException | None, float]:
+    started = perf_counter()
+    try:
+        data = client.fetch_rates()
+    except Exception as e:
+        return None, e, (perf_counter() - started) * 1000
+    return data, None, (perf_counter() - started) * 1000
+
+
 class RatesUpdater:
-    def __init__(self, clients: list[ClientSpec], storage: Any):
+    def __init__(
+        self,
+        clients: list[ClientSpec],
+        storage: Any,
+        deadline_seconds: float | None = None,
+        health_path: str | Path | None = None,
+    ):
         self.clients = clients
         self.storage = storage
+        settings = SettingsLoader()
+        if deadline_seconds is None:
+            deadline_seconds = settings.get("UPDATE_DEADLINE_SECONDS", 15)
+        self.deadline_seconds = float(deadline_seconds)
+        self.breakers = BreakerStore(health_path if health_path is not None else settings.get("PROVIDER_HEALTH_JSON", None))
         self.logger = logging.getLogger("valutatrade.parser.updater")
 
+    def warm_up(self, at: float | None = None) -> None:
+        # Прогреваются только источники, к которым в момент at (ближайший тик) пойдёт запрос:
+        # с открытым предохранителем или свежим ответом в кеше соединение не понадобится.
+        at = time.time() if at is None else at
+        breakers = self.breakers.load([spec.name for spec in self.clients])
+        for spec in self.clients:
+            if breakers[spec.name].is_open(at):
+                continue
+            fresh = getattr(spec.client, "cache_fresh", None)
+            if callable(fresh) and fresh(at):
+                continue
+            warm = getattr(spec.client, "warm_up", None)
+            if callable(warm):
+                warm()
+
+    def _fetch_all(self, breakers: dict[str, CircuitBreaker]) -> list[FetchOutcome]:
+        # Все клиенты опрашиваются одновременно, общее ожидание ограничено deadline_seconds; клиенты
+        # с открытым предохранителем пропускаются сразу. Результаты возвращаются в порядке self.clients,
+        # поэтому слияние совпадает с последовательным опросом.
+        outcomes = [FetchOutcome(spec, skipped=not breakers[spec.name].allow()) for spec in self.clients]
+        active = [o for o in outcomes if not o.skipped]
+        if not active:
+            return outcomes
+        pool = ThreadPoolExecutor(max_workers=len(active), thread_name_prefix="rates-fetch")
+        try:
+            futures = []
+            for o in active:
+                self.logger.info(f"{_utc_ts()} UPDATE_RATES client_start source='{o.spec.name}'")
+                futures.append(pool.submit(_timed_fetch, o.spec.client))
+            wait(futures, timeout=self.deadline_seconds)
+        finally:
+            # Зависший запрос не держит обновление: его поток завершится сам по REQUEST_TIMEOUT.
+            pool.shutdown(wait=False, cancel_futures=True)
+
+        for o, fut in zip(active, futures):
+            if fut.done():
+                o.data, o.error, o.latency_ms = fut.result()
+            else:
+                o.error = ApiRequestError(f"deadline {self.deadline_seconds:g}s exceeded")
+                o.latency_ms = self.deadline_seconds * 1000
+        return outcomes
+
     def run_update(self) -> dict[str, Any]:
         ts = _utc_ts()
-        self.logger.info(f"{ts} UPDATE_RATES start clients={len(self.clients)}")
+        self.logger.info(f"{ts} UPDATE_RATES start clients={len(self.clients)} deadline={self.deadline_seconds:g}s")
 
         combined: dict[str, float] = {}
         per_source: dict[str, str] = {}
         client_results: list[dict[str, Any]] = []
 
-        for spec in self.clients:
-            started_ts = _utc_ts()
+        breakers = self.breakers.load([spec.name for spec in self.clients])
+        for outcome in self._fetch_all(breakers):
+            spec, data, error = outcome.spec, outcome.data, outcome.error
+            breaker = breakers[spec.name]
+            if outcome.skipped:
+                until = datetime.fromtimestamp(breaker.open_until, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+                self.logger.info(f"{_utc_ts()} UPDATE_RATES client_skipped source='{spec.name}' breaker=open until={until}")
+                client_results.append(
+                    {"source": spec.name, "status": "SKIPPED", "error_message": f"circuit open until {until}", "breaker": breaker.stats()}
+                )
+                continue
+            latency_ms = round(outcome.latency_ms or 0.0, 1)
             try:
-                self.logger.info(f"{started_ts} UPDATE_RATES client_start source='{spec.name}'")
-                data = spec.client.fetch_rates()
+                if error is not None:
+                    raise error
                 if not isinstance(data, dict):
                     raise ApiRequestError("client returned non-dict")
 
@@ -67,26 +154,43 @@ class RatesUpdater:
                     per_source[key] = spec.name
                     ok += 1
 
+                breaker.record(True, latency_ms)
                 done_ts = _utc_ts()
-                self.logger.info(f"{done_ts} UPDATE_RATES client_ok source='{spec.name}' pairs={ok}")
-                client_results.append({"source": spec.name, "status": "OK", "pairs": ok})
+                self.logger.info(f"{done_ts} UPDATE_RATES client_ok source='{spec.name}' pairs={ok} latency_ms={latency_ms}")
+                client_results.append(
+                    {"source": spec.name, "status": "OK", "pairs": ok, "latency_ms": latency_ms, "breaker": breaker.stats()}
+                )
             except Exception as e:
+                breaker.record(False, latency_ms)
                 err_ts = _utc_ts()
                 self.logger.info(
                     f"{err_ts} UPDATE_RATES source='{spec.name}' error_type={type(e).__name__} error_message='{str(e).replace(chr(10), ' ').strip()}'"
+                    f" breaker={breaker.state}"
                 )
                 client_results.append(
-                    {"source": spec.name, "status": "ERROR", "error_type": type(e).__name__, "error_message": str(e)}
+                    {
+                        "source": spec.name,
+                        "status": "ERROR",
+                        "error_type": type(e).__name__,
+                        "error_message": str(e),
+                        "latency_ms": latency_ms,
+                        "breaker": breaker.stats(),
+                    }
                 )
                 continue
 
+        try:
+            self.breakers.save(breakers)
+        except Exception as e:
+            self.logger.info(f"{_utc_ts()} UPDATE_RATES breakers error_type={type(e).__name__} error_message='{str(e)}'")
+
         if not combined:
             end_ts = _utc_ts()
             self.logger.info(f"{end_ts} UPDATE_RATES end result=ERROR error_type=ApiRequestError error_message='no rates collected'")
             raise ApiRequestError("no rates collected")
 
-        inserted_history = 0
-        updated_pairs = 0
+        records: list[dict[str, Any]] = []
+        snapshot_pairs: list[dict[str, Any]] = []
 
         for pair_key, rate in combined.items():
             try:
@@ -95,39 +199,39 @@ class RatesUpdater:
                 continue
 
             source = per_source.get(pair_key, "UNKNOWN")
+            records.append(
+                {
+                    "from_currency": f,
+                    "to_currency": t,
+                    "rate": rate,
+                    "timestamp": ts,
+                    "source": source,
+                    "meta": {},
+                }
+            )
+            snapshot_pairs.append(
+                {
+                    "from_currency": f,
+                    "to_currency": t,
+                    "rate": rate,
+                    "updated_at": ts,
+                    "source": source,
+                }
+            )
 
-            try:
-                r = self.storage.append_measurement(
-                    {
-                        "from_currency": f,
-                        "to_currency": t,
-                        "rate": rate,
-                        "timestamp": ts,
-                        "source": source,
-                        "meta": {},
-                    }
-                )
-                if getattr(r, "inserted", False):
-                    inserted_history += 1
-            except Exception:
-                pass
-
-            try:
-                self.storage.upsert_rates_snapshot_pair(
-                    from_currency=f,
-                    to_currency=t,
-                    rate=rate,
-                    updated_at=ts,
-                    source=source,
-                )
-                updated_pairs += 1
-            except Exception:
-                continue
+        inserted_history = 0
+        try:
+            results = self.storage.append_measurements(records, skip_invalid=True)
+            inserted_history = sum(1 for r in results if getattr(r, "inserted", False))
+        except Exception as e:
+            self.logger.info(f"{_utc_ts()} UPDATE_RATES history error_type={type(e).__name__} error_message='{str(e)}'")
 
+        updated_pairs = 0
         try:
-            self.storage.set_rates_last_refresh(ts)
-        except Exception:
-            pass
+            upsert = self.storage.upsert_rates_snapshot_pairs(snapshot_pairs, last_refresh=ts, skip_invalid=True)
+            updated_pairs = int(getattr(upsert, "accepted", 0))
+        except Exception as e:
+            self.logger.info(f"{_utc_ts()} UPDATE_RATES snapshot error_type={type(e).__name__} error_message='{str(e)}'")
 
         end_ts = _utc_ts()
         self.logger.info(